@@ -18,7 +18,7 @@
 import re, unicodedata
 import arabiclib
 from arabiclib import *
-from blib import remove_links, msg
+from blib import remove_links, msg, translit_memoized
 
 # FIXME!! To do:
 #
@@ -44,18 +44,24 @@ def uniprint(x):
 def uniout(x):
   print x.encode('utf-8'),
 
+# Return a function for use as the replacement in re.sub() that replaces
+# the first group of the match (or the whole match if no groups) according
+# to the dict TO, leaving it alone if not in TO.
+def dict_replacement(to):
+    def rsub_replace(m):
+        try:
+            g = m.group(1)
+        except IndexError:
+            g = m.group(0)
+        if g in to:
+            return to[g]
+        else:
+            return g
+    return rsub_replace
+
 def rsub(text, fr, to):
     if type(to) is dict:
-        def rsub_replace(m):
-            try:
-                g = m.group(1)
-            except IndexError:
-                g = m.group(0)
-            if g in to:
-                return to[g]
-            else:
-                return g
-        return re.sub(fr, rsub_replace, text)
+        return re.sub(fr, dict_replacement(to), text)
     else:
         return re.sub(fr, to, text)
 
@@ -196,87 +202,118 @@ before_diacritic_checking_subs = [
     [u"l-[" + sun_letters + "]", ttsun2]
 ]
 
-# Transliterate the word(s) in TEXT. LANG (the language) and SC (the script)
-# are ignored. OMIT_I3RAAB means leave out final short vowels (ʾiʿrāb).
-# GRAY_I3RAAB means render transliterate short vowels (ʾiʿrāb) in gray.
-# FORCE_TRANSLATE causes even non-vocalized text to be transliterated
-# (normally the function checks for non-vocalized text and returns nil,
-# since such text is ambiguous in transliteration).
-def tr(text, lang=None, sc=None, omit_i3raab=False, gray_i3raab=False,
-        force_translate=False, msgfun=msg):
-    for sub in before_diacritic_checking_subs:
-        text = rsub(text, sub[0], sub[1])
+# Compile SUBS, a list of [FROM, TO] substitutions of the form taken by
+# rsub(), into a list of functions that each make one of the substitutions,
+# so the regexes are compiled once rather than looked up on every call. A
+# dict substitution of single characters for u"." is done with
+# unicode.translate() rather than a callback per character.
+def compile_subs(subs):
+    steps = []
+    for fr, to in subs:
+        if (fr == u"." and type(to) is dict and u"\n" not in to and
+                all(len(ch) == 1 for ch in to)):
+            table = dict((ord(ch), unicode(repl)) for ch, repl in to.items())
+            steps.append(lambda text, table=table: text.translate(table))
+        else:
+            if type(to) is dict:
+                to = dict_replacement(to)
+            steps.append(lambda text, regex=re.compile(fr), to=to:
+                regex.sub(to, text))
+    return steps
+
+def apply_subs(text, steps):
+    for step in steps:
+        text = step(text)
+    return text
 
-    if not force_translate and not has_diacritics(text):
-        return None
+tr_before_diacritic_checking_subs = compile_subs(
+        before_diacritic_checking_subs)
 
-    ############# transformations after checking for diacritics ##############
+############# transformations after checking for diacritics ##############
+tr_long_vowel_subs = compile_subs([
     # Replace plain alif with hamzatu l-waṣl when followed by fatḥa/ḍamma/kasra.
     # Must go after handling of initial al-, which distinguishes alif-fatḥa
     # from alif w/hamzatu l-waṣl. Must go before generation of ū and ī, which
     # eliminate the ḍamma/kasra.
-    text = rsub(text, u"\u0627([\u064E\u064F\u0650])", u"\u0671\\1")
+    [u"\u0627([\u064E\u064F\u0650])", u"\u0671\\1"],
     # ḍamma + waw not followed by a diacritic is ū, otherwise w
-    text = rsub(text, u"\u064F\u0648([^\u064B\u064C\u064D\u064E\u064F\u0650\u0651\u0652\u0670])", u"ū\\1")
-    text = rsub(text, u"\u064F\u0648$", u"ū")
+    [u"\u064F\u0648([^\u064B\u064C\u064D\u064E\u064F\u0650\u0651\u0652\u0670])", u"ū\\1"],
+    [u"\u064F\u0648$", u"ū"],
     # kasra + yaa not followed by a diacritic (or ū from prev step) is ī, otherwise y
-    text = rsub(text, u"\u0650\u064A([^\u064B\u064C\u064D\u064E\u064F\u0650\u0651\u0652\u0670ū])", u"ī\\1")
-    text = rsub(text, u"\u0650\u064A$", u"ī")
+    [u"\u0650\u064A([^\u064B\u064C\u064D\u064E\u064F\u0650\u0651\u0652\u0670ū])", u"ī\\1"],
+    [u"\u0650\u064A$", u"ī"],
     # convert shadda to double letter.
-    text = rsub(text, u"(.)\u0651", u"\\1\\1")
-    if not omit_i3raab and gray_i3raab: # show ʾiʿrāb grayed in transliteration
-        # decide whether to gray out the t in ة. If word begins with al-, yes.
-        # Otherwise, no if word ends in a/i/u, yes if ends in an/in/un.
-        text = rsub(text, u"((?:^|\\s)a?l-[^\\s]+)\u0629([\u064B\u064C\u064D\u064E\u064F\u0650])",
-            u"\\1<span style=\"color: #888888\">t</span>\\2")
-        text = rsub(text, u"\u0629([\u064E\u064F\u0650])", u"t\\1")
-        text = rsub(text, u"\u0629([\u064B\u064C\u064D])",
-            u"<span style=\"color: #888888\">t</span>\\1")
-        text = rsub(text, u".", {
-            u"\u064B":u"<span style=\"color: #888888\">an</span>",
-            u"\u064D":u"<span style=\"color: #888888\">in</span>",
-            u"\u064C":u"<span style=\"color: #888888\">un</span>"
-        })
-        text = rsub(text, u"([\u064E\u064F\u0650])\\s", {
-            u"\u064E":u"<span style=\"color: #888888\">a</span> ",
-            u"\u0650":u"<span style=\"color: #888888\">i</span> ",
-            u"\u064F":u"<span style=\"color: #888888\">u</span> "
-        })
-        text = rsub(text, u"[\u064E\u064F\u0650]$", {
-            u"\u064E":u"<span style=\"color: #888888\">a</span>",
-            u"\u0650":u"<span style=\"color: #888888\">i</span>",
-            u"\u064F":u"<span style=\"color: #888888\">u</span>"
-        })
-        text = rsub(text, u"</span><span style=\"color: #888888\">", u"")
-    elif omit_i3raab: # omit ʾiʿrāb in transliteration
-        text = rsub(text, u"[\u064B\u064C\u064D]", u"")
-        text = rsub(text, u"[\u064E\u064F\u0650]\\s", u" ")
-        text = rsub(text, u"[\u064E\u064F\u0650]$", u"")
+    [u"(.)\u0651", u"\\1\\1"],
+])
+
+# show ʾiʿrāb grayed in transliteration
+tr_gray_i3raab_subs = compile_subs([
+    # decide whether to gray out the t in ة. If word begins with al-, yes.
+    # Otherwise, no if word ends in a/i/u, yes if ends in an/in/un.
+    [u"((?:^|\\s)a?l-[^\\s]+)\u0629([\u064B\u064C\u064D\u064E\u064F\u0650])",
+        u"\\1<span style=\"color: #888888\">t</span>\\2"],
+    [u"\u0629([\u064E\u064F\u0650])", u"t\\1"],
+    [u"\u0629([\u064B\u064C\u064D])",
+        u"<span style=\"color: #888888\">t</span>\\1"],
+    [u".", {
+        u"\u064B":u"<span style=\"color: #888888\">an</span>",
+        u"\u064D":u"<span style=\"color: #888888\">in</span>",
+        u"\u064C":u"<span style=\"color: #888888\">un</span>"
+    }],
+    [u"([\u064E\u064F\u0650])\\s", {
+        u"\u064E":u"<span style=\"color: #888888\">a</span> ",
+        u"\u0650":u"<span style=\"color: #888888\">i</span> ",
+        u"\u064F":u"<span style=\"color: #888888\">u</span> "
+    }],
+    [u"[\u064E\u064F\u0650]$", {
+        u"\u064E":u"<span style=\"color: #888888\">a</span>",
+        u"\u0650":u"<span style=\"color: #888888\">i</span>",
+        u"\u064F":u"<span style=\"color: #888888\">u</span>"
+    }],
+    [u"</span><span style=\"color: #888888\">", u""],
+])
+
+# omit ʾiʿrāb in transliteration
+tr_omit_i3raab_subs = compile_subs([
+    [u"[\u064B\u064C\u064D]", u""],
+    [u"[\u064E\u064F\u0650]\\s", u" "],
+    [u"[\u064E\u064F\u0650]$", u""],
+])
+
+tr_final_taa_subs = compile_subs([
     # tāʾ marbūṭa should not be rendered by -t if word-final even when
     # ʾiʿrāb (desinential inflection) is shown; instead, use (t) before
     # whitespace, nothing when final; but render final -اة and -آة as -āh,
     # consistent with Wehr's dictionary
-    text = rsub(text, u"([\u0627\u0622])\u0629$", u"\\1h")
+    [u"([\u0627\u0622])\u0629$", u"\\1h"],
     # Ignore final tāʾ marbūṭa (it appears as "a" due to the preceding
     # short vowel). Need to do this after graying or omitting word-final
     # ʾiʿrāb.
-    text = rsub(text, u"\u0629$", u"")
-    if not omit_i3raab: # show ʾiʿrāb in transliteration
-        text = rsub(text, u"\u0629\\s", u"(t) ")
-    else:
-        # When omitting ʾiʿrāb, show all non-absolutely-final instances of
-        # tāʾ marbūṭa as (t), with trailing ʾiʿrāb omitted.
-        text = rsub(text, u"\u0629", u"(t)")
+    [u"\u0629$", u""],
+])
+
+# show ʾiʿrāb in transliteration
+tr_show_i3raab_taa_subs = compile_subs([
+    [u"\u0629\\s", u"(t) "],
+])
+
+# When omitting ʾiʿrāb, show all non-absolutely-final instances of
+# tāʾ marbūṭa as (t), with trailing ʾiʿrāb omitted.
+tr_omit_i3raab_taa_subs = compile_subs([
+    [u"\u0629", u"(t)"],
+])
+
+tr_final_subs = compile_subs([
     # tatwīl should be rendered as - at beginning or end of word. It will
     # be rendered as nothing in the middle of a word (FIXME, do we want
     # this?)
-    text = rsub(text, u"^ـ", "-")
-    text = rsub(text, u"\\sـ", " -")
-    text = rsub(text, u"ـ$", "-")
-    text = rsub(text, u"ـ\\s", "- ")
+    [u"^ـ", "-"],
+    [u"\\sـ", " -"],
+    [u"ـ$", "-"],
+    [u"ـ\\s", "- "],
     # Now convert remaining Arabic chars according to table.
-    text = rsub(text, u".", tt)
-    text = rsub(text, u"aā", u"ā")
+    [u".", tt],
+    [u"aā", u"ā"],
     # Implement elision of al- after a final vowel. We do this
     # conservatively, only handling elision of the definite article rather
     # than elision in other cases of hamzat al-waṣl (e.g. form-I imperatives
@@ -284,15 +321,39 @@ def tr(text, lang=None, sc=None, omit_i3raab=False, gray_i3raab=False,
     # these cases isn't so common in MSA and partly to avoid excessive
     # elision in case of words written with initial bare alif instead of
     # properly with hamzated alif. Possibly we should reconsider.
-    # At the very least we currently don't handle elision of الَّذِي (allaḏi)
+    # At the very least we currently don't handle elision of الَّذِي (allaḏi)
     # correctly because we special-case it to appear without the hyphen;
     # perhaps we should reconsider that.
-    text = rsub(text, u"([aiuāīū](?:</span>)?) a([" + sun_letters_tr + "]-)",
-        u"\\1 \\2")
+    [u"([aiuāīū](?:</span>)?) a([" + sun_letters_tr + "]-)", u"\\1 \\2"],
     # Special-case the transliteration of allāh, without the hyphen
-    text = rsub(text, u"(^|\\s)(a?)l-lāh", u"\\1\\2llāh")
+    [u"(^|\\s)(a?)l-lāh", u"\\1\\2llāh"],
+])
 
-    return text
+# Transliterate the word(s) in TEXT. LANG (the language) and SC (the script)
+# are ignored. OMIT_I3RAAB means leave out final short vowels (ʾiʿrāb).
+# GRAY_I3RAAB means render transliterate short vowels (ʾiʿrāb) in gray.
+# FORCE_TRANSLATE causes even non-vocalized text to be transliterated
+# (normally the function checks for non-vocalized text and returns nil,
+# since such text is ambiguous in transliteration).
+@translit_memoized
+def tr(text, lang=None, sc=None, omit_i3raab=False, gray_i3raab=False,
+        force_translate=False, msgfun=msg):
+    text = apply_subs(text, tr_before_diacritic_checking_subs)
+
+    if not force_translate and not has_diacritics(text):
+        return None
+
+    text = apply_subs(text, tr_long_vowel_subs)
+    if not omit_i3raab and gray_i3raab:
+        text = apply_subs(text, tr_gray_i3raab_subs)
+    elif omit_i3raab:
+        text = apply_subs(text, tr_omit_i3raab_subs)
+    text = apply_subs(text, tr_final_taa_subs)
+    if not omit_i3raab:
+        text = apply_subs(text, tr_show_i3raab_taa_subs)
+    else:
+        text = apply_subs(text, tr_omit_i3raab_taa_subs)
+    return apply_subs(text, tr_final_subs)
 
 has_diacritics_subs = [
     # FIXME! What about lam-alif ligature?
@@ -329,10 +390,85 @@ has_diacritics_subs = [
     [u"[^\u0600-\u06FF\u0750-\u077F\u08A1-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF]", u""]
 ]
 
+# Character classes for has_diacritics(), one ASCII letter per class:
+# c = consonant needing a vowel, w = wāw, y = yāʾ, A = alif,
+# M = alif maqṣūra, u = ḍamma, i = kasra, a = fatḥa, n = fatḥatān,
+# d = other diacritic (ḍammatān, kasratān, sukūn, dagger alif),
+# s = whitespace or dash/hyphen, L = newline, N = number, hamzatu l-waṣl or
+# alif madda, X = any other Arabic character. Punctuation and shadda are
+# deleted, and non-Arabic characters are mapped to themselves (or to "." if
+# they are one of the class letters), so that anything not a class letter
+# counts as non-Arabic.
+def build_diacritic_class_table():
+    table = {}
+    for lo, hi in [(0x0600, 0x06FF), (0x0750, 0x077F), (0x08A1, 0x08FF),
+            (0xFB50, 0xFDFF), (0xFE70, 0xFEFF)]:
+        for cp in xrange(lo, hi + 1):
+            table[cp] = u"X"
+    for ch in u"cwyAMuiandsLNX":
+        table[ord(ch)] = u"."
+    for chars, cls in [(consonants_needing_vowels, u"c"), (u"\u0648", u"w"),
+            (u"\u064A", u"y"), (u"\u0627", u"A"), (u"\u0649", u"M"),
+            (u"\u064F", u"u"), (u"\u0650", u"i"), (u"\u064E", u"a"),
+            (u"\u064B", u"n"), (u"\u064C\u064D\u0652\u0670", u"d"),
+            (u" \t\r\f\v-–", u"s"), (u"\n", u"L"),
+            (numbers + u"ٱ" + u"آ", u"N"),
+            (punctuation + u"\u0651", None)]:
+        for ch in chars:
+            table[ord(ch)] = cls
+    return table
+
+diacritic_class_table = build_diacritic_class_table()
+
+# The steps of has_diacritics_subs on the text of classes, as regexes whose
+# matches are removed. The first combines removing consonants at the end of
+# a word or utterance (two of them before a final newline, as the "$" in
+# has_diacritics_subs then matches before the newline and the consonant
+# before it is left followed by whitespace) and consonants or alif followed
+# by diacritics; then come removing ḍamma + wāw, kasra + yāʾ, and
+# fatḥa/fatḥatān + alif/alif maqṣūra, each on the result of the one before.
+# What is left unvocalized are the class letters in
+# unvocalized_class_re; diacritics, numbers etc. and non-Arabic characters
+# are removed by the remaining steps.
+has_diacritics_class_res = [
+    re.compile(u"[cwyA](?=[uiand])|[cwy](?=[sL])|[cwy]{1,2}(?=L\\Z)|[cwy]\\Z"),
+    re.compile(u"uw"),
+    re.compile(u"iy"),
+    re.compile(u"[an][AM]"),
+]
+unvocalized_class_re = re.compile(u"[cwyAMX]")
+
+# Return True if TEXT is fully vocalized, i.e. every Arabic consonant has a
+# diacritic (or is word-final) and every alif, wāw, yāʾ or alif maqṣūra is
+# either vocalized or a long vowel. Equivalent to applying
+# has_diacritics_subs and checking that nothing is left, but done on a
+# string of character classes, which is much faster.
 def has_diacritics(text):
-    for sub in has_diacritics_subs:
-        text = rsub(text, sub[0], sub[1])
-    return len(text) == 0
+    classes = text.translate(diacritic_class_table)
+    for regex in has_diacritics_class_res:
+        classes = regex.sub(u"", classes)
+    return not unvocalized_class_re.search(classes)
+
+# Return a list of the positions in TEXT of the characters that keep it from
+# being fully vocalized (see has_diacritics()), which is empty if it is.
+def unvocalized_positions(text):
+    classes = []
+    positions = []
+    for pos, ch in enumerate(text):
+        cls = ch.translate(diacritic_class_table)
+        if cls:
+            classes.append(cls)
+            positions.append(pos)
+    classes = u"".join(classes)
+    for regex in has_diacritics_class_res:
+        keep = [True] * len(classes)
+        for m in regex.finditer(classes):
+            for i in xrange(m.start(), m.end()):
+                keep[i] = False
+        classes = u"".join(cls for cls, k in zip(classes, keep) if k)
+        positions = [pos for pos, k in zip(positions, keep) if k]
+    return [pos for cls, pos in zip(classes, positions)
+            if unvocalized_class_re.match(cls)]
 
 
 ############################################################################
@@ -779,6 +915,7 @@ def post_canonicalize_latin(text):
 # is more reliable when both aare provided. This is less reliable than
 # tr_matching() and is meant when that fails. Return value is a tuple of
 # (CANONLATIN, CANONARABIC).
+@translit_memoized
 def canonicalize_latin_arabic(latin, arabic, msgfun=msg):
     if arabic is not None:
         arabic = pre_pre_canonicalize_arabic(arabic, msgfun=msgfun)
@@ -988,6 +1125,7 @@ debug_tr_matching = False
 # the right places, so that ambiguities of Latin transliteration can be
 # correctly handled. Returns a tuple of Arabic, Latin. If unable to match,
 # throw an error if ERR, else return None.
+@translit_memoized
 def tr_matching(arabic, latin, err=False, msgfun=msg):
     origarabic = arabic
     origlatin = latin
@@ -1004,17 +1142,13 @@ def tr_matching(arabic, latin, err=False, msgfun=msg):
 
     ar = [] # exploded Arabic characters
     la = [] # exploded Latin characters
-    res = [] # result Arabic characters
-    lres = [] # result Latin characters
     for cp in arabic:
         ar.append(cp)
     for cp in latin:
         la.append(cp)
     debprint("Arabic characters: %s" % ar)
     debprint("Latin characters: %s" % la)
-    aind = [0] # index of next Arabic character
     alen = len(ar)
-    lind = [0] # index of next Latin character
     llen = len(la)
 
     # Find occurrences of al- in Arabic text and note characte pos's after.
@@ -1028,23 +1162,28 @@ def tr_matching(arabic, latin, err=False, msgfun=msg):
             A + "?" + L + SK + "?", arabic):
         after_al_pos.append(m.end(0))
 
-    def is_bow(pos=None):
-        if pos is None:
-            pos = aind[0]
+    def is_bow(pos):
         return (pos == 0 or ar[pos - 1] in [u" ", u"[", u"|"] or
                 pos in after_al_pos)
 
     # True if we are at the last character in a word.
-    def is_eow(pos=None):
-        if pos is None:
-            pos = aind[0]
+    def is_eow(pos):
         return pos == alen - 1 or ar[pos + 1] in [u" ", u"]", u"|"]
 
-    def get_matches():
-        ac = ar[aind[0]]
+    # The matching is a search through a lattice whose states are pairs
+    # (AIND, LIND) of the index of the next Arabic character and the index
+    # of the next Latin character. Each of the ways of matching below
+    # yields steps (or "edges") from a state, each a tuple (NEWAIND,
+    # NEWLIND, ARABIC, LATIN, MESSAGE) of the new state, the Arabic and
+    # Latin characters to add to the result and a message to output (or
+    # None) if the step is taken. Every step advances at least one of the
+    # indices, so the lattice has no cycles.
+
+    def get_matches(aind):
+        ac = ar[aind]
         debprint("get_matches: ac is %s" % ac)
-        bow = is_bow()
-        eow = is_eow()
+        bow = is_bow(aind)
+        eow = is_eow(aind)
 
         # Special-case handling of the lām that gets assimilated to a sun
         # letter in transliteration. We build up the list of possible
@@ -1052,8 +1191,8 @@ def tr_matching(arabic, latin, err=False, msgfun=msg):
         # should be a sun letter. We put "l" as a secondary match so that
         # something like al-nūr will get recognized and converted to an-nūr.
         if ac == assimilating_l_subst:
-            assert aind[0] < alen - 1
-            sunlet = ar[aind[0] + 1]
+            assert aind < alen - 1
+            sunlet = ar[aind + 1]
             assert sunlet in sun_letters
             matches = [ttsun1[sunlet], "l"]
         else:
@@ -1067,37 +1206,34 @@ def tr_matching(arabic, latin, err=False, msgfun=msg):
                 return []
             if True:
                 error("Encountered non-Arabic (?) character " + ac +
-                    " at index " + str(aind[0]))
+                    " at index " + str(aind))
             else:
                 matches = [ac]
         if type(matches) is not list:
             matches = [matches]
         return matches
 
-    # attempt to match the current Arabic character against the current
-    # Latin character(s). If no match, return False; else, increment the
-    # Arabic and Latin pointers over the matched characters, add the Arabic
-    # character to the result characters and return True.
-    def match():
-        matches = get_matches()
+    # Match the current Arabic character against the current Latin
+    # character(s), yielding a step for each of the possible matches that
+    # matches, in order.
+    def match(aind, lind):
+        matches = get_matches(aind)
 
-        ac = ar[aind[0]]
+        ac = ar[aind]
 
         # Check for link of the form [[foo|bar]] and skip over the part
         # up through the vertical bar, copying it
         if ac == '[':
-            newpos = aind[0]
+            newpos = aind
             while newpos < alen and ar[newpos] != ']':
                 if ar[newpos] == '|':
                     newpos += 1
-                    while aind[0] < newpos:
-                        res.append(ar[aind[0]])
-                        aind[0] += 1
-                    return True
+                    yield (newpos, lind, u"".join(ar[aind:newpos]), u"", None)
+                    return
                 newpos += 1
 
         debprint("match: lind=%s, la=%s" % (
-            lind[0], lind[0] >= llen and "EOF" or la[lind[0]]))
+            lind, lind >= llen and "EOF" or la[lind]))
 
         for m in matches:
             preserve_latin = False
@@ -1110,153 +1246,100 @@ def tr_matching(arabic, latin, err=False, msgfun=msg):
             # not here.
             elif type(m) is tuple:
                 m = m[0]
-            l = lind[0]
-            matched = True
             debprint("m: %s" % m)
-            for cp in m:
-                if l < llen and la[l] == cp:
-                    debprint("cp: %s, l=%s, la=%s" % (cp, l, la[l]))
-                    l = l + 1
-                else:
-                    debprint("cp: %s, unmatched")
-                    matched = False
-                    break
-            if matched:
-                res.append(ac)
+            if latin.startswith(m, lind):
                 if preserve_latin:
-                    for cp in m:
-                        lres.append(cp)
+                    lres = m
                 elif ac == u"ة":
-                    if not is_eow():
-                        lres.append(u"t")
-                    elif aind[0] > 0 and (ar[aind[0] - 1] == u"ا" or
-                            ar[aind[0] - 1] == u"آ"):
-                        lres.append(u"h")
-                    # else do nothing
+                    if not is_eow(aind):
+                        lres = u"t"
+                    elif aind > 0 and (ar[aind - 1] == u"ا" or
+                            ar[aind - 1] == u"آ"):
+                        lres = u"h"
+                    else:
+                        lres = u""
                 else:
                     subst = matches[0]
                     if type(subst) is list or type(subst) is tuple:
                         subst = subst[0]
-                    for cp in subst:
-                        lres.append(cp)
-                lind[0] = l
-                aind[0] = aind[0] + 1
-                debprint("matched; lind is %s" % lind[0])
-                return True
-        return False
-
-    def cant_match():
-        if aind[0] < alen and lind[0] < llen:
-            error("Unable to match Arabic character %s at index %s, Latin character %s at index %s" %
-                (ar[aind[0]], aind[0], la[lind[0]], lind[0]))
-        elif aind[0] < alen:
-            error("Unable to match trailing Arabic character %s at index %s" %
-                (ar[aind[0]], aind[0]))
-        else:
-            error("Unable to match trailing Latin character %s at index %s" %
-                (la[lind[0]], lind[0]))
+                    lres = subst
+                yield (aind + 1, lind + len(m), ac, lres, None)
 
     # Check for an unmatched Latin short vowel or similar; if so, insert
     # corresponding Arabic diacritic.
-    def check_unmatching():
-        if not (lind[0] < llen):
-            return False
-        debprint("Unmatched Latin: %s at %s" % (la[lind[0]], lind[0]))
-        unmatched = tt_to_arabic_unmatching.get(la[lind[0]])
+    def check_unmatching(aind, lind):
+        if not (lind < llen):
+            return
+        debprint("Unmatched Latin: %s at %s" % (la[lind], lind))
+        unmatched = tt_to_arabic_unmatching.get(la[lind])
         if unmatched != None:
-            res.append(unmatched)
-            lres.append(la[lind[0]])
-            lind[0] = lind[0] + 1
-            return True
-        return False
+            yield (aind, lind + 1, unmatched, la[lind], None)
 
     # Check for an Arabic long vowel that is unmatched but following a Latin
     # short vowel.
-    def check_skip_unmatching():
-        if not (lind[0] > 0 and aind[0] < alen):
-            return False
-        skip_char_pos = lind[0] - 1
+    def check_skip_unmatching(aind, lind):
+        if not (lind > 0 and aind < alen):
+            return
+        skip_char_pos = lind - 1
         # Skip back over a hyphen, so we match wa-l-jabal against والجبل
         if la[skip_char_pos] == "-" and skip_char_pos > 0:
             skip_char_pos -= 1
         skip_chars = tt_skip_unmatching.get(la[skip_char_pos])
-        if skip_chars != None and ar[aind[0]] in skip_chars:
+        if skip_chars != None and ar[aind] in skip_chars:
             debprint("Skip-unmatching matched %s at %s following %s at %s" % (
-                ar[aind[0]], aind[0], la[skip_char_pos], skip_char_pos))
-            res.append(ar[aind[0]])
-            aind[0] = aind[0] + 1
-            return True
-        return False
+                ar[aind], aind, la[skip_char_pos], skip_char_pos))
+            yield (aind + 1, lind, ar[aind], u"", None)
 
     # Check for Latin hyphen and match it against -, zwj, zwnj, Arabic space
     # or nothing. See the caller for some of the reasons we special-case
     # this.
-    def check_against_hyphen():
-        if lind[0] < llen and la[lind[0]] == "-":
-            if aind[0] >= alen:
-                lres.append("-")
-            elif ar[aind[0]] in ["-", u"–", zwj, zwnj]:
-                lres.append("-")
-                res.append(ar[aind[0]])
-                aind[0] += 1
-            elif ar[aind[0]] == " ":
+    def check_against_hyphen(aind, lind):
+        if lind < llen and la[lind] == "-":
+            if aind >= alen:
+                yield (aind, lind + 1, u"", u"-", None)
+            elif ar[aind] in ["-", u"–", zwj, zwnj]:
+                yield (aind + 1, lind + 1, ar[aind], u"-", None)
+            elif ar[aind] == " ":
                 # When matching against space, convert hyphen to space.
-                lres.append(" ")
-                res.append(" ")
-                aind[0] += 1
+                yield (aind + 1, lind + 1, u" ", u" ", None)
             else:
-                lres.append("-")
-            lind[0] += 1
-            return True
-        return False
+                yield (aind, lind + 1, u"", u"-", None)
 
     # Check for plain alif matching hamza and canonicalize.
-    def check_bow_alif():
-        if not (is_bow() and aind[0] < alen and ar[aind[0]] == u"ا"):
-            return False
+    def check_bow_alif(aind, lind):
+        if not (aind < alen and is_bow(aind) and ar[aind] == u"ا"):
+            return
         # Check for hamza + vowel.
-        if not (lind[0] < llen - 1 and la[lind[0]] in hamza_match_chars and
-                la[lind[0] + 1] in u"aeiouəāēīōū"):
-            return False
+        if not (lind < llen - 1 and la[lind] in hamza_match_chars and
+                la[lind + 1] in u"aeiouəāēīōū"):
+            return
         # long vowels should have been pre-canonicalized to have the
         # corresponding short vowel before them.
-        assert la[lind[0] + 1] not in u"āēīōū"
-        if la[lind[0] + 1] in u"ei":
+        assert la[lind + 1] not in u"āēīōū"
+        if la[lind + 1] in u"ei":
             canonalif = u"إ"
         else:
             canonalif = u"أ"
-        msgfun("Canonicalized alif to %s in %s (%s)" % (
-            canonalif, origarabic, origlatin))
-        res.append(canonalif)
-        aind[0] += 1
-        lres.append(u"ʾ")
-        lind[0] += 1
-        return True
+        yield (aind + 1, lind + 1, canonalif, u"ʾ",
+            "Canonicalized alif to %s in %s (%s)" % (
+                canonalif, origarabic, origlatin))
 
     # Check for inferring tanwīn
-    def check_eow_tanwin():
+    def check_eow_tanwin(aind, lind):
         tanwin_mapping = {"a":AN, "i":IN, "u":UN}
         # Infer tanwīn at EOW
-        if (aind[0] > 0 and is_eow(aind[0] - 1) and lind[0] < llen - 1 and
-                la[lind[0]] in "aiu" and la[lind[0] + 1] == "n"):
-            res.append(tanwin_mapping[la[lind[0]]])
-            lres.append(la[lind[0]])
-            lres.append(la[lind[0] + 1])
-            lind[0] += 2
-            return True
+        if (aind > 0 and is_eow(aind - 1) and lind < llen - 1 and
+                la[lind] in "aiu" and la[lind + 1] == "n"):
+            yield (aind, lind + 2, tanwin_mapping[la[lind]],
+                    la[lind] + la[lind + 1], None)
         # Infer fatḥatān before EOW alif/alif maqṣūra
-        if (aind[0] < alen and is_eow() and
-                ar[aind[0]] in u"اى" and lind[0] < llen - 1 and
-                la[lind[0]] == "a" and la[lind[0] + 1] == "n"):
-            res.append(AN)
-            res.append(ar[aind[0]])
-            lres.append("a")
-            lres.append("n")
-            aind[0] += 1
-            lind[0] += 2
-            return True
-        return False
+        elif (aind < alen and is_eow(aind) and
+                ar[aind] in u"اى" and lind < llen - 1 and
+                la[lind] == "a" and la[lind + 1] == "n"):
+            yield (aind + 1, lind + 2, AN + ar[aind], u"an", None)
 
+    # Yield the steps from state (AIND, LIND), in order of preference.
+    #
     # Here we go through the unvocalized Arabic letter for letter, matching
     # up the consonants we encounter with the corresponding Latin consonants
     # using the dict in tt_to_arabic_matching and copying the Arabic
@@ -1265,23 +1348,18 @@ def tr_matching(arabic, latin, err=False, msgfun=msg):
     # handles short vowels and shadda. If this doesn't match either, and we
     # have left-over Arabic or Latin characters, we reject the whole match,
     # either returning False or signaling an error.
-
-    while aind[0] < alen or lind[0] < llen:
-        matched = False
+    def get_steps(aind, lind):
         # The first clause ensures that shadda always gets processed first;
         # necessary in the case of the qiṭṭun example below, which otherwise
         # would be rendered as qiṭunn.
-        if lind[0] < llen and la[lind[0]] == u"\u0651":
-            debprint("Matched: Clause shadda")
-            lind[0] += 1
-            lres.append(u"\u0651")
-            if aind[0] < alen and (
-                    ar[aind[0]] == u"\u0651" or ar[aind[0]] == double_l_subst):
-                res.append(ar[aind[0]])
-                aind[0] += 1
+        if lind < llen and la[lind] == u"\u0651":
+            debprint("Step: Clause shadda")
+            if aind < alen and (
+                    ar[aind] == u"\u0651" or ar[aind] == double_l_subst):
+                yield (aind + 1, lind + 1, ar[aind], u"\u0651", None)
             else:
-                res.append(u"\u0651")
-            matched = True
+                yield (aind, lind + 1, u"\u0651", u"\u0651", None)
+            return
         # We need a special clause for hyphen for various reasons. One of them
         # is that otherwise we have problems with al-ʾimārāt against الإمارات,
         # where the إ is in BOW position against hyphen and is allowed to
@@ -1289,9 +1367,10 @@ def tr_matching(arabic, latin, err=False, msgfun=msg):
         # against nothing and the ʾ can't match. Another is so that we can
         # canonicalize it to space if matching against a space but keep it
         # a hyphen otherwise.
-        elif check_against_hyphen():
-            debprint("Matched: Clause check_against_hyphen()")
-            matched = True
+        for step in check_against_hyphen(aind, lind):
+            debprint("Step: Clause check_against_hyphen()")
+            yield step
+            return
         # The effect of the next clause is to handle cases where the
         # Arabic has a right bracket or similar character and the Latin has
         # a short vowel or shadda that doesn't match and needs to go before
@@ -1310,38 +1389,84 @@ def tr_matching(arabic, latin, err=False, msgfun=msg):
         # of the matches are an empty string. This had the side-effect of
         # fixing the qiṭṭun problem but made it impossible to vocalize the
         # ghurfatun al-kuuba example, among others.
-        elif (not is_bow() and aind[0] < alen and
-                ar[aind[0]] in word_interrupting_chars and
-                check_unmatching()):
-            debprint("Matched: Clause 1")
-            matched = True
-        elif check_bow_alif():
-            debprint("Matched: Clause check_bow_alif()")
-            matched = True
-        elif aind[0] < alen and match():
-            debprint("Matched: Clause match()")
-            matched = True
-        elif check_eow_tanwin():
-            debprint("Matched: Clause check_eow_tanwin()")
-            matched = True
-        elif check_unmatching():
-            debprint("Matched: Clause check_unmatching()")
-            matched = True
-        elif check_skip_unmatching():
-            debprint("Matched: Clause check_skip_unmatching()")
-            matched = True
-        if not matched:
-            if err:
-                cant_match()
+        if (aind < alen and not is_bow(aind) and
+                ar[aind] in word_interrupting_chars):
+            for step in check_unmatching(aind, lind):
+                debprint("Step: Clause 1")
+                yield step
+        for step in check_bow_alif(aind, lind):
+            debprint("Step: Clause check_bow_alif()")
+            yield step
+        if aind < alen:
+            for step in match(aind, lind):
+                debprint("Step: Clause match()")
+                yield step
+        for step in check_eow_tanwin(aind, lind):
+            debprint("Step: Clause check_eow_tanwin()")
+            yield step
+        for step in check_unmatching(aind, lind):
+            debprint("Step: Clause check_unmatching()")
+            yield step
+        for step in check_skip_unmatching(aind, lind):
+            debprint("Step: Clause check_skip_unmatching()")
+            yield step
+
+    # Find the first path from (0, 0) to (ALEN, LLEN), taking the steps
+    # from each state in order of preference, so that the path found is
+    # the one that always takes the most preferred step that still allows
+    # the rest of the text to be matched. This is a depth-first search
+    # that remembers the states from which the end can't be reached, so no
+    # state is explored twice and the time taken is proportional to the
+    # number of states reachable (normally a narrow band around the
+    # diagonal, so roughly linear in the length of the text). FURTHEST is
+    # the state furthest into the Arabic (and then the Latin) that was
+    # reached, for reporting where a failed match got stuck.
+    dead = set()
+    path = []
+    stack = [((0, 0), get_steps(0, 0))]
+    furthest = (0, 0)
+    while stack:
+        state, steps = stack[-1]
+        if state == (alen, llen):
+            break
+        for step in steps:
+            newstate = step[0:2]
+            if newstate not in dead:
+                path.append(step)
+                stack.append((newstate, get_steps(*newstate)))
+                furthest = max(furthest, newstate)
+                break
+        else:
+            dead.add(state)
+            stack.pop()
+            if path:
+                path.pop()
+
+    if not stack:
+        if err:
+            aind, lind = furthest
+            if aind < alen and lind < llen:
+                error("Unable to match Arabic character %s at index %s, Latin character %s at index %s" %
+                    (ar[aind], aind, la[lind], lind))
+            elif aind < alen:
+                error("Unable to match trailing Arabic character %s at index %s" %
+                    (ar[aind], aind))
             else:
-                return False
+                error("Unable to match trailing Latin character %s at index %s" %
+                    (la[lind], lind))
+        else:
+            return False
 
-    arabic = "".join(res)
-    latin = "".join(lres)
+    for step in path:
+        if step[4]:
+            msgfun(step[4])
+    arabic = "".join(step[2] for step in path)
+    latin = "".join(step[3] for step in path)
     arabic = post_canonicalize_arabic(arabic)
     latin = post_canonicalize_latin(latin)
     return arabic, latin
 
+@translit_memoized
 def remove_diacritics(word):
     return arabiclib.remove_diacritics(word)
 
@@ -1426,6 +1551,203 @@ def tr_latin_direct(text, pos, msgfun=msg):
 
 ################################ Test code ##########################
 
+# Reference implementation of has_diacritics(), applying has_diacritics_subs
+# one by one. Used by run_tr_differential() to check has_diacritics() and
+# unvocalized_positions().
+def has_diacritics_reference(text):
+    for sub in has_diacritics_subs:
+        text = rsub(text, sub[0], sub[1])
+    return len(text) == 0
+
+# Reference implementation of tr(), making the substitutions one by one with
+# rsub(), as tr() did before its rules were compiled. Used by
+# run_tr_differential() to check that tr() still gives the same results.
+def tr_reference(text, lang=None, sc=None, omit_i3raab=False, gray_i3raab=False,
+        force_translate=False, msgfun=msg):
+    for sub in before_diacritic_checking_subs:
+        text = rsub(text, sub[0], sub[1])
+
+    if not force_translate and not has_diacritics_reference(text):
+        return None
+
+    ############# transformations after checking for diacritics ##############
+    # Replace plain alif with hamzatu l-waṣl when followed by fatḥa/ḍamma/kasra.
+    # Must go after handling of initial al-, which distinguishes alif-fatḥa
+    # from alif w/hamzatu l-waṣl. Must go before generation of ū and ī, which
+    # eliminate the ḍamma/kasra.
+    text = rsub(text, u"\u0627([\u064E\u064F\u0650])", u"\u0671\\1")
+    # ḍamma + waw not followed by a diacritic is ū, otherwise w
+    text = rsub(text, u"\u064F\u0648([^\u064B\u064C\u064D\u064E\u064F\u0650\u0651\u0652\u0670])", u"ū\\1")
+    text = rsub(text, u"\u064F\u0648$", u"ū")
+    # kasra + yaa not followed by a diacritic (or ū from prev step) is ī, otherwise y
+    text = rsub(text, u"\u0650\u064A([^\u064B\u064C\u064D\u064E\u064F\u0650\u0651\u0652\u0670ū])", u"ī\\1")
+    text = rsub(text, u"\u0650\u064A$", u"ī")
+    # convert shadda to double letter.
+    text = rsub(text, u"(.)\u0651", u"\\1\\1")
+    if not omit_i3raab and gray_i3raab: # show ʾiʿrāb grayed in transliteration
+        # decide whether to gray out the t in ة. If word begins with al-, yes.
+        # Otherwise, no if word ends in a/i/u, yes if ends in an/in/un.
+        text = rsub(text, u"((?:^|\\s)a?l-[^\\s]+)\u0629([\u064B\u064C\u064D\u064E\u064F\u0650])",
+            u"\\1<span style=\"color: #888888\">t</span>\\2")
+        text = rsub(text, u"\u0629([\u064E\u064F\u0650])", u"t\\1")
+        text = rsub(text, u"\u0629([\u064B\u064C\u064D])",
+            u"<span style=\"color: #888888\">t</span>\\1")
+        text = rsub(text, u".", {
+            u"\u064B":u"<span style=\"color: #888888\">an</span>",
+            u"\u064D":u"<span style=\"color: #888888\">in</span>",
+            u"\u064C":u"<span style=\"color: #888888\">un</span>"
+        })
+        text = rsub(text, u"([\u064E\u064F\u0650])\\s", {
+            u"\u064E":u"<span style=\"color: #888888\">a</span> ",
+            u"\u0650":u"<span style=\"color: #888888\">i</span> ",
+            u"\u064F":u"<span style=\"color: #888888\">u</span> "
+        })
+        text = rsub(text, u"[\u064E\u064F\u0650]$", {
+            u"\u064E":u"<span style=\"color: #888888\">a</span>",
+            u"\u0650":u"<span style=\"color: #888888\">i</span>",
+            u"\u064F":u"<span style=\"color: #888888\">u</span>"
+        })
+        text = rsub(text, u"</span><span style=\"color: #888888\">", u"")
+    elif omit_i3raab: # omit ʾiʿrāb in transliteration
+        text = rsub(text, u"[\u064B\u064C\u064D]", u"")
+        text = rsub(text, u"[\u064E\u064F\u0650]\\s", u" ")
+        text = rsub(text, u"[\u064E\u064F\u0650]$", u"")
+    # tāʾ marbūṭa should not be rendered by -t if word-final even when
+    # ʾiʿrāb (desinential inflection) is shown; instead, use (t) before
+    # whitespace, nothing when final; but render final -اة and -آة as -āh,
+    # consistent with Wehr's dictionary
+    text = rsub(text, u"([\u0627\u0622])\u0629$", u"\\1h")
+    # Ignore final tāʾ marbūṭa (it appears as "a" due to the preceding
+    # short vowel). Need to do this after graying or omitting word-final
+    # ʾiʿrāb.
+    text = rsub(text, u"\u0629$", u"")
+    if not omit_i3raab: # show ʾiʿrāb in transliteration
+        text = rsub(text, u"\u0629\\s", u"(t) ")
+    else:
+        # When omitting ʾiʿrāb, show all non-absolutely-final instances of
+        # tāʾ marbūṭa as (t), with trailing ʾiʿrāb omitted.
+        text = rsub(text, u"\u0629", u"(t)")
+    # tatwīl should be rendered as - at beginning or end of word. It will
+    # be rendered as nothing in the middle of a word (FIXME, do we want
+    # this?)
+    text = rsub(text, u"^ـ", "-")
+    text = rsub(text, u"\\sـ", " -")
+    text = rsub(text, u"ـ$", "-")
+    text = rsub(text, u"ـ\\s", "- ")
+    # Now convert remaining Arabic chars according to table.
+    text = rsub(text, u".", tt)
+    text = rsub(text, u"aā", u"ā")
+    # Implement elision of al- after a final vowel. We do this
+    # conservatively, only handling elision of the definite article rather
+    # than elision in other cases of hamzat al-waṣl (e.g. form-I imperatives
+    # or form-VII and above verbal nouns) partly because elision in
+    # these cases isn't so common in MSA and partly to avoid excessive
+    # elision in case of words written with initial bare alif instead of
+    # properly with hamzated alif. Possibly we should reconsider.
+    # At the very least we currently don't handle elision of الَّذِي (allaḏi)
+    # correctly because we special-case it to appear without the hyphen;
+    # perhaps we should reconsider that.
+    text = rsub(text, u"([aiuāīū](?:</span>)?) a([" + sun_letters_tr + "]-)",
+        u"\\1 \\2")
+    # Special-case the transliteration of allāh, without the hyphen
+    text = rsub(text, u"(^|\\s)(a?)l-lāh", u"\\1\\2llāh")
+
+    return text
+
+# Flag combinations that change the output of tr(), for checking it against
+# tr_reference().
+tr_differential_flags = [{}, {"omit_i3raab": True}, {"gray_i3raab": True},
+        {"force_translate": True},
+        {"force_translate": True, "omit_i3raab": True},
+        {"force_translate": True, "gray_i3raab": True}]
+
+# Check tr() against tr_reference() on TEXT with each of the flag
+# combinations in tr_differential_flags, and has_diacritics() and
+# unvocalized_positions() against has_diacritics_reference(), printing any
+# differences. Return the number of differences.
+def check_tr_differential(text):
+    differences = check_has_diacritics_differential(text)
+    for flags in tr_differential_flags:
+        result = tr(text, **flags)
+        reference = tr_reference(text, **flags)
+        if result != reference:
+            uniprint(u"tr(%s, %s) = %s, but reference gives %s" % (text,
+                flags, result, reference))
+            differences += 1
+    return differences
+
+# Check has_diacritics() and unvocalized_positions() against
+# has_diacritics_reference() on TEXT, printing any difference. Return the
+# number of differences (0 or 1).
+def check_has_diacritics_differential(text):
+    reference = has_diacritics_reference(text)
+    result = has_diacritics(text)
+    positions = unvocalized_positions(text)
+    if result != reference or (not positions) != reference:
+        uniprint(u"has_diacritics(%s) = %s, unvocalized positions %s, but reference gives %s" % (
+            text, result, positions, reference))
+        return 1
+    return 0
+
+# Characters used to make the random texts in
+# check_has_diacritics_random(): each class of character that
+# has_diacritics() distinguishes, including newline at the end of the text.
+has_diacritics_random_chars = (u"بةوياىآٱ١" + punctuation +
+        u"\u064B\u064C\u064E\u064F\u0650\u0651\u0652\u0670" +
+        u" -–\t\nxcﻻ")
+
+# Check has_diacritics() etc. against has_diacritics_reference() on COUNT
+# random texts of up to 8 characters. Return the number of differences.
+def check_has_diacritics_random(count, seed=1):
+    import random
+    rand = random.Random(seed)
+    differences = 0
+    for i in xrange(count):
+        text = u"".join(rand.choice(has_diacritics_random_chars)
+                for j in xrange(rand.randint(0, 8)))
+        differences += check_has_diacritics_differential(text)
+    return differences
+
+# Yield the runs of Arabic text (words possibly separated by spaces and
+# hyphens) in the run logs FILENAMES (log files or run-logs-*.tar.bz2
+# archives).
+def iter_log_arabic(filenames):
+    import blib
+    arabic_run_re = re.compile(u"[\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF\u200C\u200D]+(?:[ \\-–][\u0600-\u06FF\u0750-\u077F\u08A0-\u08FF\uFB50-\uFDFF\uFE70-\uFEFF\u200C\u200D]+)*")
+    for filename in filenames:
+        for name, fp in blib.iter_log_files(filename):
+            for line in fp:
+                for arabic in arabic_run_re.findall(
+                        line.decode("utf-8", "replace")):
+                    yield arabic
+
+# Differential test of tr() against tr_reference(): check the Arabic inputs
+# to and outputs of tr_matching() in run_tests() (by running the tests with
+# tr() replaced by a checking version), then has_diacritics() on random
+# texts, then each distinct run of Arabic text in the run logs LOGS.
+def run_tr_differential(logs=[]):
+    global tr
+    differences = [0]
+    checked = set()
+    real_tr = tr
+    def checking_tr(text, *args, **kwargs):
+        if text not in checked:
+            checked.add(text)
+            differences[0] += check_tr_differential(text)
+        return real_tr(text, *args, **kwargs)
+    tr = checking_tr
+    try:
+        run_tests()
+    finally:
+        tr = real_tr
+    differences[0] += check_has_diacritics_random(100000)
+    for arabic in iter_log_arabic(logs):
+        if arabic not in checked:
+            checked.add(arabic)
+            differences[0] += check_tr_differential(arabic)
+    uniprint("DIFFERENTIAL: %s texts checked, %s differences." % (
+        len(checked), differences[0]))
+
 num_failed = 0
 num_succeeded = 0
 
@@ -1700,7 +2022,11 @@ def run_tests():
     uniprint("RESULTS: %s SUCCEEDED, %s FAILED." % (num_succeeded, num_failed))
 
 if __name__ == "__main__":
-    run_tests()
+    import sys
+    if sys.argv[1:2] == ["--differential"]:
+        run_tr_differential(sys.argv[2:])
+    else:
+        run_tests()
 
 # For Vim, so we get 4-space indent
 # vim: set sw=4:
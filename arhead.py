@@ -20,5 +20,5 @@ def fix(page, index, text):
  
 startFrom, upTo = blib.get_args()
  
-for page, index in blib.references(u"Template:tracking/ar-head/head", startFrom, upTo):
-  blib.do_edit(page, index, fix)
+blib.do_edits(blib.references(u"Template:tracking/ar-head/head", startFrom,
+  upTo), fix)
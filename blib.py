@@ -17,18 +17,39 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import pywikibot, mwparserfromhell, re, sys, urllib2, datetime, json, argparse, time
+import os, bz2, gzip, tarfile, sqlite3, threading, Queue, collections, multiprocessing
+import traceback, hashlib, uuid, bisect, itertools, random, socket, httplib
+import functools, inspect
+import requests
+import lua_sandbox
+from pywikibot import xmlreader
 from arabiclib import reorder_shadda
 
 site = pywikibot.Site()
 
 
+# If not None, a list to which msg() and msgn() append their output rather
+# than printing it; used to collect output from subprocesses (see
+# do_process_texts()).
+msg_capture = None
+
+# If not None, an EventLog to which page_message() also sends its messages
+# (--event-log).
+event_log = None
+
 def msg(text):
   #pywikibot.output(text.encode('utf-8'), toStdout = True)
-  print text.encode('utf-8')
+  if msg_capture is not None:
+    msg_capture.append(text.encode('utf-8') + "\n")
+  else:
+    print text.encode('utf-8')
 
 def msgn(text):
   #pywikibot.output(text.encode('utf-8'), toStdout = True)
-  print text.encode('utf-8'),
+  if msg_capture is not None:
+    msg_capture.append(text.encode('utf-8') + " ")
+  else:
+    print text.encode('utf-8'),
 
 def errmsg(text):
   #pywikibot.output(text.encode('utf-8'))
@@ -37,6 +58,24 @@ def errmsg(text):
 def errmsgn(text):
   print >> sys.stderr, text.encode('utf-8'),
 
+# Output TEXT, a message about page TITLE with index INDEX, as
+# "Page INDEX TITLE: TEXT" using OUTFUN (msg() by default), and record it in
+# the event log if there is one (see EventLog) with action ACTION and the
+# fields in FIELDS (e.g. "before" and "after" for "replace"). If TEMPNAME is
+# given, the message is about its param PARAM and is output as
+# "Page INDEX TITLE: TEMPNAME.PARAM: TEXT". If ACTION isn't given, it's
+# "warning" for a message starting "WARNING: " and "message" otherwise.
+def page_message(index, title, text, action=None, tempname=None, param=None,
+    outfun=None, **fields):
+  if tempname:
+    (outfun or msg)(u"Page %s %s: %s.%s: %s" % (index, title, tempname, param,
+      text))
+  else:
+    (outfun or msg)(u"Page %s %s: %s" % (index, title, text))
+  if event_log:
+    event_log.page_event(index, title, text, action, tempname=tempname,
+        param=param, **fields)
+
 def display(page):
   errmsg(u'# [[{0}]]'.format(page.title()))
 
@@ -44,13 +83,196 @@ def dump(page):
   old = page.get(get_redirect=True)
   msg(u'Contents of [[{0}]]:\n{1}\n----------'.format(page.title(), old))
 
+# Return the revision ID of the text of PAGE if it's already known (to avoid
+# a request for it), else None.
+def known_revid(page):
+  if isinstance(page, DumpPage) or hasattr(page, "_revid"):
+    return page.latest_revision_id
+  if page_cache:
+    return page_cache.revids_used.get(unicode(page.title()))
+  return None
+
 def parse(page):
   return parse_text(page.text)
 
 def parse_text(text):
+  if fast_parse:
+    parsed = parse_templates_only(text)
+    if parsed is not None:
+      return parsed
   return mwparserfromhell.parser.Parser().parse(text,
     skip_style_tags=True)
 
+# If true (--fast-parse), parse_text() uses parse_templates_only() where
+# possible. Only suitable for scripts that look at nothing but templates.
+fast_parse = False
+fast_parse_pages = 0
+fast_parse_fallbacks = 0
+
+def set_fast_parse(value=True):
+  global fast_parse
+  fast_parse = value
+
+# Return the fast parse statistics since the last call and reset them; used
+# to collect statistics from subprocesses (see do_process_texts()).
+def take_fast_parse_stats():
+  global fast_parse_pages, fast_parse_fallbacks
+  stats = (fast_parse_pages, fast_parse_fallbacks)
+  fast_parse_pages = 0
+  fast_parse_fallbacks = 0
+  return stats
+
+def merge_fast_parse_stats(stats):
+  global fast_parse_pages, fast_parse_fallbacks
+  fast_parse_pages += stats[0]
+  fast_parse_fallbacks += stats[1]
+
+class TemplateOnlyParseError(Exception):
+  pass
+
+# Tags whose contents aren't parsed, and the start of a comment, at top
+# level; a template; and the tokens that matter inside a template.
+template_only_toplevel_re = re.compile(r"<!--|<(%s)\b|\{\{" %
+    "|".join(mwparserfromhell.definitions.PARSER_BLACKLIST), re.I)
+template_only_inner_re = re.compile(r"\{\{|\}\}|\[\[|\]\]|[\[|=<]")
+template_only_name_re = re.compile(r"^\s*[^\[\]{}<>|\n]+?\s*$")
+
+# The nodes are made directly, bypassing the checks in the constructors
+# (which account for much of the time otherwise), since what's passed in
+# is known to be valid.
+def template_only_wikicode(pieces):
+  Text = mwparserfromhell.nodes.Text
+  nodes = []
+  for piece in pieces:
+    if isinstance(piece, basestring):
+      if piece:
+        node = Text.__new__(Text)
+        node._value = piece
+        nodes.append(node)
+    else:
+      nodes.append(piece)
+  return mwparserfromhell.wikicode.Wikicode(
+      mwparserfromhell.smart_list.SmartList(nodes))
+
+def template_only_param(name, value, showkey):
+  Parameter = mwparserfromhell.nodes.extras.Parameter
+  param = Parameter.__new__(Parameter)
+  param._name = name
+  param._value = value
+  param._showkey = showkey
+  return param
+
+# Parse the template starting at position START of TEXT (just after the
+# opening braces). Return the Template node and the position just after
+# it.
+def parse_template_only(text, start):
+  # Each piece (the name, then each param) is a list of text strings and
+  # nested templates; KEYS holds the names of named params.
+  pieces = [[]]
+  keys = [None]
+  pos = segstart = start
+  link_depth = 0
+  while True:
+    m = template_only_inner_re.search(text, pos)
+    if not m:
+      raise TemplateOnlyParseError("unclosed template")
+    tok = m.group(0)
+    pos = m.end()
+    if tok == "[[":
+      link_depth += 1
+    elif tok == "]]":
+      link_depth = max(link_depth - 1, 0)
+    elif tok in ["[", "<"]:
+      raise TemplateOnlyParseError("external link or tag in template")
+    elif tok == "{{":
+      if text.startswith("{", pos):
+        raise TemplateOnlyParseError("template argument")
+      pieces[-1].append(text[segstart:m.start()])
+      template, pos = parse_template_only(text, pos)
+      pieces[-1].append(template)
+      segstart = pos
+    elif link_depth:
+      if tok == "}}":
+        raise TemplateOnlyParseError("unclosed link in template")
+    elif tok == "=":
+      if len(pieces) > 1 and keys[-1] is None:
+        if any(not isinstance(piece, basestring) for piece in pieces[-1]):
+          raise TemplateOnlyParseError("template in param name")
+        keys[-1] = pieces[-1] + [text[segstart:m.start()]]
+        pieces[-1] = []
+        segstart = pos
+    else:
+      pieces[-1].append(text[segstart:m.start()])
+      segstart = pos
+      if tok == "}}":
+        break
+      pieces.append([])
+      keys.append(None)
+  name = "".join(pieces[0]) if all(isinstance(piece, basestring)
+      for piece in pieces[0]) else ""
+  if not template_only_name_re.match(name):
+    raise TemplateOnlyParseError("invalid template name")
+  params = []
+  default = 1
+  for key, value in zip(keys[1:], pieces[1:]):
+    showkey = key is not None
+    if not showkey:
+      key = [str(default)]
+      default += 1
+    params.append(template_only_param(template_only_wikicode(key),
+      template_only_wikicode(value), showkey))
+  return mwparserfromhell.nodes.Template(template_only_wikicode([name]),
+      params), pos
+
+# Parse TEXT, finding only the templates in it, as an alternative to the
+# full parse done by mwparserfromhell that is several times faster. The
+# result is a Wikicode object like the one from parse_text(), made of Text
+# and Template nodes (with parameters as usual), so that getparam(),
+# addparam() etc. and unicode() work as usual, and unchanged parts of the
+# text come out exactly as they went in. Return None if the text has
+# something in it that might not come out the same as with a full parse
+# (e.g. a tag, external link or {{{template argument}}} inside a template,
+# or unbalanced braces); in that case a full parse should be done.
+def parse_templates_only(text):
+  global fast_parse_pages, fast_parse_fallbacks
+  fast_parse_pages += 1
+  pieces = []
+  pos = segstart = 0
+  try:
+    while True:
+      m = template_only_toplevel_re.search(text, pos)
+      if not m:
+        break
+      if m.group(0) == "<!--":
+        end = text.find("-->", m.end())
+        if end < 0:
+          raise TemplateOnlyParseError("unclosed comment")
+        pos = end + 3
+      elif m.group(1):
+        tagend = text.find(">", m.end())
+        if tagend < 0:
+          raise TemplateOnlyParseError("unclosed tag")
+        if text[tagend - 1] == "/":
+          pos = tagend + 1
+        else:
+          close = re.compile(r"</%s\s*>" % m.group(1), re.I).search(text,
+              tagend)
+          if not close:
+            raise TemplateOnlyParseError("unclosed tag")
+          pos = close.end()
+      elif text.startswith("{", m.end()):
+        raise TemplateOnlyParseError("template argument")
+      else:
+        pieces.append(text[segstart:m.start()])
+        template, pos = parse_template_only(text, m.end())
+        pieces.append(template)
+        segstart = pos
+  except TemplateOnlyParseError:
+    fast_parse_fallbacks += 1
+    return None
+  pieces.append(text[segstart:])
+  return template_only_wikicode(pieces)
+
 def getparam(template, param):
   if template.has(param):
     return unicode(template.get(param).value)
@@ -73,10 +295,96 @@ def getrmparam(template, param):
   rmparam(template, param)
   return val
 
+# Wrapper around TEMPLATE that keeps an index of its params by name, so
+# that has() and get() (and hence getparam(), etc.) take constant time
+# rather than scanning the params. It can be used in place of the template
+# with getparam(), addparam(), rmparam() etc., and passes everything else
+# through to the template. The index is updated by add() and rebuilt after
+# remove(); if the template's params are changed other than through the
+# wrapper, call invalidate().
+class ParamIndex(object):
+  def __init__(self, template):
+    self.template = template
+    self.index = None
+    self.sorted_names = None
+
+  def get_index(self):
+    if self.index is None:
+      # As with Template.get(), the last of several params with the same
+      # name is the one that counts.
+      self.index = dict((unicode(param.name).strip(), param)
+        for param in self.template.params)
+    return self.index
+
+  def invalidate(self):
+    self.index = None
+    self.sorted_names = None
+
+  def has(self, name, ignore_empty=False):
+    param = self.get_index().get(unicode(name).strip())
+    if param is None:
+      return False
+    if ignore_empty and not param.value.strip():
+      return self.template.has(name, ignore_empty=True)
+    return True
+
+  def get(self, name):
+    param = self.get_index().get(unicode(name).strip())
+    if param is None:
+      raise ValueError(name)
+    return param
+
+  def add(self, name, value, *args, **kwargs):
+    param = self.template.add(name, value, *args, **kwargs)
+    if self.index is not None:
+      name = unicode(param.name).strip()
+      if name not in self.index:
+        self.sorted_names = None
+      self.index[name] = param
+    return param
+
+  def remove(self, param, keep_field=False):
+    self.template.remove(param, keep_field=keep_field)
+    self.invalidate()
+
+  # Return the names of the params whose names begin with PREFIX, in sorted
+  # order, e.g. to find which params of a chain such as pl, pl2, pl3, ...
+  # are present without looking each one up.
+  def names_with_prefix(self, prefix):
+    if self.sorted_names is None:
+      self.sorted_names = sorted(self.get_index())
+    names = []
+    for name in itertools.islice(self.sorted_names,
+        bisect.bisect_left(self.sorted_names, prefix), None):
+      if not name.startswith(prefix):
+        break
+      names.append(name)
+    return names
+
+  def __getattr__(self, attr):
+    return getattr(self.template, attr)
+
+  def __unicode__(self):
+    return unicode(self.template)
+
+  def __str__(self):
+    return str(self.template)
+
+# Return the expansion of wikitext TEXT as if on page TITLE, through the
+# expansion cache if enabled.
+def expand_wikitext(text, title):
+  if local_lua:
+    result = local_lua.expand(text, title)
+    if result is not None:
+      return result
+  if expand_cache:
+    return expand_cache.expand(text, title)
+  return server_expand_text(text, title)
+
 def expand_text(tempcall, pagetitle, pagemsg, verbose):
   if verbose:
     pagemsg("Expanding text: %s" % tempcall)
-  result = site.expand_text(tempcall, title=pagetitle)
+  result = expand_wikitext(tempcall, pagetitle)
   if verbose:
     pagemsg("Raw result is %s" % result)
   if result.startswith('<strong class="error">'):
@@ -87,13 +395,269 @@ def expand_text(tempcall, pagetitle, pagemsg, verbose):
     return False
   return result
 
-def do_edit(page, index, func=None, null=False, save=False, verbose=False):
+# Expand each of the pieces of wikitext in CALLS (typically template calls)
+# as if on page TITLE, using a single expandtemplates request for all those
+# not in the expansion cache. The calls are joined with unique sentinel
+# lines, which are used to split the result back apart; each call starts
+# on a new line, so templates whose output depends on being at the start of
+# a line behave as when expanded alone. Return a list of the expansions in
+# the same order as CALLS. As with expand_text(), a call whose expansion is
+# an error gives False, and the error is reported using PAGEMSG (by
+# default, a message prefixed with TITLE).
+def expand_many(calls, title, pagemsg=None, verbose=False):
+  if not pagemsg:
+    def pagemsg(text):
+      msg("Page %s: %s" % (title, text))
+  results = [None] * len(calls)
+  todo = []
+  for i, call in enumerate(calls):
+    if local_lua:
+      results[i] = local_lua.expand(call, title)
+    if results[i] is None and expand_cache:
+      results[i] = expand_cache.lookup(call, title)
+    if results[i] is None:
+      todo.append(i)
+  if todo:
+    sep = "BLIB-SEPARATOR-%s" % uuid.uuid4().hex
+    text = "".join("%s\n%s-%s\n" % (calls[i], sep, i) for i in todo)
+    if verbose:
+      pagemsg("Expanding text: %s" % text)
+    pieces = re.split("\n%s-([0-9]+)(?:\n|$)" % sep,
+        server_expand_text(text, title))
+    if pieces[1::2] == [str(i) for i in todo] and pieces[-1] == "":
+      for i, result in zip(todo, pieces[0::2]):
+        results[i] = result
+        if expand_cache:
+          expand_cache.store(calls[i], title, result)
+    else:
+      # Something (e.g. unbalanced braces in a call) swallowed a separator;
+      # expand the calls one by one instead.
+      pagemsg("WARNING: Unable to split combined expansion, expanding calls separately")
+      for i in todo:
+        results[i] = expand_wikitext(calls[i], title)
+
+  for i, result in enumerate(results):
+    if result.startswith('<strong class="error">'):
+      pagemsg("Expanding text: %s" % calls[i])
+      pagemsg("WARNING: Got error: %s" % re.sub("<.*?>", "", result))
+      results[i] = False
+    elif verbose:
+      pagemsg("Raw result for %s is %s" % (calls[i], result))
+  return results
+
+# Check applied to the raw text of a page before it's parsed, so that pages
+# that can't contain anything of interest are skipped cheaply. REGEX is a
+# compiled regex that must match somewhere in the text of any page worth
+# processing; it may match pages that turn out to have nothing to do, but
+# must never fail to match a page that does.
+class TextPrefilter(object):
+  def __init__(self, regex):
+    self.regex = regex
+    self.checked = 0
+    self.skipped = 0
+
+  def __call__(self, text):
+    self.checked += 1
+    if self.regex.search(text):
+      return True
+    self.skipped += 1
+    return False
+
+  # Return and reset the counts, e.g. to pass them from a subprocess to the
+  # parent process, which merges them using merge_stats().
+  def get_stats(self):
+    stats = (self.checked, self.skipped)
+    self.checked = 0
+    self.skipped = 0
+    return stats
+
+  def merge_stats(self, stats):
+    self.checked += stats[0]
+    self.skipped += stats[1]
+
+  def msg_stats(self):
+    msg("Prefilter: skipped %s of %s pages without candidate templates (%0.1f%%)" % (
+      self.skipped, self.checked,
+      self.checked and 100.0 * self.skipped / self.checked or 0))
+
+# Raised by RetryPolicy.call() when a request still fails after the
+# maximum number of tries. KIND is the kind of request ("fetch", "expand",
+# "save", or "process" for processing a whole page again), ERROR the last
+# error and TRIES the number of tries made.
+class RetryFailed(Exception):
+  def __init__(self, kind, error, tries):
+    Exception.__init__(self, "failed to %s after %s tries: %s" % (kind, tries,
+      error))
+    self.kind = kind
+    self.error = error
+    self.tries = tries
+
+# Policy for retrying requests to the server (fetching page text, expanding
+# templates and saving pages) that fail with errors likely to be transient:
+# 5xx and 429 HTTP errors, other network errors, server errors and timeouts,
+# including pywikibot giving up after repeated maxlag errors. A request is
+# tried up to MAX_TRIES times, waiting between tries for an exponentially
+# increasing time (starting at BASE_DELAY secs, at most MAX_DELAY) with
+# random jitter, and at least LAG_DELAY secs after a maxlag failure. Pages
+# whose requests still fail are added to a dead-letter list, output in the
+# summary at the end of the run, and the run goes on to the next page.
+#
+# If ADAPTIVE (--adaptive-edit-rate), the delay pywikibot puts between saves
+# is adjusted to how the server is coping: it's shortened by 10% after each
+# successful save, down to MIN_WRITE_DELAY secs, and doubled (up to
+# MAX_WRITE_DELAY) whenever the server reports lag (see --maxlag) or a save
+# has to be retried.
+class RetryPolicy(object):
+  def __init__(self, max_tries=5, base_delay=5, max_delay=300, lag_delay=60,
+      adaptive=False, min_write_delay=1, max_write_delay=120):
+    self.max_tries = max_tries
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.lag_delay = lag_delay
+    self.adaptive = adaptive
+    self.min_write_delay = min_write_delay
+    self.max_write_delay = max_write_delay
+    self.retries = collections.Counter()
+    self.lags = 0
+    # List of (INDEX, TITLE, ERROR) for pages that failed for good.
+    self.dead_letters = []
+    self.lock = threading.Lock()
+
+  # pywikibot's Page.save() wraps errors other than PageSaveRelatedError
+  # ones, including server errors and MaxlagTimeoutError, in
+  # OtherPageSaveError; return the error it wraps.
+  @staticmethod
+  def unwrap(error):
+    while (isinstance(error, pywikibot.OtherPageSaveError) and
+        isinstance(error.reason, Exception)):
+      error = error.reason
+    return error
+
+  def is_transient(self, error):
+    error = self.unwrap(error)
+    if isinstance(error, urllib2.HTTPError):
+      return error.code >= 500 or error.code == 429
+    if isinstance(error, pywikibot.FatalServerError):
+      return False
+    return isinstance(error, (urllib2.URLError, socket.error,
+      httplib.HTTPException, requests.ConnectionError, requests.Timeout,
+      pywikibot.ServerError, pywikibot.exceptions.TimeoutError))
+
+  # Wait before try number TRIES + 1 of a request of kind KIND that failed
+  # with ERROR.
+  def wait(self, kind, error, tries):
+    delay = min(self.max_delay, self.base_delay * 2 ** (tries - 1))
+    delay = delay / 2.0 + random.uniform(0, delay / 2.0)
+    if isinstance(self.unwrap(error), pywikibot.exceptions.MaxlagTimeoutError):
+      delay = max(delay, self.lag_delay)
+      self.note_lag()
+    elif kind == "save":
+      self.slow_down()
+    with self.lock:
+      self.retries[kind] += 1
+    errmsg("WARNING: Failed to %s (%s), retrying in %0.1f secs (try %s of %s)"
+        % (kind, error, delay, tries + 1, self.max_tries))
+    time.sleep(delay)
+
+  # Call FUN with ARGS and KWARGS, a request of kind KIND, retrying after
+  # transient errors; raise RetryFailed if it fails MAX_TRIES times.
+  def call(self, kind, fun, *args, **kwargs):
+    tries = 0
+    while True:
+      tries += 1
+      try:
+        return fun(*args, **kwargs)
+      except Exception as e:
+        if not self.is_transient(e):
+          raise
+        if tries >= self.max_tries:
+          raise RetryFailed(kind, e, tries)
+        self.wait(kind, e, tries)
+
+  def dead_letter(self, index, title, error):
+    with self.lock:
+      self.dead_letters.append((index, unicode(title), unicode(error)))
+    journal_page(index, title, "failed", unicode(error))
+
+  def set_write_delay(self, delay):
+    delay = min(self.max_write_delay, max(self.min_write_delay, delay))
+    with site.throttle.lock:
+      site.throttle.writedelay = delay
+
+  # Called when the server reports lag.
+  def note_lag(self, lagtime=None):
+    with self.lock:
+      self.lags += 1
+    self.slow_down()
+
+  def slow_down(self):
+    if self.adaptive:
+      self.set_write_delay(site.throttle.writedelay * 2)
+
+  # Called after each successful save.
+  def saved(self):
+    if self.adaptive:
+      self.set_write_delay(site.throttle.writedelay * 0.9)
+
+  def msg_stats(self):
+    if self.retries or self.lags:
+      msg("Retries: %s fetch, %s expand, %s save, %s whole page; server reported lag %s times" % (
+        self.retries["fetch"], self.retries["expand"], self.retries["save"],
+        self.retries["process"], self.lags))
+    if self.adaptive:
+      msg("Final delay between saves: %0.1f secs" % site.throttle.writedelay)
+    if self.dead_letters:
+      msg("%s pages failed and were skipped:" % len(self.dead_letters))
+      for index, title, error in self.dead_letters:
+        msg("Page %s %s: %s" % (index, title, error))
+
+retry_policy = RetryPolicy()
+
+# Use a RetryPolicy with the given arguments. If ADAPTIVE, also watch for the
+# server reporting lag, which pywikibot handles by pausing, so the delay
+# between saves can be lengthened.
+def set_retry_policy(max_tries=5, adaptive=False):
+  global retry_policy
+  retry_policy = RetryPolicy(max_tries=max_tries, adaptive=adaptive)
+  if adaptive:
+    throttle_lag = site.throttle.lag
+    def lag(lagtime=None):
+      retry_policy.note_lag(lagtime)
+      throttle_lag(lagtime)
+    site.throttle.lag = lag
+
+# Expand TEXT as if on page TITLE on the server, retrying after transient
+# errors.
+def server_expand_text(text, title):
+  return retry_policy.call("expand", site.expand_text, text, title=title)
+
+# Save PAGE (with index INDEX) with comment COMMENT, updating the page text
+# cache and run journal if enabled.
+def save_page(page, index, comment):
+  retry_policy.call("save", page.save, comment = comment)
+  retry_policy.saved()
+  if page_cache:
+    page_cache.store(page)
+  journal_page(index, page.title(), "saved", comment)
+
+# If SAVER is given, it should be a PageSaver object, and the save is queued
+# on it rather than done directly; see do_edits(). If PREFILTER is given, it
+# should be a TextPrefilter object, and pages whose text it rejects are
+# skipped without being parsed or passed to FUNC.
+def do_edit(page, index, func=None, null=False, save=False, verbose=False,
+    saver=None, prefilter=None):
   title = page.title()
-  def pagemsg(text):
-    msg("Page %s %s: %s" % (index, title, text))
+  def pagemsg(text, action=None, **fields):
+    page_message(index, title, text, action, **fields)
+  tries = 0
   while True:
     try:
-      if func:
+      retry_policy.call("fetch", lambda: page.text)
+      if func and prefilter and not prefilter(page.text):
+        pagemsg("Skipped, no candidate templates", "skip",
+            comment="no candidate templates")
+        journal_page(index, title, "skipped", "no candidate templates")
+      elif func:
         if verbose:
           pagemsg("Begin processing")
         new, comment = func(page, index, parse(page))
@@ -106,42 +670,243 @@ def do_edit(page, index, func=None, null=False, save=False, verbose=False):
           if reorder_shadda(page.text) != reorder_shadda(new):
             if verbose:
               pagemsg('Replacing <%s> with <%s>' % (page.text, new))
+            if save and page_cache and not page_cache.is_current(page):
+              pagemsg("Cached text out of date, refetching")
+              page.text = page.get(force=True)
+              page_cache.store(page)
+              continue
+            oldtext = page.text
             page.text = new
             if save:
-              pagemsg("Saving with comment = %s" % comment)
-              page.save(comment = comment)
+              pagemsg("Saving with comment = %s" % comment, "save",
+                  comment=comment)
+              if saver:
+                saver.queue_save(page, index, comment)
+              else:
+                save_page(page, index, comment)
             else:
-              pagemsg("Would save with comment = %s" % comment)
+              pagemsg("Would save with comment = %s" % comment,
+                  "would-save", comment=comment)
+              journal_page(index, title, "would save", comment)
+              plan_edit(index, title, known_revid(page), oldtext, new,
+                  comment)
           elif null:
             pagemsg('Purged page cache')
             page.purge(forcelinkupdate = True)
+            journal_page(index, title, "purged")
           else:
-            pagemsg('Skipped, no changes')
+            pagemsg('Skipped, no changes', "skip", comment="no changes")
+            journal_page(index, title, "no changes")
         elif null:
           pagemsg('Purged page cache')
           page.purge(forcelinkupdate = True)
+          journal_page(index, title, "purged")
         else:
-          pagemsg('Skipped: %s' % comment)
+          pagemsg('Skipped: %s' % comment, "skip", comment=comment)
+          journal_page(index, title, "skipped", comment)
       else:
         pagemsg('Purged page cache')
         page.purge(forcelinkupdate = True)
+        journal_page(index, title, "purged")
     except (pywikibot.LockedPage, pywikibot.NoUsername):
-      errmsg(u'Page %s %s: Skipped, page is protected' % (index, title))
-    except urllib2.HTTPError as e:
-      if e.code != 503:
-        raise
+      pagemsg('Skipped, page is protected', "skip", outfun=errmsg,
+          comment="page is protected")
+      journal_page(index, title, "protected")
+    except RetryFailed as e:
+      pagemsg('Skipped, %s' % e, "skip", outfun=errmsg, comment=unicode(e))
+      retry_policy.dead_letter(index, title, e)
     except:
-      errmsg(u'Page %s %s: Error' % (index, title))
-      raise
+      # Transient errors from requests not made through retry_policy (e.g.
+      # by FUNC) are retried by processing the page again.
+      error = sys.exc_info()[1]
+      if not retry_policy.is_transient(error):
+        pagemsg('Error', "error", outfun=errmsg)
+        raise
+      tries += 1
+      if tries < retry_policy.max_tries:
+        retry_policy.wait("process", error, tries)
+        continue
+      error = RetryFailed("process", error, tries)
+      pagemsg('Skipped, %s' % error, "skip", outfun=errmsg,
+          comment=unicode(error))
+      retry_policy.dead_letter(index, title, error)
 
     break
 
-def do_process_text(pagetitle, pagetext, index, func=None, verbose=False):
-  def pagemsg(text):
-    msg("Page %s %s: %s" % (index, pagetitle, text))
+# Thread that saves pages queued by do_edit() in the order they were queued.
+# pywikibot's edit throttle is applied by page.save() as usual, so this
+# doesn't save any faster than a plain loop, but the saves no longer hold up
+# fetching and processing of the following pages.
+class PageSaver(threading.Thread):
+  def __init__(self, maxqueued):
+    super(PageSaver, self).__init__()
+    self.daemon = True
+    self.queue = Queue.Queue(maxqueued)
+    self.error = None
+    # Map from page title to the number of its last queued save (the first
+    # save queued is 1), and the number of saves done so far, for
+    # wait_for().
+    self.queued_titles = {}
+    self.num_queued = 0
+    self.num_done = 0
+    self.done = threading.Condition()
+
+  def run(self):
+    while True:
+      item = self.queue.get()
+      if item is None:
+        return
+      page, index, comment = item
+      self.save(page, index, comment)
+      with self.done:
+        self.num_done += 1
+        self.done.notify_all()
+      if self.error:
+        return
+
+  # Save PAGE, setting self.error to stop the saver on an unexpected error.
+  def save(self, page, index, comment):
+    try:
+      save_page(page, index, comment)
+    except (pywikibot.LockedPage, pywikibot.NoUsername):
+      page_message(index, page.title(), 'Skipped, page is protected', "skip",
+          outfun=errmsg, comment="page is protected")
+      journal_page(index, page.title(), "protected")
+    except RetryFailed as e:
+      page_message(index, page.title(), 'Skipped, %s' % e, "skip",
+          outfun=errmsg, comment=unicode(e))
+      retry_policy.dead_letter(index, page.title(), e)
+    except:
+      page_message(index, page.title(), 'Error when saving', "error",
+          outfun=errmsg)
+      self.error = sys.exc_info()
+
+  # Re-raise in the calling thread an error that stopped the saver.
+  def check_error(self):
+    if self.error:
+      raise self.error[0], self.error[1], self.error[2]
+
+  def queue_save(self, page, index, comment):
+    self.check_error()
+    self.num_queued += 1
+    self.queued_titles[page.title()] = self.num_queued
+    self.queue.put((page, index, comment))
+
+  # Wait until the save numbered SEQ (see queued_titles) is done.
+  def wait_for(self, seq):
+    with self.done:
+      while self.num_done < seq and not self.error:
+        self.done.wait(1)
+    self.check_error()
+
+  # Wait for all queued saves to finish, without checking for an error. If
+  # the saver has stopped on an error, there's nothing left to wait for (and
+  # the queue may be full), so don't block trying to queue the end marker.
+  def drain(self):
+    while self.is_alive():
+      try:
+        self.queue.put(None, timeout=1)
+        break
+      except Queue.Full:
+        pass
+    self.join()
+
+# Number of threads used by do_edits() to fetch page text ahead of the page
+# currently being processed; set by --workers.
+num_workers = 1
+
+# Fetch the text of the page in JOB, a list [PAGE, EVENT], then set EVENT.
+# Errors are ignored here; they'll occur again when the page is processed
+# and be handled by do_edit() in the usual way.
+def prefetch_page(jobs):
   while True:
+    job = jobs.get()
+    if job is None:
+      return
+    page, fetched = job
     try:
-      if func:
+      page.text
+    except:
+      pass
+    fetched.set()
+
+# Call do_edit() on each (PAGE, INDEX) pair in PAGEINDS, as returned by the
+# page iterators. An element can also be (PAGE, INDEX, FUNC) to use a
+# callback specific to that page instead of FUNC. The remaining arguments
+# are as for do_edit(). If num_workers > 1 (--workers), run as a pipeline:
+# a pool of num_workers threads fetches page text ahead of the page being
+# processed, the callback FUNC runs in this thread in page order (so output
+# and any state kept by FUNC are exactly as in a plain loop), and saves are
+# handed to a single PageSaver thread that does them in order. A page that
+# occurs more than once (e.g. when pushing several changes to it from a
+# list) is refetched after the earlier save of it is done.
+def do_edits(pageinds, func=None, null=False, save=False, verbose=False,
+    prefilter=None):
+  def page_func(pageind):
+    if len(pageind) == 3:
+      return pageind
+    page, index = pageind
+    return page, index, func
+
+  if num_workers <= 1:
+    for pageind in pageinds:
+      page, index, pagefunc = page_func(pageind)
+      do_edit(page, index, pagefunc, null=null, save=save, verbose=verbose,
+          prefilter=prefilter)
+    return
+
+  jobs = Queue.Queue()
+  fetchers = [threading.Thread(target=prefetch_page, args=(jobs,))
+      for i in xrange(num_workers)]
+  for fetcher in fetchers:
+    fetcher.daemon = True
+    fetcher.start()
+  saver = PageSaver(2 * num_workers)
+  saver.start()
+  pending = collections.deque()
+
+  def process_next():
+    page, index, pagefunc, fetched = pending.popleft()
+    fetched.wait()
+    seq = saver.queued_titles.get(page.title())
+    if seq:
+      # The text may have been fetched before the earlier save was done.
+      saver.wait_for(seq)
+      page.text = retry_policy.call("fetch", lambda: page.get(force=True))
+    do_edit(page, index, pagefunc, null=null, save=save, verbose=verbose,
+        saver=saver, prefilter=prefilter)
+
+  try:
+    for pageind in pageinds:
+      page, index, pagefunc = page_func(pageind)
+      fetched = threading.Event()
+      pending.append((page, index, pagefunc, fetched))
+      jobs.put((page, fetched))
+      # Bound the lookahead so we don't fetch arbitrarily far ahead.
+      if len(pending) > 2 * num_workers:
+        process_next()
+    while pending:
+      process_next()
+  finally:
+    for fetcher in fetchers:
+      jobs.put(None)
+    # Do the saves already queued even if processing stopped on an error
+    # (including Ctrl-C); do_edit() has already logged them as being saved,
+    # and the saver is a daemon thread, so they'd be lost on exit.
+    saver.drain()
+  saver.check_error()
+
+def do_process_text(pagetitle, pagetext, index, func=None, verbose=False,
+    prefilter=None):
+  def pagemsg(text, action=None, **fields):
+    page_message(index, pagetitle, text, action, **fields)
+  while True:
+    try:
+      if func and prefilter and not prefilter(pagetext):
+        pagemsg("Skipped, no candidate templates", "skip",
+            comment="no candidate templates")
+        journal_page(index, pagetitle, "skipped", "no candidate templates")
+      elif func:
         if verbose:
           pagemsg("Begin processing")
         new, comment = func(pagetitle, index, parse_text(pagetext))
@@ -158,26 +923,130 @@ def do_process_text(pagetitle, pagetext, index, func=None, verbose=False):
             #  pagemsg("Saving with comment = %s" % comment)
             #  page.save(comment = comment)
             #else:
-            pagemsg("Would save with comment = %s" % comment)
+            pagemsg("Would save with comment = %s" % comment, "would-save",
+                comment=comment)
+            journal_page(index, pagetitle, "would save", comment)
+            plan_edit(index, pagetitle, None, pagetext, new, comment)
           else:
-            pagemsg('Skipped, no changes')
+            pagemsg('Skipped, no changes', "skip", comment="no changes")
+            journal_page(index, pagetitle, "no changes")
         else:
-          pagemsg('Skipped: %s' % comment)
+          pagemsg('Skipped: %s' % comment, "skip", comment=comment)
+          journal_page(index, pagetitle, "skipped", comment)
     except:
-      errmsg(u'Page %s %s: Error' % (index, pagetitle))
+      pagemsg('Error', "error", outfun=errmsg)
       raise
 
     break
 
+# Number of processes used by do_process_texts(); set by --processes.
+num_processes = 1
+
+# Arguments to do_process_text() in subprocesses, set before the process
+# pool is created so that they're inherited (they're often closures, which
+# can't be pickled).
+subprocess_args = None
+
+def process_text_in_subprocess(pageind):
+  global msg_capture
+  (pagetitle, pagetext), index = pageind
+  func, verbose, statsfun, prefilter = subprocess_args
+  msg_capture = []
+  if journal:
+    journal.capture = []
+  if event_log:
+    event_log.capture = []
+  if edit_plan:
+    edit_plan.capture = []
+  error = None
+  # Discard any statistics inherited from the parent process.
+  if statsfun:
+    statsfun()
+  if translit_memo:
+    translit_memo.take_stats()
+  take_fast_parse_stats()
+  try:
+    do_process_text(pagetitle, pagetext, index, func, verbose=verbose,
+        prefilter=prefilter)
+  except:
+    error = traceback.format_exc()
+  output = "".join(msg_capture)
+  msg_capture = None
+  journal_entries = journal and journal.capture
+  events = event_log and event_log.capture
+  plan_entries = edit_plan and edit_plan.capture
+  memo_stats = translit_memo and translit_memo.take_stats()
+  return (output, statsfun and statsfun(), journal_entries, events,
+      plan_entries, memo_stats, take_fast_parse_stats(), error)
+
+# Call do_process_text() on each ((PAGETITLE, PAGETEXT), INDEX) pair in
+# PAGEINDS, as returned by iter_pages() on a list of (PAGETITLE, PAGETEXT)
+# entries; FUNC, VERBOSE and PREFILTER are as for do_process_text(). If
+# num_processes > 1 (--processes), the pages are sharded across a pool of
+# processes; each page's output is collected in the subprocess and written
+# out here in index order, so the log is the same as for a single-process
+# run. If FUNC keeps statistics, STATSFUN should return them and reset them
+# (it's called in the subprocess after each page), and MERGEFUN is called
+# here with each page's statistics to merge them into the totals.
+def do_process_texts(pageinds, func=None, verbose=False, statsfun=None,
+    mergefun=None, prefilter=None):
+  global subprocess_args
+  if num_processes <= 1:
+    for (pagetitle, pagetext), index in pageinds:
+      do_process_text(pagetitle, pagetext, index, func, verbose=verbose,
+          prefilter=prefilter)
+    return
+
+  subprocess_args = (func, verbose, statsfun, prefilter)
+  pool = multiprocessing.Pool(num_processes)
+  try:
+    for (output, stats, journal_entries, events, plan_entries, memo_stats,
+        parse_stats, error) in pool.imap(process_text_in_subprocess,
+            pageinds, chunksize=16):
+      sys.stdout.write(output)
+      if journal_entries:
+        journal.write_entries(journal_entries)
+      if events:
+        event_log.write_events(events)
+      if plan_entries:
+        edit_plan.write_entries(plan_entries)
+      if memo_stats:
+        translit_memo.merge_stats(memo_stats)
+      merge_fast_parse_stats(parse_stats)
+      if error:
+        raise RuntimeError("Error in subprocess:\n%s" % error)
+      if mergefun:
+        mergefun(stats)
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+    subprocess_args = None
+
 ignore_prefixes = ["User:", "Talk:",
     "Wiktionary:Beer parlour", "Wiktionary:Translation requests",
     "Wiktionary:Grease pit", "Wiktionary:Etymology scriptorium",
     "Wiktionary:Information desk"]
 
-def iter_pages(pageiter, startsort = None, endsort = None, key = None):
-  i = 0
+# If PAGEITER doesn't start at the beginning of the enumeration (e.g. it
+# comes from seek_index.iter_list()), SKIPPED is the number of items it
+# skipped, so that indices come out right. If PAGEITER is an API list,
+# LISTKEY identifies it (see list_key()), so that a run journal can record
+# how far through the list the run has got.
+def iter_pages(pageiter, startsort = None, endsort = None, key = None,
+    skipped = 0, listkey = None):
+  return load_pages(iter_unloaded_pages(pageiter, startsort, endsort, key,
+    skipped, listkey))
+
+def iter_unloaded_pages(pageiter, startsort = None, endsort = None, key = None,
+    skipped = 0, listkey = None):
+  i = skipped
   t = None
   steps = 50
+  progress = None
+  if journal and listkey:
+    progress = journal.list_progress(listkey,
+        startsort - 1 if isinstance(startsort, int) else 0)
 
   for current in pageiter:
     i += 1
@@ -212,7 +1081,13 @@ def iter_pages(pageiter, startsort = None, endsort = None, key = None):
         is_ignore_prefix = True
     if " talk:" in pagetitle:
       is_ignore_prefix = True
-    if not is_ignore_prefix:
+    # Skip pages finished in the run being resumed (--resume).
+    if is_ignore_prefix or journal and pagetitle in journal.done:
+      if progress:
+        journal.skip(i, progress)
+    else:
+      if progress:
+        journal.expect(i, pagetitle, progress)
       yield current, i
 
     if i % steps == 0:
@@ -228,34 +1103,97 @@ def iter_pages(pageiter, startsort = None, endsort = None, key = None):
       errmsg(str(i) + "/" + str(endsort) + tdisp)
 
 
+# Yield (PAGE, INDEX) for the pages of the API list PARAMS (see SeekIndex)
+# from STARTSORT to ENDSORT, where PAGEITER is a function returning an
+# iterator over the whole list done the usual way (e.g. using
+# Category.articles()). When resuming a run (--resume), start after the
+# pages at the start of the list that the run finished (see RunJournal).
+# If we're starting at a numeric index and have a seek index
+# (--seek-index), read the list from the recorded continuation point
+# before the start rather than listing it from the beginning.
+def iter_list_pages(params, startsort, endsort, pageiter):
+  # A string STARTSORT starts at a sort key, and indices count from there.
+  listkey = None if isinstance(startsort, basestring) else list_key(params)
+  if journal and listkey:
+    through = journal.done_through.get(listkey, 0)
+    if through >= (startsort or 1):
+      msg("Resuming at index %s of %s" % (through + 1, listkey))
+      startsort = through + 1
+  if seek_index and isinstance(startsort, int):
+    pageiter, skipped = seek_index.iter_list(params, startsort - 1)
+  else:
+    pageiter, skipped = pageiter(), 0
+  return iter_pages(pageiter, startsort, endsort, skipped=skipped,
+      listkey=listkey)
+
 def references(page, startsort = None, endsort = None, namespaces = None, includelinks = False):
-  if isinstance(page, basestring):
-    page = pywikibot.Page(site, page)
-  pageiter = page.getReferences(onlyTemplateInclusion = not includelinks,
-      namespaces = namespaces)
+  if dump_source:
+    if not isinstance(page, basestring):
+      page = unicode(page.title())
+    pageiter = dump_source.references(page, namespaces=namespaces,
+        includelinks=includelinks)
+  elif not includelinks:
+    if not isinstance(page, basestring):
+      page = unicode(page.title())
+    params = {"list": "embeddedin", "eititle": page, "eilimit": "max"}
+    if namespaces is not None:
+      if not isinstance(namespaces, list):
+        namespaces = [namespaces]
+      params["einamespace"] = "|".join(str(ns) for ns in namespaces)
+    for pageind in iter_list_pages(params, startsort, endsort,
+        lambda: pywikibot.Page(site, page).getReferences(
+          onlyTemplateInclusion = True, namespaces = namespaces)):
+      yield pageind
+    return
+  else:
+    if isinstance(page, basestring):
+      page = pywikibot.Page(site, page)
+    pageiter = page.getReferences(onlyTemplateInclusion = False,
+        namespaces = namespaces)
   for pageind in iter_pages(pageiter, startsort, endsort):
     yield pageind
 
 def cat_articles(page, startsort = None, endsort = None):
   if type(page) is str:
     page = page.decode("utf-8")
-  if isinstance(page, basestring):
-    page = pywikibot.Category(site, "Category:" + page)
-  pageiter = page.articles(startsort = startsort if not isinstance(startsort, int) else None)
+  if dump_source:
+    if not isinstance(page, basestring):
+      page = page.title(withNamespace=False)
+    pageiter = dump_source.articles(page,
+        startsort = startsort if not isinstance(startsort, int) else None)
+  else:
+    if isinstance(page, basestring):
+      page = pywikibot.Category(site, "Category:" + page)
+    params = {"list": "categorymembers", "cmtitle": unicode(page.title()),
+        "cmtype": "page|file", "cmlimit": "max"}
+    for pageind in iter_list_pages(params, startsort, endsort,
+        lambda: page.articles(startsort = startsort
+          if not isinstance(startsort, int) else None)):
+      yield pageind
+    return
   for pageind in iter_pages(pageiter, startsort, endsort):
     yield pageind
 
 def cat_subcats(page, startsort = None, endsort = None):
   if type(page) is str:
     page = page.decode("utf-8")
-  if isinstance(page, basestring):
-    page = pywikibot.Category(site, "Category:" + page)
-  pageiter = page.subcategories() #no startsort; startsort = startsort if not isinstance(startsort, int) else None)
-  for pageind in iter_pages(pageiter, startsort, endsort):
+  if dump_source:
+    if not isinstance(page, basestring):
+      page = page.title(withNamespace=False)
+    pageiter = dump_source.subcategories(page)
+  else:
+    if isinstance(page, basestring):
+      page = pywikibot.Category(site, "Category:" + page)
+    pageiter = page.subcategories() #no startsort; startsort = startsort if not isinstance(startsort, int) else None)
+  # Don't preload the text of category pages, which isn't normally needed.
+  for pageind in iter_unloaded_pages(pageiter, startsort, endsort):
     yield pageind
 
 def prefix(prefix, startsort = None, endsort = None, namespace = None):
-  pageiter = site.prefixindex(prefix, namespace)
+  if dump_source:
+    pageiter = dump_source.prefixindex(prefix, namespace)
+  else:
+    pageiter = site.prefixindex(prefix, namespace)
   for pageind in iter_pages(pageiter, startsort, endsort):
     yield pageind
 
@@ -278,6 +1216,1121 @@ def stream(st, startsort = None, endsort = None):
     yield pywikibot.Page(site, name)
 
 
+# Open a possibly compressed dump file for reading, based on its extension.
+def open_dump_file(filename):
+  if filename.endswith(".bz2"):
+    return bz2.BZ2File(filename, "r")
+  elif filename.endswith(".gz"):
+    return gzip.open(filename, "r")
+  else:
+    return open(filename, "r")
+
+# Iterate over the log files in FILENAME, yielding (NAME, FILE) for each
+# with FILE open for reading. FILENAME may be a tar archive, possibly
+# compressed, whose members are streamed one after another without being
+# extracted (NAME is the member name; the "._" resource-fork members that
+# macOS tar adds are skipped), or a single log, possibly compressed.
+def iter_log_files(filename):
+  if re.search(r"\.(tar(\.bz2|\.gz)?|tbz2?|tgz)$", filename):
+    tar = tarfile.open(filename, "r|*")
+    try:
+      for member in tar:
+        if member.isfile() and not (
+            os.path.basename(member.name).startswith("._")):
+          yield member.name, tar.extractfile(member)
+    finally:
+      tar.close()
+  else:
+    yield filename, open_dump_file(filename)
+
+sql_row_re = re.compile(r"\(((?:'(?:[^'\\]|\\.)*'|[^'()])*)\)")
+sql_field_re = re.compile(r"'((?:[^'\\]|\\.)*)'|([^,]+)")
+sql_escapes = {"n": "\n", "r": "\r", "t": "\t", "0": "\0", "Z": "\x1a"}
+
+def sql_unescape(value):
+  return re.sub(r"\\(.)", lambda m: sql_escapes.get(m.group(1), m.group(1)),
+      value)
+
+# Yield the rows of TABLE in a MySQL dump file (e.g. the
+# enwiktionary-*-categorylinks.sql.gz dumps) as lists of field values.
+# Quoted fields are returned as unescaped Unicode strings, other fields as
+# the raw text of the field (e.g. "123" or "NULL").
+def sql_dump_rows(filename, table):
+  insert_prefix = "INSERT INTO `%s` VALUES " % table
+  for line in open_dump_file(filename):
+    if not line.startswith(insert_prefix):
+      continue
+    line = line[len(insert_prefix):].decode("utf-8", "replace")
+    for row in sql_row_re.finditer(line):
+      yield [sql_unescape(quoted) if unquoted == "" else unquoted
+          for quoted, unquoted in sql_field_re.findall(row.group(1))]
+
+# Namespaces we may need to recognize in titles passed to the dump-based
+# iterators, which can't consult the site's namespace info without going
+# online.
+dump_namespaces = {"Talk": 1, "User": 2, "User talk": 3, "Wiktionary": 4,
+    "File": 6, "Image": 6, "MediaWiki": 8, "Template": 10, "Help": 12,
+    "Category": 14, "Appendix": 100, "Rhymes": 106, "Thesaurus": 110,
+    "Citations": 114, "Reconstruction": 118, "Module": 828}
+
+def split_dump_title(title):
+  m = re.match("^(.*?):(.*)$", title)
+  if m and m.group(1) in dump_namespaces:
+    return dump_namespaces[m.group(1)], m.group(2)
+  return 0, title
+
+# A page read from an XML dump. Supports the parts of the pywikibot.Page
+# interface used by do_edit() and the page iterators: title(), namespace(),
+# text and latest_revision_id. Saving and purging aren't possible since the
+# page doesn't come from the live site.
+class DumpPage(object):
+  def __init__(self, title, ns, pageid, revid, text):
+    self._title = title
+    self.ns = ns
+    self.pageid = pageid
+    self.latest_revision_id = revid
+    self.text = text
+
+  def title(self, withNamespace=True):
+    if withNamespace or self.ns == 0:
+      return self._title
+    return re.sub("^.*?:", "", self._title)
+
+  def namespace(self):
+    return self.ns
+
+  def exists(self):
+    return True
+
+  def save(self, *args, **kwargs):
+    raise pywikibot.Error("Can't save page [[%s]] read from dump"
+        % self._title)
+
+  def purge(self, *args, **kwargs):
+    raise pywikibot.Error("Can't purge page [[%s]] read from dump"
+        % self._title)
+
+  def __repr__(self):
+    return "DumpPage(%r)" % self._title
+
+# Page source backed by local dump files rather than the live API. XMLFILE
+# is a pages-articles XML dump (optionally .bz2 or .gz compressed), which is
+# streamed with an incremental parser so memory use is bounded by the size
+# of the result being collected rather than the size of the dump.
+# CATLINKS_FILE and TEMPLATELINKS_FILE are the corresponding categorylinks
+# and templatelinks SQL dumps, needed for category and reference
+# enumeration respectively.
+class DumpSource(object):
+  def __init__(self, xmlfile, catlinks_file=None, templatelinks_file=None):
+    self.xmlfile = xmlfile
+    self.catlinks_file = catlinks_file
+    self.templatelinks_file = templatelinks_file
+
+  # Yield all pages in the dump, in dump order.
+  def iter_pages(self):
+    for entry in xmlreader.XmlDump(self.xmlfile).parse():
+      yield DumpPage(entry.title, int(entry.ns), int(entry.id),
+          int(entry.revisionid), entry.text)
+
+  # Return a dictionary mapping each page ID in PAGEIDS that occurs in the
+  # dump to its DumpPage, using one pass over the dump.
+  def pages_by_ids(self, pageids):
+    pageids = set(pageids)
+    pages = {}
+    for page in self.iter_pages():
+      if page.pageid in pageids:
+        pages[page.pageid] = page
+        if len(pages) == len(pageids):
+          break
+    return pages
+
+  # Return a dictionary mapping each title in TITLES that occurs in the
+  # dump to its DumpPage, using one pass over the dump.
+  def pages_by_titles(self, titles):
+    titles = set(titles)
+    pages = {}
+    for page in self.iter_pages():
+      if page.title() in titles:
+        pages[page.title()] = page
+        if len(pages) == len(titles):
+          break
+    return pages
+
+  # Yield the pages with IDs in PAGEIDS, a list of (SORTKEY, PAGEID) tuples,
+  # in sort order.
+  def yield_sorted_pages(self, pageids):
+    pages = self.pages_by_ids(pageid for sortkey, pageid in pageids)
+    for sortkey, pageid in sorted(pageids):
+      if pageid in pages:
+        yield pages[pageid]
+
+  # Return a list of (SORTKEY, PAGEID) for the members of category CAT
+  # (without the Category: prefix) of type MEMBERTYPE ('page', 'subcat' or
+  # 'file').
+  def category_members(self, cat, membertype):
+    if not self.catlinks_file:
+      raise ValueError("Category enumeration from dump requires a categorylinks dump")
+    cat = cat.replace(" ", "_")
+    members = []
+    for row in sql_dump_rows(self.catlinks_file, "categorylinks"):
+      # cl_from, cl_to, cl_sortkey, cl_timestamp, cl_sortkey_prefix,
+      # cl_collation, cl_type
+      if row[1] == cat and row[6] == membertype:
+        members.append((row[2], int(row[0])))
+    return members
+
+  def articles(self, cat, startsort=None):
+    members = self.category_members(cat, "page")
+    for page in self.yield_sorted_pages(members):
+      if startsort and page.title(withNamespace=False) < startsort:
+        continue
+      yield page
+
+  def subcategories(self, cat):
+    return self.yield_sorted_pages(self.category_members(cat, "subcat"))
+
+  # Yield the pages transcluding TITLE (e.g. "Template:t+"), optionally
+  # restricted to NAMESPACES (a namespace number or list of them).
+  def references(self, title, namespaces=None, includelinks=False):
+    if includelinks:
+      raise ValueError("Link references aren't supported from dump, only template inclusions")
+    if not self.templatelinks_file:
+      raise ValueError("Reference enumeration from dump requires a templatelinks dump")
+    if namespaces is not None and not isinstance(namespaces, list):
+      namespaces = [namespaces]
+    ns, name = split_dump_title(title)
+    name = name.replace(" ", "_")
+    pageids = []
+    for row in sql_dump_rows(self.templatelinks_file, "templatelinks"):
+      # tl_from, tl_namespace, tl_title, tl_from_namespace
+      if (row[2] == name and int(row[1]) == ns and
+          (namespaces is None or int(row[3]) in namespaces)):
+        pageids.append((int(row[0]), int(row[0])))
+    return self.yield_sorted_pages(pageids)
+
+  # Yield the pages in NAMESPACE (default the main namespace) whose titles
+  # begin with PREFIX, in title order.
+  def prefixindex(self, prefix, namespace=None):
+    namespace = namespace or 0
+    pages = [page for page in self.iter_pages()
+        if page.ns == namespace and
+        page.title(withNamespace=False).startswith(prefix)]
+    return iter(sorted(pages, key=lambda page: page.title()))
+
+dump_source = None
+
+# Make the page iterators (cat_articles(), cat_subcats(), references() and
+# prefix()) read from local dump files instead of the live API. See
+# DumpSource for the meaning of the arguments. Pass None for XMLFILE to go
+# back to the live API.
+def set_dump_source(xmlfile, catlinks_file=None, templatelinks_file=None):
+  global dump_source
+  if xmlfile:
+    dump_source = DumpSource(xmlfile, catlinks_file, templatelinks_file)
+  else:
+    dump_source = None
+
+
+# Persistent cache of page text, keyed by title and revision ID, stored in
+# the SQLite database FILENAME. Pages are checked for staleness in batches
+# with a single lightweight revision-ID query per batch; only pages whose
+# latest revision isn't in the cache are downloaded, and those are fetched
+# in one batched request as well.
+class PageTextCache(object):
+  def __init__(self, filename):
+    # The connection may be used by the PageSaver thread as well as the
+    # main thread, so serialize access ourselves.
+    self.conn = sqlite3.connect(filename, check_same_thread=False)
+    self.lock = threading.Lock()
+    self.conn.execute("""CREATE TABLE IF NOT EXISTS pages
+      (title TEXT PRIMARY KEY, revid INTEGER, text TEXT)""")
+    self.hits = 0
+    self.misses = 0
+    # Revision ID of the cached text we set for each page, so we can check
+    # before saving that it hasn't changed in the meantime.
+    self.revids_used = {}
+
+  # Return a dictionary mapping each of TITLES to the ID of its latest
+  # revision, using one API request. Nonexistent pages are omitted.
+  def get_latest_revids(self, titles):
+    req = pywikibot.data.api.Request(action="query",
+        prop = "revisions",
+        rvprop = "ids",
+        titles = "|".join(titles),
+        site = site
+        )
+    result = req.submit()["query"]
+    normalized = dict((norm["to"], norm["from"]) for norm in
+        result.get("normalized", []))
+    revids = {}
+    for pageinfo in result["pages"].values():
+      if "revisions" in pageinfo:
+        title = pageinfo["title"]
+        revids[normalized.get(title, title)] = pageinfo["revisions"][0]["revid"]
+    return revids
+
+  # Cache the text of PAGE, which is that of its latest revision, so it's no
+  # longer checked by is_current().
+  def store(self, page):
+    title = unicode(page.title())
+    with self.lock:
+      self.conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+          (title, page.latest_revision_id, page.text))
+      self.conn.commit()
+      self.revids_used.pop(title, None)
+
+  # Set the text of the pywikibot.Page objects in PAGES, from the cache where
+  # possible, otherwise by fetching and caching it.
+  def load_batch(self, pages):
+    titles = [unicode(page.title()) for page in pages]
+    revids = self.get_latest_revids(titles)
+    stale = []
+    for page, title in zip(pages, titles):
+      revid = revids.get(title)
+      if revid is None:
+        # Nonexistent page; let pywikibot deal with it.
+        continue
+      with self.lock:
+        row = self.conn.execute(
+            "SELECT text FROM pages WHERE title = ? AND revid = ?",
+            (title, revid)).fetchone()
+      if row:
+        page.text = row[0]
+        self.revids_used[title] = revid
+        self.hits += 1
+      else:
+        stale.append(page)
+        self.misses += 1
+    if stale:
+      for page in retry_policy.call("fetch",
+          lambda: list(site.preloadpages(stale))):
+        self.store(page)
+
+  # True if PAGE's text wasn't set from the cache or the revision it came
+  # from is still the latest one.
+  def is_current(self, page):
+    revid = self.revids_used.get(unicode(page.title()))
+    return revid is None or page.latest_revision_id == revid
+
+  def msg_stats(self):
+    total = self.hits + self.misses
+    msg("Page text cache: %s hits, %s misses (%0.1f%% hit rate)" % (
+      self.hits, self.misses, total and 100.0 * self.hits / total or 0))
+
+page_cache = None
+
+# Cache page text in the SQLite database FILENAME; see PageTextCache.
+# Pass None to disable caching.
+def set_page_cache(filename):
+  global page_cache
+  page_cache = filename and PageTextCache(filename) or None
+
+# Persistent cache of template expansions, stored in the SQLite database
+# FILENAME. The key is a hash of the wikitext, the page title and the
+# latest revision IDs of the pages the expansion depends on: the templates
+# and modules named directly in the wikitext (in {{NAME|...}} or
+# {{#invoke:NAME|...}}) together with everything those pages transclude or
+# require, as recorded by the server. Revision IDs are looked up once per
+# run for each set of directly named pages, so edits made to a module
+# during a run aren't seen until the next run. At most MAXSIZE entries are
+# kept; beyond that the least recently used are evicted. Error results
+# aren't cached.
+class ExpandCache(object):
+  def __init__(self, filename, maxsize=200000):
+    self.conn = sqlite3.connect(filename, check_same_thread=False)
+    self.conn.execute("""CREATE TABLE IF NOT EXISTS expansions
+      (key TEXT PRIMARY KEY, deps TEXT, result TEXT, lastused REAL)""")
+    self.lock = threading.Lock()
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+    self.dep_revids = {}
+
+  # Return the pages directly referenced by template calls or #invoke's
+  # in TEXT.
+  def direct_deps(self, text):
+    deps = set()
+    for name in re.findall(r"\{\{\s*([^{}|]+?)\s*[|}]", text):
+      m = re.match("#invoke:(.*)$", name)
+      if m:
+        deps.add("Module:" + m.group(1).strip())
+      elif not name.startswith("#") and ":" not in name:
+        deps.add("Template:" + name)
+    return frozenset(deps)
+
+  # Return a string listing the pages the expansion of TEXT depends on,
+  # with their latest revision IDs.
+  def get_dep_revids(self, text):
+    direct = self.direct_deps(text)
+    if direct not in self.dep_revids:
+      revids = {}
+      direct_list = sorted(direct)
+      # The API takes at most 50 titles per request.
+      for i in xrange(0, len(direct_list), 50):
+        titles = "|".join(direct_list[i:i + 50])
+        for params in [{"titles": titles},
+            {"generator": "templates", "titles": titles, "gtllimit": "max"}]:
+          # Follow continuations, or a page transcluding many templates would
+          # leave some of them out of the key.
+          cont = {"continue": ""}
+          while True:
+            reqparams = dict(params)
+            reqparams.update(cont)
+            req = pywikibot.data.api.Request(action="query",
+                prop = "revisions", rvprop = "ids", site = site, **reqparams)
+            result = req.submit()
+            for pageinfo in result.get("query", {}).get("pages", {}).values():
+              if "revisions" in pageinfo:
+                revids[pageinfo["title"]] = pageinfo["revisions"][0]["revid"]
+            if "continue" not in result:
+              break
+            cont = result["continue"]
+      self.dep_revids[direct] = "|%s|" % "|".join("%s=%s" % (title, revid)
+          for title, revid in sorted(revids.items()))
+    return self.dep_revids[direct]
+
+  def key(self, text, title):
+    deps = self.get_dep_revids(text)
+    return hashlib.sha1(json.dumps([text, title, deps])).hexdigest(), deps
+
+  # Return the cached expansion of TEXT on page TITLE, or None.
+  def lookup(self, text, title):
+    key, deps = self.key(text, title)
+    with self.lock:
+      row = self.conn.execute("SELECT result FROM expansions WHERE key = ?",
+          (key,)).fetchone()
+      if row:
+        self.hits += 1
+        self.conn.execute("UPDATE expansions SET lastused = ? WHERE key = ?",
+            (time.time(), key))
+        self.conn.commit()
+        return row[0]
+    self.misses += 1
+    return None
+
+  def store(self, text, title, result):
+    if result.startswith('<strong class="error">'):
+      return
+    key, deps = self.key(text, title)
+    with self.lock:
+      self.conn.execute(
+          "INSERT OR REPLACE INTO expansions VALUES (?, ?, ?, ?)",
+          (key, deps, result, time.time()))
+      self.evict()
+      self.conn.commit()
+
+  def expand(self, text, title):
+    result = self.lookup(text, title)
+    if result is None:
+      result = server_expand_text(text, title)
+      self.store(text, title, result)
+    return result
+
+  # Evict least recently used entries, 10% of MAXSIZE at a time, if there
+  # are more than MAXSIZE.
+  def evict(self):
+    size = self.conn.execute("SELECT COUNT(*) FROM expansions").fetchone()[0]
+    if size > self.maxsize:
+      self.conn.execute("""DELETE FROM expansions WHERE key IN
+        (SELECT key FROM expansions ORDER BY lastused LIMIT ?)""",
+        (size - self.maxsize + self.maxsize // 10,))
+
+  # Remove cached expansions depending on page DEP (e.g. "Module:ar-verb"),
+  # or all of them if DEP is None. Return the number removed.
+  def invalidate(self, dep=None):
+    with self.lock:
+      if dep:
+        cur = self.conn.execute("DELETE FROM expansions WHERE deps LIKE ?",
+            ("%%|%s=%%" % dep,))
+      else:
+        cur = self.conn.execute("DELETE FROM expansions")
+      self.conn.commit()
+    return cur.rowcount
+
+  def msg_stats(self):
+    total = self.hits + self.misses
+    msg("Expansion cache: %s hits, %s misses (%0.1f%% hit rate)" % (
+      self.hits, self.misses, total and 100.0 * self.hits / total or 0))
+
+expand_cache = None
+
+# Cache template expansions in the SQLite database FILENAME; see
+# ExpandCache. Pass None to disable caching.
+def set_expand_cache(filename):
+  global expand_cache
+  expand_cache = filename and ExpandCache(filename) or None
+
+# Memo of the results of the transliteration functions of the translit
+# modules (tr(), tr_matching(), etc.), which canon runs call over and over
+# on the same text, e.g. for common translations. A function is memoized by
+# decorating it with @translit_memoized, which has an effect only if
+# memoization is turned on with set_translit_memo() (--translit-memo).
+# Results are keyed on the function and its arguments other than MSGFUN
+# (with defaults filled in, so that f(x) and f(x, err=False) are the same).
+# The messages the function outputs through MSGFUN are captured, and
+# replayed to the caller's MSGFUN on every call, so the log is the same as
+# without the memo; exceptions are remembered and reraised in the same way.
+# At most MAXSIZE results are kept; beyond that the least recently used are
+# evicted.
+class TranslitMemo(object):
+  def __init__(self, maxsize=50000):
+    self.entries = collections.OrderedDict()
+    self.maxsize = maxsize
+    self.hits = collections.Counter()
+    self.misses = collections.Counter()
+
+  # Call FUN, named NAME, with the list of all its arguments ARGS (the
+  # one at MSGFUN_POS, if not None, being the function for messages),
+  # or return the remembered result of doing so.
+  def call(self, name, fun, args, msgfun_pos):
+    if msgfun_pos is None:
+      key = (name,) + tuple(args)
+      msgfun = None
+    else:
+      key = (name,) + tuple(args[:msgfun_pos]) + tuple(args[msgfun_pos + 1:])
+      msgfun = args[msgfun_pos]
+    entry = self.entries.pop(key, None)
+    if entry is None:
+      self.misses[name] += 1
+      messages = []
+      if msgfun_pos is not None:
+        args = list(args)
+        args[msgfun_pos] = messages.append
+      try:
+        entry = (fun(*args), None, messages)
+      except Exception as e:
+        entry = (None, e, messages)
+    else:
+      self.hits[name] += 1
+    self.entries[key] = entry
+    if len(self.entries) > self.maxsize:
+      self.entries.popitem(last=False)
+    result, error, messages = entry
+    for message in messages:
+      msgfun(message)
+    if error:
+      raise error
+    return result
+
+  # Return the hits and misses since the last call and reset them; used to
+  # collect statistics from subprocesses (see do_process_texts()).
+  def take_stats(self):
+    stats = (self.hits, self.misses)
+    self.hits = collections.Counter()
+    self.misses = collections.Counter()
+    return stats
+
+  def merge_stats(self, stats):
+    self.hits.update(stats[0])
+    self.misses.update(stats[1])
+
+  def msg_stats(self):
+    for name in [None] + sorted(set(self.hits) | set(self.misses)):
+      if name:
+        hits = self.hits[name]
+        misses = self.misses[name]
+      else:
+        hits = sum(self.hits.values())
+        misses = sum(self.misses.values())
+      total = hits + misses
+      msg("Translit memo%s: %s hits, %s misses (%0.1f%% hit rate)" % (
+        name and " (%s)" % name or "", hits, misses,
+        total and 100.0 * hits / total or 0))
+
+translit_memo = None
+
+# Memoize FUN, a transliteration function, in translit_memo if it's
+# enabled; see TranslitMemo.
+def translit_memoized(fun):
+  argnames, varargs, varkw, defaults = inspect.getargspec(fun)
+  defaults = defaults or ()
+  name = "%s.%s" % (fun.__module__, fun.__name__)
+  msgfun_pos = argnames.index("msgfun") if "msgfun" in argnames else None
+  @functools.wraps(fun)
+  def memoized(*args, **kwargs):
+    if not translit_memo or len(args) > len(argnames):
+      return fun(*args, **kwargs)
+    args = list(args)
+    for i in xrange(len(args), len(argnames)):
+      if argnames[i] in kwargs:
+        args.append(kwargs.pop(argnames[i]))
+      elif i >= len(argnames) - len(defaults):
+        args.append(defaults[i - len(argnames) + len(defaults)])
+      else:
+        return fun(*args, **kwargs)
+    if kwargs:
+      return fun(*args, **kwargs)
+    return translit_memo.call(name, fun, args, msgfun_pos)
+  return memoized
+
+# Memoize transliteration functions, keeping at most MAXSIZE results; see
+# TranslitMemo. Pass 0 to disable memoization.
+def set_translit_memo(maxsize):
+  global translit_memo
+  translit_memo = maxsize and TranslitMemo(maxsize) or None
+
+# Return the source of module TITLE (e.g. "Module:ar-verb") for the local
+# Lua sandbox, from the dump if reading from one, else from the site; None
+# if there's no such module.
+def fetch_module_source(title):
+  if dump_source:
+    page = dump_source.pages_by_titles([title]).get(title)
+    return page and page.text
+  page = pywikibot.Page(site, title)
+  return page.text if page.exists() else None
+
+local_lua = None
+
+# Expand #invoke's and wrapper templates locally where possible, using the
+# Lua modules in this directory and in MODULE_DIRS; see
+# lua_sandbox.LuaSandbox. Modules found in neither are fetched once and
+# saved in the first of MODULE_DIRS, if any.
+def set_local_lua(module_dirs=None):
+  global local_lua
+  module_dirs = module_dirs or []
+  for dirname in module_dirs[0:1]:
+    if not os.path.isdir(dirname):
+      os.makedirs(dirname)
+  local_lua = lua_sandbox.LuaSandbox(
+    [os.path.dirname(os.path.abspath(__file__))] + module_dirs,
+    fetch=fetch_module_source, save_dir=module_dirs and module_dirs[0])
+
+# Number of pages whose text is fetched together in one request by
+# load_pages(), or 0 to fetch each page's text when it's first accessed.
+# This is also the lookahead: at most this many pages are pulled from the
+# underlying page enumeration before being yielded.
+preload_batch_size = 0
+# The API won't return more than this many page texts per request (and only
+# 50 for non-bot accounts, in which case pywikibot splits the request).
+max_preload_batch_size = 500
+
+def set_preload_batch_size(size):
+  global preload_batch_size
+  preload_batch_size = min(size, max_preload_batch_size)
+
+# Given an iterator over (PAGE, INDEX) pairs, as returned by
+# iter_unloaded_pages(), load the text of pywikibot.Page objects in batches
+# (through the page text cache, if enabled) and yield the same pairs. Other
+# items (e.g. page titles or pages from a dump) are passed through as-is.
+def load_pages(pageinds):
+  batch_size = preload_batch_size or (page_cache and 50)
+  if not batch_size:
+    for pageind in pageinds:
+      yield pageind
+    return
+  batch = []
+  for pageind in pageinds:
+    batch.append(pageind)
+    if len(batch) >= batch_size:
+      for pageind in load_page_batch(batch):
+        yield pageind
+      batch = []
+  for pageind in load_page_batch(batch):
+    yield pageind
+
+def load_page_batch(batch):
+  pages = [page for page, index in batch if isinstance(page, pywikibot.Page)]
+  if pages:
+    if page_cache:
+      page_cache.load_batch(pages)
+    else:
+      retry_policy.call("fetch",
+          lambda: list(site.preloadpages(pages, groupsize=len(pages))))
+  return batch
+
+# Index of API continuation points for category and reference
+# enumerations, stored in the SQLite database FILENAME, so that an
+# enumeration can be started at index N (e.g. cat_articles(CAT, 20000))
+# without listing the N - 1 pages before it, and so that different index
+# ranges of one enumeration can be handed to different runs. A continuation
+# point is recorded for the start of each batch (500 or 5000 pages,
+# depending on the account's API limits) whenever an enumeration is
+# listed. Since pages may have been added or removed since the point was
+# recorded, indices reached by seeking may be off by the net number of
+# such changes before that point.
+class SeekIndex(object):
+  def __init__(self, filename):
+    self.conn = sqlite3.connect(filename)
+    self.conn.execute("""CREATE TABLE IF NOT EXISTS seekpoints
+      (listkey TEXT, pos INTEGER, cont TEXT, PRIMARY KEY (listkey, pos))""")
+
+  # Return (ITERATOR, SKIPPED) where ITERATOR yields pywikibot.Page objects
+  # for the API list described by PARAMS (e.g. {"list": "categorymembers",
+  # "cmtitle": ...}), starting at or before the (0-based) position SKIP,
+  # and SKIPPED is the position of the first page it yields.
+  def iter_list(self, params, skip):
+    listkey = list_key(params)
+    row = self.conn.execute("""SELECT pos, cont FROM seekpoints
+      WHERE listkey = ? AND pos <= ? ORDER BY pos DESC LIMIT 1""",
+      (listkey, skip)).fetchone()
+    if row:
+      pos, cont = row[0], json.loads(row[1])
+    else:
+      pos, cont = 0, {"continue": ""}
+    return self.yield_list(listkey, params, pos, cont), pos
+
+  def yield_list(self, listkey, params, pos, cont):
+    while True:
+      self.conn.execute("INSERT OR REPLACE INTO seekpoints VALUES (?, ?, ?)",
+          (listkey, pos, json.dumps(cont)))
+      self.conn.commit()
+      reqparams = dict(params)
+      reqparams.update(cont)
+      req = pywikibot.data.api.Request(action="query", site=site,
+          **reqparams)
+      result = req.submit()
+      for pageinfo in result["query"][params["list"]]:
+        pos += 1
+        yield pywikibot.Page(site, pageinfo["title"])
+      if "continue" not in result:
+        return
+      cont = result["continue"]
+
+seek_index = None
+
+# Return the key identifying the API list PARAMS in SeekIndex and
+# RunJournal.
+def list_key(params):
+  return json.dumps(params, sort_keys=True)
+
+# Record and use API continuation points in the SQLite database FILENAME;
+# see SeekIndex. Pass None to disable.
+def set_seek_index(filename):
+  global seek_index
+  seek_index = filename and SeekIndex(filename) or None
+
+# Directory holding run journals.
+journal_dir = "blib-runs"
+
+# Append-only journal of the pages completed in a run, identified by RUNID,
+# stored in JOURNAL_DIR/RUNID.journal. Each line is a JSON object giving the
+# index and title of a page, the result of processing it ("saved",
+# "would save", "no changes", "skipped", "purged" or "protected") and the
+# changelog, if any. Lines are flushed to disk as they're written, so after
+# a crash the journal records exactly the pages that were finished. If
+# RESUME, read the existing journal for RUNID and skip the pages it
+# records (see iter_unloaded_pages()); pages that failed with an error
+# aren't recorded, so they're retried.
+#
+# For pages from category and reference lists, an entry also records,
+# whenever it changes, how far the run has got through the list: "list",
+# the list's key (see list_key()), and "through", the index up to which
+# every page of the list was finished (or skipped, e.g. as a talk page).
+# A resumed run starts the list after that index (see iter_list_pages()),
+# which with --seek-index avoids listing those pages again.
+class RunJournal(object):
+  def __init__(self, runid, resume=False):
+    self.runid = runid
+    self.filename = os.path.join(journal_dir, runid + ".journal")
+    self.done = set()
+    # Map from list key to the "through" index read from the journal.
+    self.done_through = {}
+    # Map from list key to the ListProgress of the list in this run, and
+    # from title to (INDEX, PROGRESS) for pages yielded from a list but not
+    # yet recorded.
+    self.progress = {}
+    self.pending = {}
+    # When not None, a list to which entries are added rather than being
+    # written; used in subprocesses, whose entries are written by the
+    # parent process (see do_process_texts()).
+    self.capture = None
+    self.lock = threading.Lock()
+    if resume:
+      if not os.path.exists(self.filename):
+        raise ValueError("No journal for run ID %s" % runid)
+      for line in open(self.filename):
+        try:
+          entry = json.loads(line)
+        except ValueError:
+          # Partly written last line after a crash.
+          continue
+        # Pages that failed (see RetryPolicy) are tried again.
+        if entry["result"] != "failed":
+          self.done.add(entry["title"])
+        if "through" in entry:
+          self.done_through[entry["list"]] = max(entry["through"],
+              self.done_through.get(entry["list"], 0))
+    elif not os.path.isdir(journal_dir):
+      os.makedirs(journal_dir)
+    self.fp = open(self.filename, "a")
+    # Terminate a partly written last line so new entries start afresh.
+    if resume and os.path.getsize(self.filename) > 0:
+      with open(self.filename) as fp:
+        fp.seek(-1, os.SEEK_END)
+        if fp.read() != "\n":
+          self.fp.write("\n")
+
+  def write_entries(self, entries):
+    with self.lock:
+      for entry in entries:
+        self.fp.write(json.dumps(entry) + "\n")
+      self.fp.flush()
+      os.fsync(self.fp.fileno())
+
+  # Return the ListProgress for the list LISTKEY, starting a new one in
+  # which the pages up through index THROUGH count as finished.
+  def list_progress(self, listkey, through):
+    with self.lock:
+      self.progress[listkey] = ListProgress(listkey, through)
+      return self.progress[listkey]
+
+  # Note that the page TITLE at INDEX in the list with progress PROGRESS is
+  # being processed, so that recording it advances the list's progress.
+  def expect(self, index, title, progress):
+    with self.lock:
+      self.pending[title] = (index, progress)
+
+  # Note that the page at INDEX in the list with progress PROGRESS is
+  # skipped, so counts as finished.
+  def skip(self, index, progress):
+    with self.lock:
+      progress.finish(index)
+
+  def record(self, index, title, result, comment=None):
+    entry = {"index": index, "title": unicode(title), "result": result}
+    if comment:
+      entry["comment"] = comment
+    with self.lock:
+      expected = self.pending.pop(entry["title"], None)
+      if expected and expected[0] == index and result != "failed":
+        progress = expected[1]
+        through = progress.through
+        progress.finish(index)
+        if progress.through != through:
+          entry["list"] = progress.listkey
+          entry["through"] = progress.through
+    if self.capture is not None:
+      self.capture.append(entry)
+    else:
+      self.write_entries([entry])
+
+# How far a run has got through an API list: THROUGH is the index up to
+# which every page of the list is finished, and FINISHED holds the indices
+# of pages finished after a gap.
+class ListProgress(object):
+  def __init__(self, listkey, through):
+    self.listkey = listkey
+    self.through = through
+    self.finished = set()
+
+  def finish(self, index):
+    self.finished.add(index)
+    while self.through + 1 in self.finished:
+      self.through += 1
+      self.finished.remove(self.through)
+
+journal = None
+
+# Start journaling completed pages under run ID RUNID, or if RESUME, resume
+# the run RUNID; see RunJournal.
+def set_journal(runid, resume=False):
+  global journal
+  journal = RunJournal(runid, resume)
+  msg("%s run %s" % ("Resuming" if resume else "Journaling", runid))
+  if resume:
+    msg("Skipping %s pages already done" % len(journal.done))
+
+def journal_page(index, title, result, comment=None):
+  if journal:
+    journal.record(index, title, result, comment)
+
+# Machine-readable log of a run's page messages (--event-log), written
+# alongside the usual output so that log tools needn't parse the text. Each
+# message output by page_message() becomes a line in FILENAME holding a JSON
+# object with the fields "time", "index", "page", "action" and "text" (the
+# message without the page and param prefixes), "run" if there's a run ID
+# (--run-id), and "tempname" and "param" if the message is about a
+# template param. The fields passed by the caller depend on the action:
+#
+# "replace": "before" and "after", the old and new templates;
+# "process": "template", the template being processed;
+# "warning": "code", the warning's code; if the caller doesn't give one, it
+#   comes from WARNING_CODES, or failing that is a slug made from the fixed
+#   words at the start of the warning (e.g. "unable-to-match-canon-arabic");
+# "save", "would-save", "skip": "comment", the changelog or skip reason;
+# "error": none;
+# "message": anything else.
+class EventLog(object):
+  # Codes of warnings whose wording starts with variable text, as pairs of
+  # (CODE, REGEX) where REGEX matches the warning after "WARNING: ".
+  warning_codes = [
+    ("latin-has-cyrillic", r"^Latin text .* contains Cyrillic characters$"),
+    ("russian-has-latin", r"^Russian .* has Latin chars in it after"),
+    ("russian-has-one-char-latin-word",
+      r"^Russian .* has one-char Latin word in it"),
+    ("russian-grave-accent", r"^Russian .* has a grave accent$"),
+    ("latin-grave-accent", r"^Latin .* has a grave accent$"),
+    ("russian-multiple-accents", r"^Russian .* has multiple .* accents$"),
+    ("latin-multiple-accents", r"^Latin .* has multiple .* accents$"),
+    ("missing-smooth-breathing",
+      r"^Text .* may be missing a smooth-breathing sign"),
+    ("expansion-error", r"^Got error: "),
+    ("page-not-in-dump", r"^Page not found in dump"),
+  ]
+  warning_re = re.compile(r"^WARNING[:,] *(.*)$", re.S)
+  slug_word_re = re.compile(r"^([A-Za-z][A-Za-z'-]*)([,:.;]?)$")
+  # Used only by parse_message().
+  page_re = re.compile(r"^Page ([^ ]+) (.+?): (.*)$", re.S)
+  param_re = re.compile(r"^([^:{}|]+?)\.([A-Za-z0-9]+): (.*)$", re.S)
+
+  def __init__(self, filename, runid=None):
+    self.runid = runid
+    self.fp = open(filename, "a")
+    # When not None, a list to which events are added rather than being
+    # written; used in subprocesses, as for RunJournal.
+    self.capture = None
+    self.lock = threading.Lock()
+
+  def write_events(self, events):
+    with self.lock:
+      for event in events:
+        self.fp.write(json.dumps(event, ensure_ascii=False).encode("utf-8")
+            + "\n")
+      self.fp.flush()
+
+  # Split "X with Y", where X and Y are templates, at the " with " following
+  # the end of X.
+  @staticmethod
+  def split_replacement(text):
+    pos = 0
+    while True:
+      pos = text.find(" with ", pos)
+      if pos < 0:
+        return None
+      before = text[:pos]
+      if before.count("{{") == before.count("}}"):
+        return before, text[pos + 6:]
+      pos += 1
+
+  # Return the code of the warning TEXT (without "WARNING: ").
+  @classmethod
+  def warning_code(cls, text):
+    for code, regex in cls.warning_codes:
+      if re.search(regex, text, re.S):
+        return code
+    words = []
+    for word in text.split(" ")[:6]:
+      m = cls.slug_word_re.match(word)
+      if not m:
+        break
+      words.append(m.group(1).replace("'", "").lower())
+      if m.group(2):
+        break
+    return "-".join(words) or "unknown"
+
+  # Record the message TEXT about page TITLE with index INDEX; see
+  # page_message().
+  def page_event(self, index, title, text, action=None, **fields):
+    event = {"index": index, "page": unicode(title), "text": text}
+    if not action:
+      m = self.warning_re.match(text)
+      action = "warning" if m else "message"
+      if m and not fields.get("code"):
+        fields["code"] = self.warning_code(m.group(1))
+    elif action == "warning" and not fields.get("code"):
+      m = self.warning_re.match(text)
+      fields["code"] = self.warning_code(m.group(1) if m else text)
+    event["action"] = action
+    for field, value in fields.items():
+      if value is not None:
+        event[field] = value
+    event["time"] = time.time()
+    if self.runid:
+      event["run"] = self.runid
+    if self.capture is not None:
+      self.capture.append(event)
+    else:
+      self.write_events([event])
+
+  # Parse TEXT, a line of a text log of the form "Page INDEX TITLE: ...",
+  # into an event without the "time" and "run" fields, classifying it by its
+  # wording; return None if TEXT isn't of that form. Used only to index old
+  # logs made without --event-log (see index_run_logs.py). A title
+  # containing ": " can't be told apart from the message, so is cut short.
+  @classmethod
+  def parse_message(cls, text):
+    m = cls.page_re.match(text)
+    if not m:
+      return None
+    index, title, rest = m.groups()
+    event = {"index": int(index) if index.isdigit() else index,
+        "page": title, "text": rest}
+    m = cls.param_re.match(rest)
+    if m:
+      event["tempname"], event["param"], rest = m.groups()
+      event["text"] = rest
+    m = cls.warning_re.match(rest)
+    if m:
+      event["action"] = "warning"
+      event["code"] = cls.warning_code(m.group(1))
+    elif rest.startswith("Replaced ") and cls.split_replacement(rest[9:]):
+      event["action"] = "replace"
+      event["before"], event["after"] = cls.split_replacement(rest[9:])
+    elif rest.startswith("Processing "):
+      event["action"] = "process"
+      event["template"] = rest[11:]
+    elif rest.startswith("Saving with comment = "):
+      event["action"] = "save"
+      event["comment"] = rest[22:]
+    elif rest.startswith("Would save with comment = "):
+      event["action"] = "would-save"
+      event["comment"] = rest[26:]
+    elif rest.startswith("Skipped"):
+      event["action"] = "skip"
+      event["comment"] = re.sub("^Skipped[:,] *", "", rest)
+    elif rest.startswith("Error"):
+      event["action"] = "error"
+    else:
+      event["action"] = "message"
+    return event
+
+def set_event_log(filename):
+  global event_log
+  event_log = EventLog(filename, journal and journal.runid)
+
+# Plan of the edits that a dry run would make (--write-plan), written to
+# FILENAME one JSON object per line with the fields "title", "index",
+# "revid" (the revision the new text was computed from, or None if unknown,
+# e.g. for --cattype pagetext), "sha1" (the SHA-1 of that revision's text),
+# "text" (the new text) and "comment". A later run with --apply-plan saves
+# the edits without recomputing them; see apply_plan(). FILENAME is
+# overwritten unless APPEND, as when resuming a run (--resume), in which
+# case pages redone by the resumed run get a second entry, which replaces
+# the first (see iter_plan()).
+class EditPlan(object):
+  def __init__(self, filename, append=False):
+    self.fp = open(filename, "a" if append else "w")
+    # When not None, a list to which entries are added rather than being
+    # written; used in subprocesses, as for RunJournal.
+    self.capture = None
+    self.lock = threading.Lock()
+
+  def write_entries(self, entries):
+    with self.lock:
+      for entry in entries:
+        self.fp.write(json.dumps(entry) + "\n")
+      self.fp.flush()
+
+  def record(self, index, title, revid, oldtext, newtext, comment):
+    entry = {"title": unicode(title), "index": index, "revid": revid,
+        "sha1": hashlib.sha1(oldtext.encode("utf-8")).hexdigest(),
+        "text": newtext, "comment": comment}
+    if self.capture is not None:
+      self.capture.append(entry)
+    else:
+      self.write_entries([entry])
+
+edit_plan = None
+
+def set_edit_plan(filename, append=False):
+  global edit_plan
+  edit_plan = EditPlan(filename, append)
+
+def plan_edit(index, title, revid, oldtext, newtext, comment):
+  if edit_plan:
+    edit_plan.record(index, title, revid, oldtext, newtext, comment)
+
+# Iterate over the entries in the edit plan FILENAME (see EditPlan). Only
+# the last entry for each page is used, so the file is read twice rather
+# than holding the new text of every page in memory. A script that edits
+# a page more than once in a run (e.g. create_inflections.py) makes each
+# dry-run edit from the same revision, so all but the last of them would
+# be lost; warn about such pages, whose edits need a --save run instead.
+def iter_plan(filename):
+  def read_entries():
+    for line in open_dump_file(filename):
+      try:
+        yield json.loads(line)
+      except ValueError:
+        # Partly written last line after a crash.
+        continue
+  last_entry = {}
+  dropped = collections.Counter()
+  for i, entry in enumerate(read_entries()):
+    title = entry["title"]
+    texthash = hashlib.sha1(entry["text"].encode("utf-8")).hexdigest()
+    if title in last_entry:
+      _, revid, sha1, lasthash = last_entry[title]
+      # An entry repeated with the same text, e.g. by a resumed run, loses
+      # nothing.
+      if (revid, sha1) == (entry["revid"], entry["sha1"]) and (
+          lasthash != texthash):
+        dropped[title] += 1
+    last_entry[title] = (i, entry["revid"], entry["sha1"], texthash)
+  for i, entry in enumerate(read_entries()):
+    title = entry["title"]
+    if dropped[title] and last_entry[title][0] == i:
+      page_message(entry["index"], title,
+          "WARNING: %s earlier edit(s) made from the same revision are lost, only the last edit is applied"
+          % dropped[title], "warning", code="plan-edits-lost")
+    if last_entry[title][0] == i:
+      yield entry
+
+# Make the edits in the edit plan FILENAME (see EditPlan) for the entries
+# from STARTSORT to ENDSORT, without running the script that made the plan.
+# An edit is skipped if its page has changed since the plan was made, i.e.
+# its latest revision isn't the one the edit was computed from or, if
+# that's unknown, its text isn't the same. If SAVE, save the edits, else
+# just check for conflicts.
+def apply_plan(filename, save, verbose, startsort=None, endsort=None):
+  for entry, index in iter_pages(iter_plan(filename), startsort, endsort,
+      key=lambda entry: entry["title"]):
+    title = entry["title"]
+    def pagemsg(text, action=None, **fields):
+      page_message(index, title, text, action, **fields)
+    page = pywikibot.Page(site, title)
+    try:
+      text = retry_policy.call("fetch", lambda: page.get(get_redirect=True))
+      if entry["revid"] is not None:
+        changed = page.latest_revision_id != entry["revid"]
+      else:
+        changed = hashlib.sha1(text.encode("utf-8")).hexdigest() != (
+            entry["sha1"])
+      if changed:
+        pagemsg("Skipped, page changed since plan was made", "skip",
+            comment="page changed since plan was made")
+        journal_page(index, title, "conflict")
+        continue
+      if verbose:
+        pagemsg("Replacing <%s> with <%s>" % (text, entry["text"]))
+      page.text = entry["text"]
+      if save:
+        pagemsg("Saving with comment = %s" % entry["comment"], "save",
+            comment=entry["comment"])
+        save_page(page, index, entry["comment"])
+      else:
+        pagemsg("Would save with comment = %s" % entry["comment"],
+            "would-save", comment=entry["comment"])
+        journal_page(index, title, "would save", entry["comment"])
+    except pywikibot.NoPage:
+      pagemsg("Skipped, page changed since plan was made", "skip",
+          comment="page changed since plan was made")
+      journal_page(index, title, "conflict")
+    except pywikibot.EditConflict:
+      pagemsg('Skipped, edit conflict', "skip", outfun=errmsg,
+          comment="edit conflict")
+      journal_page(index, title, "conflict")
+    except (pywikibot.LockedPage, pywikibot.NoUsername):
+      pagemsg('Skipped, page is protected', "skip", outfun=errmsg,
+          comment="page is protected")
+      journal_page(index, title, "protected")
+    except RetryFailed as e:
+      pagemsg('Skipped, %s' % e, "skip", outfun=errmsg, comment=unicode(e))
+      retry_policy.dead_letter(index, title, e)
+
+# Iterate over the events in FILENAME, written by EventLog, optionally only
+# those with one of the actions in ACTIONS.
+def iter_events(filename, actions=None):
+  with open(filename) as fp:
+    for line in fp:
+      try:
+        event = json.loads(line)
+      except ValueError:
+        # Partly written last line after a crash.
+        continue
+      if not actions or event["action"] in actions:
+        yield event
+
 def get_args(args = sys.argv[1:]):
   startsort = None
   endsort = None
@@ -304,13 +2357,133 @@ def parse_start_end(startsort, endsort):
 
 starttime = time.time()
 
+# Argument parser returned by init_argparser(). After parsing, it applies
+# the arguments that configure blib itself (e.g. --dump-file) so that
+# scripts don't have to do it themselves.
+class BlibArgumentParser(argparse.ArgumentParser):
+  def parse_args(self, args=None, namespace=None):
+    params = super(BlibArgumentParser, self).parse_args(args, namespace)
+    process_blib_args(self, params)
+    return params
+
+def process_blib_args(pa, params):
+  global num_workers, num_processes
+  if params.dump_file:
+    if params.save:
+      pa.error("--save can't be used with --dump-file")
+    set_dump_source(params.dump_file, params.categorylinks_file,
+        params.templatelinks_file)
+  if params.page_cache:
+    set_page_cache(params.page_cache)
+  if params.expand_cache:
+    set_expand_cache(params.expand_cache)
+  if params.fast_parse:
+    set_fast_parse()
+  if params.translit_memo:
+    set_translit_memo(params.translit_memo)
+  if params.local_lua or params.lua_module_dir:
+    set_local_lua(params.lua_module_dir)
+  if params.preload:
+    set_preload_batch_size(params.preload)
+  if params.seek_index:
+    set_seek_index(params.seek_index)
+  if params.resume:
+    set_journal(params.resume, resume=True)
+  elif params.run_id:
+    set_journal(params.run_id)
+  if params.event_log:
+    set_event_log(params.event_log)
+  if params.maxlag is not None:
+    pywikibot.config.maxlag = params.maxlag
+  set_retry_policy(params.max_tries, params.adaptive_edit_rate)
+  if params.write_plan:
+    if params.save:
+      pa.error("--write-plan is for dry runs and can't be used with --save")
+    set_edit_plan(params.write_plan, append=bool(params.resume))
+  if params.apply_plan:
+    if params.dump_file or params.write_plan:
+      pa.error("--apply-plan can't be used with --dump-file or --write-plan")
+    startsort, endsort = parse_start_end(params.start, params.end)
+    apply_plan(params.apply_plan, params.save, params.verbose, startsort,
+        endsort)
+    elapsed_time()
+    sys.exit(0)
+  num_workers = params.workers
+  num_processes = params.processes
+
 def init_argparser(desc):
   msg("Beginning at %s" % time.ctime(starttime))
-  pa = argparse.ArgumentParser(description=desc)
+  pa = BlibArgumentParser(description=desc)
   pa.add_argument("-s", "--save", action='store_true',
       help="Save changed pages")
   pa.add_argument("-v", "--verbose", action='store_true',
       help="Show changes in detail")
+  pa.add_argument("--dump-file",
+      help="""Read pages from this XML dump (e.g. pages-articles.xml.bz2)
+instead of the live site""")
+  pa.add_argument("--categorylinks-file",
+      help="Categorylinks SQL dump to use for categories with --dump-file")
+  pa.add_argument("--templatelinks-file",
+      help="Templatelinks SQL dump to use for references with --dump-file")
+  pa.add_argument("--page-cache",
+      help="SQLite file in which to cache page text between runs")
+  pa.add_argument("--expand-cache",
+      help="SQLite file in which to cache template expansions between runs")
+  pa.add_argument("--fast-parse", action='store_true',
+      help="""Parse only the templates on each page rather than doing a full
+parse, which is faster; only for scripts that look at nothing else""")
+  pa.add_argument("--translit-memo", type=int, default=0,
+      help="""Remember the results of transliteration functions (tr(),
+tr_matching(), etc.) for this many texts (e.g. 50000), rather than
+recomputing them each time the same text occurs""")
+  pa.add_argument("--local-lua", action='store_true',
+      help="""Expand #invoke's of Lua modules and simple wrapper templates
+around them locally where possible, rather than on the server""")
+  pa.add_argument("--lua-module-dir", action="append",
+      help="""Directory with additional Lua modules (named as the .lua files
+here are) for --local-lua; modules not available locally are fetched and
+saved in the first such directory. Implies --local-lua""")
+  pa.add_argument("--preload", type=int, default=0,
+      help="""Fetch page text in batches of this many pages (e.g. 50) rather
+than one page at a time""")
+  pa.add_argument("--workers", type=int, default=1,
+      help="""Number of threads fetching pages ahead of the one being
+processed, with saves done in a separate thread (default 1, no pipelining)""")
+  pa.add_argument("--processes", type=int, default=1,
+      help="""Number of processes to spread offline processing across
+(--cattype pagetext, or pages read from --dump-file)""")
+  pa.add_argument("--seek-index",
+      help="""SQLite file recording positions in category and reference
+lists, so that a numeric start page can be reached without listing all the
+pages before it""")
+  pa.add_argument("--run-id",
+      help="""Record the pages done in this run in a journal under this ID,
+so the run can be resumed with --resume if interrupted""")
+  pa.add_argument("--resume", metavar="RUNID",
+      help="""Resume the run with the given ID, skipping pages already done;
+with --seek-index, category and reference lists start after the pages done in
+order from their start rather than being listed again""")
+  pa.add_argument("--max-tries", type=int, default=5,
+      help="""Number of times to try fetching, expanding or saving before
+giving up on a page after transient server errors (default 5)""")
+  pa.add_argument("--maxlag", type=int,
+      help="""Ask the server to refuse requests while its database lag is
+more than this many seconds, pausing until it recovers (pywikibot's default
+is 5)""")
+  pa.add_argument("--adaptive-edit-rate", action="store_true",
+      help="""Adjust the delay between saves to how the server is coping,
+speeding up while saves succeed and slowing down on lag or errors""")
+  pa.add_argument("--write-plan",
+      help="""In a dry run, record the edits that would be made (new text and
+comment for each page) in this file, for a later run with --apply-plan; the
+file is overwritten unless resuming a run with --resume""")
+  pa.add_argument("--apply-plan",
+      help="""Instead of running the script, make the edits recorded in this
+plan file by --write-plan (save them with --save), skipping pages changed
+since the plan was made""")
+  pa.add_argument("--event-log",
+      help="""File to which to append a JSON line for each page message
+(replacements, warnings, saves, etc.), for log tools to read""")
   pa.add_argument("start", nargs="?", help="First page to work on")
   pa.add_argument("end", nargs="?", help="Last page to work on")
   return pa
@@ -326,6 +2499,19 @@ def elapsed_time():
     msg("Elapsed time: %s hours %s mins %0.2f secs" % (hours, mins, secs))
   else:
     msg("Elapsed time: %s mins %0.2f secs" % (mins, secs))
+  if page_cache:
+    page_cache.msg_stats()
+  if expand_cache:
+    expand_cache.msg_stats()
+  if fast_parse:
+    msg("Fast parse: %s pages, %s of them needing a full parse" % (
+      fast_parse_pages, fast_parse_fallbacks))
+  if local_lua:
+    msg("Local Lua expansions: %s done locally, %s on the server" % (
+      local_lua.local_expansions, local_lua.server_expansions))
+  if translit_memo:
+    translit_memo.msg_stats()
+  retry_policy.msg_stats()
   msg("Ending at %s" % time.ctime(endtime))
 
 def remove_links(text):
@@ -408,6 +2594,181 @@ def getEtymLanguageData():
     etym_languages_byCode[etyl["code"]] = etyl
     etym_languages_byCanonicalName[etyl["canonicalName"]] = etyl
 
+# Registry of the link-like templates handled by process_links(), mapping
+# template names to lists of parameter specs. Each spec is a dictionary:
+#
+#   "when": if given, a parameter that must be non-empty for the spec to
+#      be chosen;
+#   "unless": if given, a parameter that must be empty for the spec to be
+#      chosen;
+#   "lang": the parameter that must hold the language code for the chosen
+#      spec to be applied ("1", "2" or "lang"), or None for templates
+#      registered for a particular language, which don't need one;
+#   "groups": a list of groups of (PARAM, TRPARAM) alternatives; in each
+#      group, the first PARAM that's non-empty is processed, with TRPARAM
+#      (possibly None) as the transliteration param;
+#   "numbered": a group of alternatives as for "groups", but with %s in
+#      the param names to be filled in with 1, 2, ...; the numbers go up to
+#      "max" if given, otherwise until a param is empty. If "count_once" is
+#      given, the template counts once in the statistics of templates seen
+#      and changed, rather than once for each param;
+#   "warn": a warning to output, with %s replaced by the template;
+#   "warn_code": the warning's code in the event log (see EventLog).
+#
+# The first spec in the list whose "when" and "unless" conditions hold is
+# chosen, and applied if its "lang" param matches; otherwise, the template
+# is left alone. Templates not listed use the specs in
+# default_link_template_specs, unless skipped (see skip_link_template()).
+# Templates registered for a particular language (lang_link_templates) take
+# precedence over those for all languages. Use add_link_templates() to add
+# templates, e.g. for a new language.
+link_templates = {}
+lang_link_templates = {}
+
+# Specs for templates not otherwise listed: {{m|ar|<PAGENAME>|<ARABICTEXT>}},
+# {{m|ar|<PAGENAME>|alt=<ARABICTEXT>}} or {{m|ar|<ARABICTEXT>}}, but if "1"
+# matches, don't do templates with a lang= as well, e.g. we don't want to do
+# {{hyphenation|ru|men|lang=sh}} in Russian because it's actually lang sh;
+# otherwise {{term|lang=ar|<PAGENAME>|<ARABICTEXT>}} etc. (but beware of
+# {{borrowing|en|<ENGLISHTEXT>|lang=ar}}, handled separately).
+default_link_template_specs = [
+  {"lang": "1", "unless": "lang",
+    "groups": [[("alt", "tr"), ("3", "tr"), ("2", "tr")]]},
+  {"lang": "lang", "groups": [[("alt", "tr"), ("2", "tr"), ("1", "tr")]]},
+]
+
+# Skip {{attention|ar|FOO}} or {{etyl|ar|FOO}} or {{audio|FOO|lang=ar}}
+# or {{lb|ar|FOO}} or {{context|FOO|lang=ar}} or {{Babel-2|ar|FOO}}
+# or various others, where FOO is not Arabic, and {{w|FOO|lang=ar}}
+# or {{wikipedia|FOO|lang=ar}} or {{pedia|FOO|lang=ar}} etc., where
+# FOO is Arabic but diacritics aren't stripped so shouldn't be added.
+skipped_link_templates = frozenset([
+  "attention",
+  "audio", "audio-IPA",
+  "catlangcode", "C", "catlangname",
+  "commonscat",
+  "etyl", "etym",
+  "gloss",
+  "label", "lb", "lbl", "context", "cx",
+  "non-gloss definition", "non-gloss", "non gloss", "n-g",
+  "qualifier", "qual", "i", "italbrac",
+  "rfe", "rfinfl",
+  "sense", "italbrac-colon",
+  "senseid",
+  "given name",
+  "+preo", "IPA", "phrasebook", "PIE root", "surname", "Q", "was fwotd",
+  # skip Wikipedia templates
+  "wikipedia", "w", "pedialite", "pedia"])
+
+def skip_link_template(tempname):
+  return (tempname in skipped_link_templates
+    # More Wiki-etc. templates
+    or tempname.startswith("projectlink")
+    or tempname.startswith("PL:")
+    # Babel templates indicating language proficiency
+    or "Babel" in tempname)
+
+# Compiled dispatch tables for each language, built by
+# compile_link_templates().
+compiled_link_templates = {}
+
+# Register the templates in TEMPNAMES as using the parameter specs in SPECS
+# (a single spec or a list of them; see link_templates), for all languages
+# or only for LANG if given.
+def add_link_templates(tempnames, specs, lang=None):
+  if isinstance(specs, dict):
+    specs = [specs]
+  if lang:
+    registry = lang_link_templates.setdefault(lang, {})
+  else:
+    registry = link_templates
+  for tempname in tempnames:
+    registry[tempname] = specs
+  compiled_link_templates.clear()
+
+# Return a dictionary mapping template names to the specs that apply for
+# LANG. Names not in it should be looked up with link_template_specs().
+def compile_link_templates(lang):
+  if lang not in compiled_link_templates:
+    dispatch = dict((tempname, []) for tempname in skipped_link_templates)
+    dispatch.update(link_templates)
+    dispatch.update(lang_link_templates.get(lang, {}))
+    compiled_link_templates[lang] = dispatch
+  return compiled_link_templates[lang]
+
+def link_template_specs(dispatch, tempname):
+  specs = dispatch.get(tempname)
+  if specs is None:
+    specs = [] if skip_link_template(tempname) else default_link_template_specs
+    dispatch[tempname] = specs
+  return specs
+
+# Look for {{head|ar|...|head=<ARABIC>}}
+add_link_templates(["head"], {"lang": "1",
+  "groups": [[("head", "tr"), (["page title", "head"], "tr")]]})
+# Look for {{t|ar|<PAGENAME>|alt=<ARABICTEXT>}}
+add_link_templates(["t", "t+", "t-", "t+check", "t-check"], {"lang": "1",
+  "groups": [[("alt", "tr"), ("2", "tr")]]})
+# Look for {{suffix|ar|<PAGENAME>|alt1=<ARABICTEXT>|<PAGENAME>|alt2=...}}
+# or  {{suffix|ar|<ARABICTEXT>|<ARABICTEXT>|...}}. Don't just do cases up
+# through where there's a numbered param because there may be holes.
+add_link_templates(["suffix", "suffix2", "prefix", "confix", "affix",
+  "circumfix", "infix", "compound"], {"lang": "lang",
+  "numbered": [("alt%s", "tr%s"), ("%s", "tr%s")], "max": 10,
+  "count_once": True})
+add_link_templates(["form of"], {"lang": "lang",
+  "groups": [[("3", "tr"), ("2", "tr")]]})
+# Templates where we don't check for alternative text because
+# the following parameter is used for the translation.
+add_link_templates(["ux", "lang"], {"lang": "1", "groups": [[("2", "tr")]]})
+add_link_templates(["usex"], {"lang": "lang", "groups": [[("1", "tr")]]})
+# FUCKME: This is a complicated template, might be doing it wrong
+add_link_templates(["cardinalbox"], {"lang": "1",
+  "warn": "Encountered cardinalbox, check params carefully: %s",
+  "warn_code": "cardinalbox",
+  "groups": [[("5", None)], [("6", None)]] +
+    [[(p + "alt", p + "tr"), (p, p + "tr")] for p in ["card", "ord", "adv",
+      "mult", "dis", "coll", "frac", "optx", "opt2x"]] +
+    [[("alt", "tr"), ("wplink", None)]]})
+add_link_templates(["der2", "der3", "der4", "der5", "rel2", "rel3", "rel4",
+  "rel5", "hyp2", "hyp3", "hyp4", "hyp5"], {"lang": "lang",
+  "numbered": [("%s", None)]})
+add_link_templates(["elements"], {"lang": "lang",
+  "groups": [[("2", None)], [("4", None)], [("next2", None)],
+    [("prev2", None)]]})
+add_link_templates(["bor", "borrowing"], [
+  {"lang": "1", "when": "lang",
+    "groups": [[("alt", "tr"), ("3", "tr"), ("2", "tr")]]},
+  {"lang": "2", "groups": [[("alt", "tr"), ("4", "tr"), ("3", "tr")]]}])
+add_link_templates(["der", "derived", "inh", "inherited"], {"lang": "2",
+  "groups": [[("alt", "tr"), ("4", "tr"), ("3", "tr")]]})
+add_link_templates(["transliteration"], [
+  {"lang": "1", "unless": "lang", "groups": [[("alt", "tr"), ("3", "tr")]]},
+  default_link_template_specs[1]])
+
+# Special-casing for Ancient Greek
+for tempnames, trparam in [
+    (["grc-noun-con"], "5"),
+    (["grc-proper noun", "grc-noun"], "4"),
+    (["grc-adj-1&2", "grc-adj-1&3", "grc-part-1&3"], "3"),
+    (["grc-adj-2nd", "grc-adj-3rd", "grc-adj-2&3"], "2"),
+    (["grc-num"], "1"),
+    (["grc-verb"], "tr")]:
+  add_link_templates(tempnames, {"lang": None,
+    "groups": [[("head", trparam), (["page title", "head"], trparam)]]},
+    lang="grc")
+
+# Special-casing for Russian
+add_link_templates(["ru-participle of", "ru-abbrev of", "ru-etym abbrev of",
+  "ru-acronym of", "ru-etym acronym of", "ru-initialism of",
+  "ru-etym initialism of", "ru-clipping of", "ru-etym clipping of",
+  "ru-pre-reform"], {"lang": None, "groups": [[("2", "tr"), ("1", "tr")]]},
+  lang="ru")
+add_link_templates(["ru-xlit"], {"lang": None, "groups": [[("1", None)]]},
+  lang="ru")
+add_link_templates(["ru-ux"], {"lang": None, "groups": [[("1", "tr")]]},
+  lang="ru")
+
 # Process link-like templates, on pages from STARTFROM to (but not including)
 # UPTO, either page names or 0-based integers. Save changes if SAVE is true.
 # VERBOSE is passed to blib.do_edit and will (e.g.) show exact changes.
@@ -442,14 +2803,26 @@ def process_links(save, verbose, lang, longlang, cattype, startFrom, upTo,
   templates_changed = {}
   templates_seen = {}
 
+  # Pages are only parsed if their text matches this: a template parameter
+  # whose value is the language code (e.g. {{t|ru|...}} or
+  # {{term|...|lang=ru}}), or a call to one of the templates registered for
+  # the language, which don't need one. Every template processed below has
+  # one or the other.
+  prefilter_re = r"[|=]\s*%s\s*[|}]" % re.escape(lang)
+  if lang_link_templates.get(lang):
+    prefilter_re += r"|\{\{(?:%s)[|}]" % "|".join(re.escape(tempname)
+      for tempname in sorted(lang_link_templates[lang]))
+  prefilter = TextPrefilter(re.compile(prefilter_re))
+
   # Process the link-like templates on the page with the given title and text,
   # calling PROCESSFN for each pair of foreign/Latin. Return a list of
   # changelog actions.
   def do_process_one_page_links(pagetitle, index, text, processfn):
-    def pagemsg(text):
-      msg("Page %s %s: %s" % (index, pagetitle, text))
+    def pagemsg(text, action=None, **fields):
+      page_message(index, pagetitle, text, action, **fields)
 
     actions = []
+    dispatch = compile_link_templates(lang)
     for template in text.filter_templates():
       def getp(param):
         return getparam(template, param)
@@ -467,210 +2840,56 @@ def process_links(save, verbose, lang, longlang, cattype, startFrom, upTo,
           return True
         return False
 
-      did_template = False
-      if lang == "grc":
-        # Special-casing for Ancient Greek
-        did_template = True
-        def dogrcparam(trparam):
-          if getp("head"):
-            doparam("head", trparam)
-          else:
-            doparam(["page title", "head"], trparam)
-        if tempname in ["grc-noun-con"]:
-          dogrcparam("5")
-        elif tempname in ["grc-proper noun", "grc-noun"]:
-          dogrcparam("4")
-        elif tempname in ["grc-adj-1&2", "grc-adj-1&3", "grc-part-1&3"]:
-          dogrcparam("3")
-        elif tempname in ["grc-adj-2nd", "grc-adj-3rd", "grc-adj-2&3"]:
-          dogrcparam("2")
-        elif tempname in ["grc-num"]:
-          dogrcparam("1")
-        elif tempname in ["grc-verb"]:
-          dogrcparam("tr")
-        else:
-          did_template = False
-      elif lang == "ru":
-        # Special-casing for Russian
-        if tempname in ["ru-participle of", "ru-abbrev of", "ru-etym abbrev of",
-            "ru-acronym of", "ru-etym acronym of", "ru-initialism of",
-            "ru-etym initialism of", "ru-clipping of", "ru-etym clipping of",
-            "ru-pre-reform"]:
-          if getp("2"):
-            doparam("2")
-          else:
-            doparam("1")
-          did_template = True
-        elif tempname == "ru-xlit":
-          doparam("1", None)
-          did_template = True
-        elif tempname == "ru-ux":
-          doparam("1")
-          did_template = True
-
-      # Skip {{attention|ar|FOO}} or {{etyl|ar|FOO}} or {{audio|FOO|lang=ar}}
-      # or {{lb|ar|FOO}} or {{context|FOO|lang=ar}} or {{Babel-2|ar|FOO}}
-      # or various others, where FOO is not Arabic, and {{w|FOO|lang=ar}}
-      # or {{wikipedia|FOO|lang=ar}} or {{pedia|FOO|lang=ar}} etc., where
-      # FOO is Arabic but diacritics aren't stripped so shouldn't be added.
-      if (tempname in [
-        "attention",
-        "audio", "audio-IPA",
-        "catlangcode", "C", "catlangname",
-        "commonscat",
-        "etyl", "etym",
-        "gloss",
-        "label", "lb", "lbl", "context", "cx",
-        "non-gloss definition", "non-gloss", "non gloss", "n-g",
-        "qualifier", "qual", "i", "italbrac",
-        "rfe", "rfinfl",
-        "sense", "italbrac-colon",
-        "senseid",
-        "given name",
-        "+preo", "IPA", "phrasebook", "PIE root", "surname", "Q", "was fwotd",
-        # skip Wikipedia templates
-        "wikipedia", "w", "pedialite", "pedia"]
-        # More Wiki-etc. templates
-        or tempname.startswith("projectlink")
-        or tempname.startswith("PL:")
-        # Babel templates indicating language proficiency
-        or "Babel" in tempname):
-        pass
-      elif did_template:
-        pass
-      # Look for {{head|ar|...|head=<ARABIC>}}
-      elif tempname == "head":
-        if getp("1") == lang:
-          if getp("head"):
-            doparam("head")
-          else:
-            doparam(["page title", "head"])
-      # Look for {{t|ar|<PAGENAME>|alt=<ARABICTEXT>}}
-      elif tempname in ["t", "t+", "t-", "t+check", "t-check"]:
-        if getp("1") == lang:
-          if getp("alt"):
-            doparam("alt")
-          else:
-            doparam("2")
-      # Look for {{suffix|ar|<PAGENAME>|alt1=<ARABICTEXT>|<PAGENAME>|alt2=...}}
-      # or  {{suffix|ar|<ARABICTEXT>|<ARABICTEXT>|...}}
-      elif (tempname in ["suffix", "suffix2", "prefix", "confix", "affix",
-          "circumfix", "infix", "compound"]):
-        if getp("lang") == lang:
-          templates_seen[tempname] = templates_seen.get(tempname, 0) + 1
+      for spec in link_template_specs(dispatch, tempname):
+        if ((spec.get("when") and not getp(spec["when"])) or
+            (spec.get("unless") and getp(spec["unless"]))):
+          continue
+        if spec["lang"] and getp(spec["lang"]) != lang:
+          break
+        if spec.get("warn"):
+          pagemsg("WARNING: %s" % (spec["warn"] % unicode(template)),
+              "warning", code=spec.get("warn_code"),
+              template=unicode(template))
+        for group in spec.get("groups", []):
+          for param, trparam in group:
+            if getp(param):
+              doparam(param, trparam)
+              break
+        if spec.get("numbered"):
+          count_once = spec.get("count_once")
+          if count_once:
+            templates_seen[tempname] = templates_seen.get(tempname, 0) + 1
           anychanged = False
-          # Don't just do cases up through where there's a numbered param
-          # because there may be holes.
-          for i in xrange(1, 11):
-            if getp("alt" + str(i)):
-              changed = doparam("alt" + str(i), "tr" + str(i), noadd=True)
-            else:
-              changed = doparam(str(i), "tr" + str(i), noadd=True)
-            anychanged = anychanged or changed
-          if anychanged:
-            templates_changed[tempname] = templates_changed.get(tempname, 0) + 1
-      elif tempname == "form of":
-        if getp("lang") == lang:
-          if getp("3"):
-            doparam("3")
-          else:
-            doparam("2")
-      # Templates where we don't check for alternative text because
-      # the following parameter is used for the translation.
-      elif tempname in ["ux", "lang"]:
-        if getp("1") == lang:
-          doparam("2")
-      elif tempname == "usex":
-        if getp("lang") == lang:
-          doparam("1")
-      elif tempname == "cardinalbox":
-        if getp("1") == lang:
-          pagemsg("WARNING: Encountered cardinalbox, check params carefully: %s"
-              % unicode(template))
-          # FUCKME: This is a complicated template, might be doing it wrong
-          doparam("5", None)
-          doparam("6", None)
-          for p in ["card", "ord", "adv", "mult", "dis", "coll", "frac",
-              "optx", "opt2x"]:
-            if getp(p + "alt"):
-              doparam(p + "alt", p + "tr")
-            else:
-              doparam(p, p + "tr")
-          if getp("alt"):
-            doparam("alt")
-          else:
-            doparam("wplink", None)
-      elif tempname in ["der2", "der3", "der4", "der5", "rel2", "rel3", "rel4",
-          "rel5", "hyp2", "hyp3", "hyp4", "hyp5"]:
-        if getp("lang") == lang:
           i = 1
-          while getp(str(i)):
-            doparam(str(i), None)
+          while not spec.get("max") or i <= spec["max"]:
+            present = False
+            for param, trparam in spec["numbered"]:
+              param = param % i
+              if getp(param):
+                present = True
+                changed = doparam(param, trparam and trparam % i,
+                    noadd=count_once)
+                anychanged = anychanged or changed
+                break
+            if not present and not spec.get("max"):
+              break
             i += 1
-      elif tempname == "elements":
-        if getp("lang") == lang:
-          doparam("2", None)
-          doparam("4", None)
-          doparam("next2", None)
-          doparam("prev2", None)
-      elif tempname in ["bor", "borrowing"] and getp("lang"):
-        if getp("1") == lang:
-          if getp("alt"):
-            doparam("alt")
-          elif getp("3"):
-            doparam("3")
-          else:
-            doparam("2")
-      elif tempname in ["der", "derived", "inh", "inherited", "bor", "borrowing"]:
-        if getp("2") == lang:
-          if getp("alt"):
-            doparam("alt")
-          elif getp("4"):
-            doparam("4")
-          else:
-            doparam("3")
-      # Look for any other template with lang as first argument
-      elif (#tempname in ["l", "link", "m", "mention"] and
-          # If "1" matches, don't do templates with a lang= as well,
-          # e.g. we don't want to do {{hyphenation|ru|men|lang=sh}} in
-          # Russian because it's actually lang sh.
-          getp("1") == lang and not getp("lang")):
-        # Look for:
-        #   {{m|ar|<PAGENAME>|<ARABICTEXT>}}
-        #   {{m|ar|<PAGENAME>|alt=<ARABICTEXT>}}
-        #   {{m|ar|<ARABICTEXT>}}
-        if getp("alt"):
-          doparam("alt")
-        elif getp("3"):
-          doparam("3")
-        elif tempname != "transliteration":
-          doparam("2")
-      # Look for any other template with "lang=ar" in it. But beware of
-      # {{borrowing|en|<ENGLISHTEXT>|lang=ar}}.
-      elif (#tempname in ["term", "plural of", "definite of", "feminine of", "diminutive of"] and
-          getp("lang") == lang):
-        # Look for:
-        #   {{term|lang=ar|<PAGENAME>|<ARABICTEXT>}}
-        #   {{term|lang=ar|<PAGENAME>|alt=<ARABICTEXT>}}
-        #   {{term|lang=ar|<ARABICTEXT>}}
-        if getp("alt"):
-          doparam("alt")
-        elif getp("2"):
-          doparam("2")
-        else:
-          doparam("1")
+          if count_once and anychanged:
+            templates_changed[tempname] = templates_changed.get(tempname, 0) + 1
+        break
     return actions
 
   # Process the link-like templates on the given page with the given text.
   # Returns the changed text along with a changelog message.
   def process_one_page_links(pagetitle, index, text):
     actions = []
-    newtext = [unicode(text)]
 
-    def pagemsg(text):
-      msg("Page %s %s: %s" % (index, pagetitle, text))
+    def pagemsg(text, action=None, **fields):
+      page_message(index, pagetitle, text, action, **fields)
 
-    # First split up any templates with commas in the Latin
+    # First split up any templates with commas in the Latin. The split
+    # templates are spliced into the parsed text in place of the original,
+    # so the text doesn't need to be parsed again before processing it.
     if split_templates:
       def process_param_for_splitting(pagetitle, index, template, param, paramtr):
         if isinstance(param, list):
@@ -691,22 +2910,17 @@ def process_links(save, verbose, lang, longlang, cattype, startFrom, upTo,
             addparam(template, paramtr, tr)
             newtemps.append(unicode(template))
           newtemp = ", ".join(newtemps)
-          old_newtext = newtext[0]
-          pagemsg("Splitting template %s into %s" % (oldtemp, newtemp))
-          new_newtext = old_newtext.replace(oldtemp, newtemp)
-          if old_newtext == new_newtext:
-            pagemsg("WARNING: Unable to locate old template when splitting trs on commas: %s"
-                % oldtemp)
-          elif len(new_newtext) - len(old_newtext) != len(newtemp) - len(oldtemp):
-            pagemsg("WARNING: Length mismatch when splitting template on tr commas, may have matched multiple templates: old=%s, new=%s" % (
-              oldtemp, newtemp))
-          newtext[0] = new_newtext
+          pagemsg("Splitting template %s into %s" % (oldtemp, newtemp),
+              "replace", before=oldtemp, after=newtemp)
+          # TEMPLATE now has the last of the translits; insert the others
+          # before it.
+          text.insert_before(template, "".join(temp + ", "
+            for temp in newtemps[:-1]))
           return ["split %s=%s" % (paramtr, latin)]
         return []
 
       actions += do_process_one_page_links(pagetitle, index, text,
           process_param_for_splitting)
-      text = parse_text(newtext[0])
 
     actions += do_process_one_page_links(pagetitle, index, text, process_param)
     if not join_actions:
@@ -720,6 +2934,22 @@ def process_links(save, verbose, lang, longlang, cattype, startFrom, upTo,
   def process_one_page_links_wrapper(page, index, text):
     return process_one_page_links(unicode(page.title()), index, text)
 
+  # Return and reset the template counts. Used when processing pages in
+  # subprocesses, where the counts are returned to the parent process and
+  # merged by merge_template_counts().
+  def get_template_counts():
+    counts = (dict(templates_seen), dict(templates_changed),
+        prefilter.get_stats())
+    templates_seen.clear()
+    templates_changed.clear()
+    return counts
+
+  def merge_template_counts(counts):
+    for counter, newcounts in zip((templates_seen, templates_changed), counts):
+      for template, count in newcounts.items():
+        counter[template] = counter.get(template, 0) + count
+    prefilter.merge_stats(counts[2])
+
   if "," in cattype:
     cattypes = cattype.split(",")
   else:
@@ -733,20 +2963,36 @@ def process_links(save, verbose, lang, longlang, cattype, startFrom, upTo,
       for template in templates:
         msg("Processing template %s" % template)
         errmsg("Processing template %s" % template)
-        for page, index in references("Template:%s" % template, startFrom, upTo):
-          do_edit(page, index, process_one_page_links_wrapper, save=save,
-              verbose=verbose)
+        do_edits(references("Template:%s" % template, startFrom, upTo),
+            process_one_page_links_wrapper, save=save, verbose=verbose,
+            prefilter=prefilter)
     elif cattype == "pages":
-      for pagename, index in iter_pages(pages_to_do, startFrom, upTo):
-        page = pywikibot.Page(site, pagename)
-        do_edit(page, index, process_one_page_links_wrapper, save=save,
-            verbose=verbose)
+      def yield_pages():
+        if dump_source:
+          dump_pages = dump_source.pages_by_titles(pages_to_do)
+        for pagename, index in iter_unloaded_pages(pages_to_do, startFrom,
+            upTo):
+          if not dump_source:
+            yield pywikibot.Page(site, pagename), index
+          elif pagename in dump_pages:
+            yield dump_pages[pagename], index
+          else:
+            page_message(index, pagename,
+                "WARNING: Page not found in dump, skipping", "warning",
+                code="page-not-in-dump")
+      if dump_source and num_processes > 1:
+        # Pages from the dump can't be saved, so process them as page text,
+        # which can be spread across processes.
+        do_process_texts((((page.title(), page.text), index)
+            for page, index in yield_pages()), process_one_page_links,
+            verbose, get_template_counts, merge_template_counts, prefilter)
+      else:
+        do_edits(load_pages(yield_pages()), process_one_page_links_wrapper,
+            save=save, verbose=verbose, prefilter=prefilter)
     elif cattype == "pagetext":
-      for current, index in iter_pages(pages_to_do, startFrom, upTo,
-          key=lambda x:x[0]):
-        pagetitle, pagetext = current
-        do_process_text(pagetitle, pagetext, index, process_one_page_links,
-            verbose=verbose)
+      do_process_texts(iter_pages(pages_to_do, startFrom, upTo,
+          key=lambda x:x[0]), process_one_page_links, verbose,
+          get_template_counts, merge_template_counts, prefilter)
     else:
       if cattype == "vocab":
         cats = ["%s lemmas" % longlang, "%s non-lemma forms" % longlang]
@@ -758,13 +3004,66 @@ def process_links(save, verbose, lang, longlang, cattype, startFrom, upTo,
       for cat in cats:
         msg("Processing category %s" % unicode(cat))
         errmsg("Processing category %s" % unicode(cat))
-        for page, index in cat_articles(cat, startFrom, upTo):
-          do_edit(page, index, process_one_page_links_wrapper, save=save,
-              verbose=verbose)
+        do_edits(cat_articles(cat, startFrom, upTo),
+            process_one_page_links_wrapper, save=save, verbose=verbose,
+            prefilter=prefilter)
   if not quiet:
     msg("Templates seen:")
-    for template, count in sorted(templates_seen.items(), key=lambda x:-x[1]):
+    # Break ties by name so that the output doesn't depend on the order
+    # the counts were accumulated in (e.g. when merged from subprocesses).
+    for template, count in sorted(templates_seen.items(),
+        key=lambda x:(-x[1], x[0])):
       msg("  %s = %s" % (template, count))
     msg("Templates processed:")
-    for template, count in sorted(templates_changed.items(), key=lambda x:-x[1]):
+    for template, count in sorted(templates_changed.items(),
+        key=lambda x:(-x[1], x[0])):
       msg("  %s = %s" % (template, count))
+    prefilter.msg_stats()
+
+# Page standing in for a pywikibot.Page in run_tests(), whose text was set
+# from the page text cache but whose latest revision is newer.
+class StubPage(object):
+  def __init__(self, title, cachedtext, latesttext, latest_revid):
+    self.pagetitle = title
+    self.text = cachedtext
+    self.latesttext = latesttext
+    self.latest_revision_id = latest_revid
+    self.fetches = 0
+    self.savedtext = None
+
+  def title(self):
+    return self.pagetitle
+
+  def get(self, force=False, get_redirect=False):
+    self.fetches += 1
+    if self.fetches > 2:
+      raise RuntimeError("Fetched %s %s times" % (self.pagetitle,
+        self.fetches))
+    return self.latesttext
+
+  def save(self, comment=None):
+    self.savedtext = self.text
+
+# Check that do_edit() refetches a page whose cached text is out of date
+# once, then saves the change made to the latest text.
+def run_tests():
+  global page_cache
+  old_page_cache = page_cache
+  page_cache = PageTextCache(":memory:")
+  try:
+    page = StubPage(u"Test page", u"cached", u"latest", 2)
+    page_cache.revids_used[u"Test page"] = 1
+    try:
+      do_edit(page, 1, lambda page, index, parsed: (unicode(parsed) + u"!",
+        "test"), save=True)
+    except RuntimeError as e:
+      msg("%s" % e)
+    succeeded = page.fetches == 1 and page.savedtext == u"latest!"
+  finally:
+    page_cache = old_page_cache
+  msg("TEST %s." % ("SUCCEEDED" if succeeded else "FAILED"))
+  msg("RESULTS: %s SUCCEEDED, %s FAILED." % (int(succeeded),
+    int(not succeeded)))
+
+if __name__ == "__main__":
+  run_tests()
@@ -59,11 +59,13 @@ def do_canon_param(pagetitle, index, template, fromparam, toparam, paramtr,
     arabic, latin, include_tempname_in_changelog=False):
   actions = []
   tname = unicode(template.name)
-  def pagemsg(text):
-    msg("Page %s %s: %s.%s: %s" % (index, pagetitle, tname, fromparam, text))
+  def pagemsg(text, action=None, **fields):
+    blib.page_message(index, pagetitle, text, action, tempname=tname,
+        param=fromparam, **fields)
 
   if show_template:
-    pagemsg("Processing %s" % (unicode(template)))
+    pagemsg("Processing %s" % (unicode(template)), "process",
+        template=unicode(template))
 
   if include_tempname_in_changelog:
     paramtrname = "%s.%s" % (tname, paramtr)
@@ -222,8 +224,8 @@ def canon_param(pagetitle, index, template, param, paramtr,
   elif canonlatin:
     addparam(template, paramtr, canonlatin)
   if canonarabic or canonlatin:
-    msg("Page %s %s: Replaced %s with %s" % (index, pagetitle,
-      oldtempl, unicode(template)))
+    blib.page_message(index, pagetitle, "Replaced %s with %s" % (oldtempl,
+      unicode(template)), "replace", before=oldtempl, after=unicode(template))
   return actions
 
 def combine_adjacent(values):
@@ -265,6 +267,10 @@ def sort_group_changelogs(actions):
 # list of changelog actions.
 def canon_param_chain(pagetitle, index, template, param):
   actions = []
+  # If TEMPLATE is a blib.ParamIndex, skip chains with no params present.
+  if (isinstance(template, blib.ParamIndex) and
+      not template.names_with_prefix(param)):
+    return actions
   result = canon_param(pagetitle, index, template, param, param + "tr")
   if result != False:
     actions.extend(result)
@@ -336,8 +342,9 @@ def canon_head(pagetitle, index, template):
           addparam(template, "tr", canonlatin)
         actions.extend(newactions)
         if canonarabic or canonlatin:
-          msg("Page %s %s: Replaced %s with %s" % (index, pagetitle,
-            oldtempl, unicode(template)))
+          blib.page_message(index, pagetitle, "Replaced %s with %s" % (
+            oldtempl, unicode(template)), "replace", before=oldtempl,
+            after=unicode(template))
 
   # Check and try to vocalize extra heads
   i = 2
@@ -357,6 +364,8 @@ def canon_one_page_headwords(pagetitle, index, text):
   for template in text.filter_templates():
     tname = unicode(template.name)
     if tname in arabiclib.arabic_non_verbal_headword_templates:
+      # Index the params, since there are many to look up.
+      template = blib.ParamIndex(template)
       thisactions = []
       thisactions += canon_head(pagetitle, index, template)
       for param in ["pl", "plobl", "cpl", "cplobl", "fpl", "fplobl", "f",
@@ -379,8 +388,8 @@ def canon_headwords(save, verbose, startFrom, upTo):
   #for page in blib.references(u"Template:tracking/ar-head/head", startFrom, upTo):
   #for page in blib.references("Template:ar-nisba", startFrom, upTo):
   for cat in [u"Arabic lemmas", u"Arabic non-lemma forms"]:
-    for page, index in blib.cat_articles(cat, startFrom, upTo):
-      blib.do_edit(page, index, process_page, save=save, verbose=verbose)
+    blib.do_edits(blib.cat_articles(cat, startFrom, upTo),
+        process_page, save=save, verbose=verbose)
 
 # Canonicalize Arabic and Latin in link-like templates on pages from STARTFROM
 # to (but not including) UPTO, either page names or 0-based integers. Save
@@ -396,14 +405,16 @@ def canon_links(save, verbose, cattype, startFrom, upTo, pages_to_do=[]):
     if getparam(template, "sc") == "Arab":
       tname = unicode(template.name)
       if show_template and result == False:
-        msg("Page %s %s: %s.%s: Processing %s" % (index,
-          pagetitle, tname, "sc", unicode(template)))
-      msg("Page %s %s: %s.%s: Removing sc=Arab" % (index,
-        pagetitle, tname, "sc"))
+        blib.page_message(index, pagetitle, "Processing %s" %
+            unicode(template), "process", tempname=tname, param="sc",
+            template=unicode(template))
+      blib.page_message(index, pagetitle, "Removing sc=Arab", tempname=tname,
+          param="sc")
       oldtempl = "%s" % unicode(template)
       template.remove("sc")
-      msg("Page %s %s: Replaced %s with %s" %
-          (index, pagetitle, oldtempl, unicode(template)))
+      blib.page_message(index, pagetitle, "Replaced %s with %s" % (oldtempl,
+        unicode(template)), "replace", before=oldtempl,
+        after=unicode(template))
       newresult = ["remove %s.sc=Arab" % tname]
       if result != False:
         result = result + newresult
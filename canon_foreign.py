@@ -17,7 +17,7 @@
 import re, unicodedata
 
 import blib, pywikibot
-from blib import msg, getparam, addparam
+from blib import getparam, addparam
 
 show_template=True
 
@@ -40,11 +40,13 @@ def do_canon_param(pagetitle, index, template, fromparam, toparam, paramtr,
     foreign, latin, translit_module, include_tempname_in_changelog=False):
   actions = []
   tname = unicode(template.name)
-  def pagemsg(text):
-    msg("Page %s %s: %s.%s: %s" % (index, pagetitle, tname, fromparam, text))
+  def pagemsg(text, action=None, **fields):
+    blib.page_message(index, pagetitle, text, action, tempname=tname,
+        param=fromparam, **fields)
 
   if show_template:
-    pagemsg("Processing %s" % (unicode(template)))
+    pagemsg("Processing %s" % (unicode(template)), "process",
+        template=unicode(template))
 
   if include_tempname_in_changelog:
     paramtrname = "%s.%s" % (tname, paramtr)
@@ -186,8 +188,8 @@ def canon_param(pagetitle, index, template, param, paramtr, translit_module,
   elif canonlatin:
     addparam(template, paramtr, canonlatin)
   if canonforeign or canonlatin:
-    msg("Page %s %s: Replaced %s with %s" % (index, pagetitle,
-      oldtempl, unicode(template)))
+    blib.page_message(index, pagetitle, "Replaced %s with %s" % (oldtempl,
+      unicode(template)), "replace", before=oldtempl, after=unicode(template))
   return actions
 
 def combine_adjacent(values):
@@ -245,14 +247,16 @@ def canon_links(save, verbose, cattype, lang, longlang, script,
     if scvalue in script:
       tname = unicode(template.name)
       if show_template and result == False:
-        msg("Page %s %s: %s.%s: Processing %s" % (index,
-          pagetitle, tname, "sc", unicode(template)))
-      msg("Page %s %s: %s.%s: Removing sc=%s" % (index,
-        pagetitle, tname, "sc", scvalue))
+        blib.page_message(index, pagetitle, "Processing %s" %
+            unicode(template), "process", tempname=tname, param="sc",
+            template=unicode(template))
+      blib.page_message(index, pagetitle, "Removing sc=%s" % scvalue,
+          tempname=tname, param="sc")
       oldtempl = "%s" % unicode(template)
       template.remove("sc")
-      msg("Page %s %s: Replaced %s with %s" %
-          (index, pagetitle, oldtempl, unicode(template)))
+      blib.page_message(index, pagetitle, "Replaced %s with %s" % (oldtempl,
+        unicode(template)), "replace", before=oldtempl,
+        after=unicode(template))
       newresult = ["remove %s.sc=%s" % (tname, scvalue)]
       if result != False:
         result = result + newresult
@@ -85,7 +85,7 @@ def create_declension(page, index, save, pos, tempname, decltempname, sgnum,
   comments = []
 
   def pgmsg(text):
-    msg("Page %s %s: %s" % (index, pagename, text))
+    blib.page_message(index, pagename, text)
 
   # Starts with definite article al-
   def starts_with_al(text):
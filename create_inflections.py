@@ -130,7 +130,7 @@ def create_inflection_entry(save, index, inflection, infltr, lemma, lemmatr,
   pagename = remove_diacritics(inflection)
   def pagemsg(text, simple = False):
     if simple:
-      msg("Page %s %s: %s" % (index, pagename, text))
+      blib.page_message(index, pagename, text)
     else:
       msg("Page %s %s: %s: %s %s%s, %s %s%s" % (index, pagename, text,
         infltype, inflection, " (%s)" % infltr if infltr else "",
@@ -1440,7 +1440,7 @@ def create_noun_plural(save, index, inflection, infltr, lemma, lemmatr,
   pagename = remove_diacritics(inflection)
   def pagemsg(text, simple = False):
     if simple:
-      msg("Page %s %s: %s" % (index, pagename, text))
+      blib.page_message(index, pagename, text)
     else:
       msg("Page %s %s: %s: plural %s%s, singular %s%s" % (index, pagename, text,
         inflection, " (%s)" % infltr if infltr else "",
@@ -1796,23 +1796,31 @@ def create_feminines(save, pos, tempname, startFrom, upTo):
       fem_inflection)
 
 def expand_template(page, text):
-  # Make an expand-template call to expand the template text.
-  # The code here is based on the expand_text() function of the Page object.
-  # FIXME: Use site.expand_text(text, title=page.title(withSection=False))
-  req = pywikibot.data.api.Request(action="expandtemplates",
-      text = text,
-      title = page.title(withSection=False),
-      site = page.site,
-      prop = "wikitext" # "*"
-      )
-  #return req.submit()["expandtemplates"]["*"]
-  return req.submit()["expandtemplates"]["wikitext"]
+  # Make an expand-template call to expand the template text, going through
+  # the expansion cache if enabled.
+  return blib.expand_wikitext(text, page.title(withSection=False))
+
+def part_prop_call(template, prefix):
+  # Convert the conjugation template to a call that fetches the desired form
+  # or property.
+  return re.sub("\{\{ar-(conj|verb)\|", "{{%s|" % prefix, unicode(template))
 
 def get_part_prop(page, template, prefix):
   # Make an expand-template call to convert the conjugation template to
   # the desired form or property.
-  return expand_template(page,
-      re.sub("\{\{ar-(conj|verb)\|", "{{%s|" % prefix, unicode(template)))
+  return expand_template(page, part_prop_call(template, prefix))
+
+# Fetch several forms or properties of the verb conjugated by TEMPLATE (one
+# for each template prefix in PREFIXES, as for get_part_prop()) in a single
+# expand-template call. Return a dictionary mapping each prefix to its value,
+# or to False if it couldn't be expanded (a warning is output in that case).
+def get_part_props(page, index, template, prefixes):
+  pagetitle = page.title(withSection=False)
+  def pagemsg(text):
+    blib.page_message(index, pagetitle, text)
+  return dict(zip(prefixes, blib.expand_many(
+    [part_prop_call(template, prefix) for prefix in prefixes], pagetitle,
+    pagemsg)))
 
 #def get_dicform(page, template):
 #  return get_part_prop(page, template, "ar-past3sm")
@@ -1845,9 +1853,11 @@ def has_passive_form(passive, pers):
 # Page object representing the dictionary-form verb of this verbal noun;
 # TEMPLATE is the conjugation template for the verb, i.e. {{ar-conj|...}};
 # UNCERTAIN is true if the verbal noun is uncertain (indicated with a ? at
-# the end of the vn=... parameter in the conjugation template).
-def create_verbal_noun(save, index, vn, form, page, template, uncertain):
-  for dicform in get_dicform_all(page, template):
+# the end of the vn=... parameter in the conjugation template); DICFORMS is
+# the list of dictionary forms of the verb, from get_dicform_all().
+def create_verbal_noun(save, index, vn, form, page, template, uncertain,
+    dicforms):
+  for dicform in dicforms:
 
     gender = get_vn_gender(vn, form)
     if gender == "?":
@@ -1876,18 +1886,27 @@ def create_verbal_nouns(save, startFrom, upTo):
         if vnvalue.endswith("?"):
           vnvalue = vnvalue[:-1]
           uncertain = True
+        if not vnvalue and form == "I":
+          continue
+        # Fetch the dictionary forms and, for an augmented verb without
+        # vn=, the auto-generated verbal noun(s), in one call.
+        props = get_part_props(page, index, template,
+            ["ar-past3sm-all"] + ([] if vnvalue else ["ar-verb-part-all|vn"]))
+        if not props["ar-past3sm-all"]:
+          continue
+        dicforms = props["ar-past3sm-all"].split(",")
         if not vnvalue:
-          if form != "I":
-            # Augmented verb. Fetch auto-generated verbal noun(s).
-            vnvalue = get_part_prop(page, template, "ar-verb-part-all|vn")
-          else:
+          vnvalue = props["ar-verb-part-all|vn"]
+          if not vnvalue:
             continue
         vns = re.split(u"[,،]", vnvalue)
         for vn in vns:
-          create_verbal_noun(save, index, vn, form, page, template, uncertain)
+          create_verbal_noun(save, index, vn, form, page, template, uncertain,
+              dicforms)
 
-def create_participle(save, index, part, page, template, actpass, apshort):
-  for dicform in get_dicform_all(page, template):
+def create_participle(save, index, part, page, template, actpass, apshort,
+    dicforms):
+  for dicform in dicforms:
 
     # Retrieve form, eliminate any weakness value (e.g. "I" from "I-sound")
     form = re.sub("-.*$", "", getparam(template, "1"))
@@ -1900,21 +1919,30 @@ def create_participles(save, startFrom, upTo):
   for page, index in blib.cat_articles("Arabic verbs", startFrom, upTo):
     for template in blib.parse(page).filter_templates():
       if template.name == "ar-conj":
-        passive = get_passive(page, template)
+        # Fetch everything we might need in one call. The participle not
+        # possible given the value of passive= comes out empty and is
+        # ignored.
+        props = get_part_props(page, index, template,
+            ["ar-verb-prop|passive", "ar-past3sm-all",
+              "ar-verb-part-all|ap", "ar-verb-part-all|pp"])
+        passive = props["ar-verb-prop|passive"]
+        if not passive or not props["ar-past3sm-all"]:
+          continue
+        dicforms = props["ar-past3sm-all"].split(",")
         if has_active_form(passive):
-          apvalue = get_part_prop(page, template, "ar-verb-part-all|ap")
+          apvalue = props["ar-verb-part-all|ap"]
           if apvalue:
             aps = re.split(",", apvalue)
             for ap in aps:
               create_participle(save, index, ap, page, template, "active",
-                  "act")
+                  "act", dicforms)
         if has_passive_form(passive, None):
-          ppvalue = get_part_prop(page, template, "ar-verb-part-all|pp")
+          ppvalue = props["ar-verb-part-all|pp"]
           if ppvalue:
             pps = re.split(",", ppvalue)
             for pp in pps:
               create_participle(save, index, pp, page, template, "passive",
-                  "pass")
+                  "pass", dicforms)
 
 # List of all verb form classes
 all_form_classes = ["I", "II", "III", "IV", "V", "VI", "VII", "VIII", "IX",
@@ -1952,23 +1980,32 @@ voices_infl_entry = {
     "passive":"pasv"
     }
 
+# The ID of a verb part in {{ar-verb-part-all|...}}, given VOICE, PERSON and
+# TENSE as in create_verb_part().
+def verb_part_id(voice, person, tense):
+  return (voice == "active" and "%s-%s" % (person, tense) or
+      "%s-ps-%s" % (person, tense))
+
+# Does a verb with the given value of passive= have the given verb part?
+def has_verb_part(passive, voice, person):
+  if voice == "active":
+    return has_active_form(passive)
+  return has_passive_form(passive, person)
+
 # Create a single verb part. SAVE, INDEX are as in create_inflection_entry().
 # PAGE is the page of the lemma, and TEMPLATE is the {{ar-conj|...}} template
 # indicating the lemma's conjugation. DICFORMS is an array of possible
 # vocalized forms of the lemma, PASSIVE is the value of the 'passive' property
 # of the lemma. VOICE is either "active" or "passive", and PERSON and TENSE
 # indicate the particular person/number/gender/tense/mood combination, using
-# the codes passed to {{ar-verb-part-all|...}}. We refuse to do combinations
-# not compatible with the value of PASSIVE, and we refuse to do the
-# dictionary form (3sm-perf, or 3sm-ps-perf for passive-only verbs).
-# We assume that impossible parts (passive and non-2nd-person imperatives)
-# have already been filtered.
+# the codes passed to {{ar-verb-part-all|...}}. VALUE is the value of the
+# part, as fetched by get_part_props(). We refuse to do the dictionary form
+# (3sm-perf, or 3sm-ps-perf for passive-only verbs). We assume that
+# impossible parts (passive and non-2nd-person imperatives, and those not
+# compatible with the value of PASSIVE; see has_verb_part()) have already
+# been filtered.
 def create_verb_part(save, index, page, template, dicforms, passive,
-    voice, person, tense):
-  if voice == "active" and not has_active_form(passive):
-    return
-  if voice == "passive" and not has_passive_form(passive, person):
-    return
+    voice, person, tense, value):
   dicformsnv = [remove_diacritics(x) for x in dicforms]
   distinct_dicformsnv = list(set(dicformsnv))
   # This should be subsumed below.
@@ -1978,11 +2015,9 @@ def create_verb_part(save, index, page, template, dicforms, passive,
   #  return
   infl_person = persons_infl_entry[person]
   infl_tense = tenses_infl_entry[tense] % voices_infl_entry[voice]
-  partid = (voice == "active" and "%s-%s" % (person, tense) or
-      "%s-ps-%s" % (person, tense))
+  partid = verb_part_id(voice, person, tense)
   # Retrieve form, eliminate any weakness value (e.g. "I" from "I-sound")
   form = re.sub("-.*$", "", getparam(template, "1"))
-  value = get_part_prop(page, template, "ar-verb-part-all|%s" % partid)
   if value:
     parts = re.split(",", value)
     for part in parts:
@@ -2081,11 +2116,23 @@ def create_verb_parts(save, startFrom, upTo, partspec):
   for page, index in blib.cat_articles("Arabic verbs", startFrom, upTo):
     for template in blib.parse(page).filter_templates():
       if template.name == "ar-conj":
-        passive = get_passive(page, template)
-        dicforms = get_dicform_all(page, template)
-        for voice, person, tense in parts_desired:
+        props = get_part_props(page, index, template,
+            ["ar-verb-prop|passive", "ar-past3sm-all"])
+        passive = props["ar-verb-prop|passive"]
+        if not passive or not props["ar-past3sm-all"]:
+          continue
+        dicforms = props["ar-past3sm-all"].split(",")
+        # Fetch all the parts this verb has in one call.
+        parts = [(voice, person, tense)
+            for voice, person, tense in parts_desired
+            if has_verb_part(passive, voice, person)]
+        values = get_part_props(page, index, template,
+            ["ar-verb-part-all|%s" % verb_part_id(voice, person, tense)
+              for voice, person, tense in parts])
+        for voice, person, tense in parts:
           create_verb_part(save, index, page, template, dicforms, passive,
-              voice, person, tense)
+              voice, person, tense, values["ar-verb-part-all|%s" %
+                verb_part_id(voice, person, tense)])
 
 def add_bracketing(defn):
   return " ".join(["[[%s]]" % word for word in defn.split(" ")])
@@ -2220,11 +2267,11 @@ def create_elatives(save, elfile, startFrom, upTo):
     create_inflection_entry(save, index, elative, None, arpositives[0], None,
       "Adjective", "elative", "positive", "ar-adj", [], "elative of",
       "|lang=ar", entrytext=defn_text)
-    for arpositive in arpositives:
+    def make_add_elative_param(arpositive):
       def add_elative_param(page, index, text):
         pagetitle = page.title()
         def pagemsg(text):
-          msg("Page %s %s: %s" % (index, pagetitle, text))
+          blib.page_message(index, pagetitle, text)
         if not page.exists():
           pagemsg("WARNING, positive %s not found for elative %s (page nonexistent)" % (
             arpositive, elative))
@@ -2253,9 +2300,11 @@ def create_elatives(save, elfile, startFrom, upTo):
           pagemsg("WARNING, positive %s not found for elative %s (page exists but couldn't find appropriate template)" % (
             arpositive, elative))
         return text, "Add el=%s to adjective %s" % (elative, arpositive)
+      return add_elative_param
 
-      page = pywikibot.Page(site, remove_diacritics(arpositive))
-      blib.do_edit(page, index, add_elative_param, save=save)
+    blib.do_edits([(pywikibot.Page(site, remove_diacritics(arpositive)), index,
+        make_add_elative_param(arpositive)) for arpositive in arpositives],
+      save=save)
 
 pa = blib.init_argparser("Create Arabic inflection entries")
 pa.add_argument("-p", "--plural", action='store_true',
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+#    expand_cache.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Inspect or invalidate the template expansion cache used by scripts run
+# with --expand-cache (see blib.ExpandCache). Expansions are keyed on the
+# revisions of the templates and modules they depend on, so normally they
+# don't need invalidating, but this can be used e.g. when a module has
+# changed in a way not reflected in the dependencies the server records.
+
+import argparse
+
+import blib
+from blib import msg
+
+pa = argparse.ArgumentParser(description="Inspect or invalidate the template expansion cache")
+pa.add_argument("-f", "--file", required=True, help="Expansion cache file")
+pa.add_argument("--clear", action="store_true",
+    help="Remove all cached expansions")
+pa.add_argument("--invalidate", metavar="PAGE",
+    help="""Remove cached expansions depending on this page (e.g.
+'Module:ar-verb' or 'Template:ar-conj')""")
+
+params = pa.parse_args()
+cache = blib.ExpandCache(params.file)
+if params.clear:
+  msg("Removed %s cached expansions" % cache.invalidate())
+elif params.invalidate:
+  msg("Removed %s cached expansions depending on %s" % (
+    cache.invalidate(params.invalidate.decode("utf-8")),
+    params.invalidate.decode("utf-8")))
+else:
+  count, = cache.conn.execute("SELECT COUNT(*) FROM expansions").fetchone()
+  msg("%s cached expansions" % count)
@@ -445,8 +445,8 @@ def process_template(pagetitle, index, template, ruparam, trparam, output_line,
     find_accents, verbose):
   origt = unicode(template)
   saveparam = ruparam
-  def pagemsg(text):
-    msg("Page %s %s: %s" % (index, pagetitle, text))
+  def pagemsg(text, action=None, **fields):
+    blib.page_message(index, pagetitle, text, action, **fields)
   def expand_text(tempcall):
     return blib.expand_text(tempcall, pagetitle, pagemsg, semi_verbose)
   if semi_verbose:
@@ -496,7 +496,8 @@ def process_template(pagetitle, index, template, ruparam, trparam, output_line,
   if not changed and check_need_accent(val):
     output_line("Need accents")
   if changed:
-    pagemsg("Replaced %s with %s" % (origt, unicode(template)))
+    pagemsg("Replaced %s with %s" % (origt, unicode(template)), "replace",
+        before=origt, after=unicode(template))
   return ["auto-accent %s%s" % (newval, "//%s" % newtr if newtr else "")] if changed else False
 
 def find_russian_need_vowels(find_accents, cattype, direcfile, save,
@@ -536,7 +537,7 @@ def find_russian_need_vowels(find_accents, cattype, direcfile, save,
     def check_template_for_missing_accent(pagetitle, index, template,
         ruparam, trparam):
       def pagemsg(text):
-        msg("Page %s %s: %s" % (index, pagetitle, text))
+        blib.page_message(index, pagetitle, text)
       def output_line(directive):
         pagemsg("%s: %s" % (directive, unicode(template)))
       result = process_template(pagetitle, index, template, ruparam, trparam,
@@ -47,9 +47,8 @@ def fix_smp(save, verbose, startFrom, upTo):
       msg("Page %s %s: Change log = %s" % (index, pagetitle, changelog))
       return text, changelog
 
-    for page, index in blib.references("Template:" + template, startFrom, upTo):
-      blib.do_edit(page, index, fix_one_page_smp, save=save,
-          verbose=verbose)
+    blib.do_edits(blib.references("Template:" + template, startFrom, upTo),
+        fix_one_page_smp, save=save, verbose=verbose)
 
 pa = blib.init_argparser("Change |pl=smp to |pl=sp in declension templates")
 params = pa.parse_args()
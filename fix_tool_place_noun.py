@@ -39,9 +39,8 @@ def fix_tool_place_noun(save, verbose, startFrom, upTo):
       msg("Page %s %s: Change log = %s" % (index, pagetitle, changelog))
       return text, changelog
 
-    for page, index in blib.references("Template:" + template, startFrom, upTo):
-      blib.do_edit(page, index, fix_one_page_tool_place_noun, save=save,
-          verbose=verbose)
+    blib.do_edits(blib.references("Template:" + template, startFrom, upTo),
+        fix_one_page_tool_place_noun, save=save, verbose=verbose)
 
 pa = blib.init_argparser("Fix lc vs. cap in tool/place noun etym templates")
 params = pa.parse_args()
@@ -171,8 +171,8 @@ def search_category_for_missing_form(form, pos, templates, save, startFrom,
       msg("WARNING: No replacements found for {{l|ar|%s}}" % pagetitle)
     return text, "Correct headword formatting for [[:Category:%s]]" % cat
 
-  for page, index in blib.cat_articles(cat, startFrom, upTo):
-    blib.do_edit(page, index, correct_one_page_headword_formatting, save=save)
+  blib.do_edits(blib.cat_articles(cat, startFrom, upTo),
+      correct_one_page_headword_formatting, save=save)
 
 def correct_headword_formatting(save, startFrom, upTo):
   search_category_for_missing_form("plural", "noun", "ar-plural", save, startFrom, upTo)
@@ -222,8 +222,8 @@ def correct_one_page_link_formatting(page, index, text):
 
 def correct_link_formatting(save, startFrom, upTo):
   for cat in [u"Arabic lemmas", u"Arabic non-lemma forms"]:
-    for page, index in blib.cat_articles(cat, startFrom, upTo):
-      blib.do_edit(page, index, correct_one_page_link_formatting, save=save)
+    blib.do_edits(blib.cat_articles(cat, startFrom, upTo),
+        correct_one_page_link_formatting, save=save)
 
 pa = blib.init_argparser("Correct formatting of headword templates")
 pa.add_argument("-l", "--links", action='store_true',
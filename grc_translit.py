@@ -18,7 +18,9 @@
 import re
 import unicodedata
 
-from blib import remove_links, msg
+import translit_tables
+
+from blib import remove_links, msg, translit_memoized
 
 # FIXME:
 #
@@ -153,6 +155,7 @@ iotate_vowel = {u"α":u"ᾳ", u"Α":u"ᾼ",
 
 # Transliterates text, which should be a single word or phrase. It should
 # include stress marks, which are then preserved in the transliteration.
+@translit_memoized
 def tr(text, lang=None, sc=None, msgfun=msg):
     text = remove_links(text)
     text = tr_canonicalize_greek(text)
@@ -273,46 +276,17 @@ tt_to_greek_matching = {
 
 word_interrupting_chars = u"-[]"
 
-build_canonicalize_latin = {}
+# Compile the matching table into the form used by tr_matching() and build
+# the self-canonicalizing tables from it (see translit_tables.py).
+# build_canonicalize_latin maps non-canonical Latin chars to canonical ones,
+# or to "multiple", which suppresses any self-canonicalization of the
+# character; tt_canonicalize_latin is the same minus the "multiple" entries.
 # x X y Y not on list -- canoned to ks Ks u U
-for ch in u"abcdefghijklmnopqrstuvwzABCDEFGHIJKLMNOPQRSTUVWZ":
-    build_canonicalize_latin[ch] = "multiple"
-build_canonicalize_latin[""] = "multiple"
-
-# Make sure we don't canonicalize any canonical letter to any other one;
-# e.g. could happen with ʾ, an alternative for ʿ.
-for greek in tt_to_greek_matching:
-    alts = tt_to_greek_matching[greek]
-    if isinstance(alts, basestring):
-        build_canonicalize_latin[alts] = "multiple"
-    else:
-        canon = alts[0]
-        if isinstance(canon, tuple):
-            pass
-        if isinstance(canon, list):
-            build_canonicalize_latin[canon[0]] = "multiple"
-        else:
-            build_canonicalize_latin[canon] = "multiple"
-
-for greek in tt_to_greek_matching:
-    alts = tt_to_greek_matching[greek]
-    if isinstance(alts, basestring):
-        continue
-    canon = alts[0]
-    if isinstance(canon, list):
-        continue
-    for alt in alts[1:]:
-        if isinstance(alt, list) or isinstance(alt, tuple):
-            continue
-        if alt in build_canonicalize_latin and build_canonicalize_latin[alt] != canon:
-            build_canonicalize_latin[alt] = "multiple"
-        else:
-            build_canonicalize_latin[alt] = canon
-tt_canonicalize_latin = {}
-for alt in build_canonicalize_latin:
-    canon = build_canonicalize_latin[alt]
-    if canon != "multiple":
-        tt_canonicalize_latin[alt] = canon
+compiled_tables = translit_tables.compile_tables("grc_translit",
+        tt_to_greek_matching,
+        u"abcdefghijklmnopqrstuvwzABCDEFGHIJKLMNOPQRSTUVWZ")
+build_canonicalize_latin = compiled_tables.build_canonicalize_latin
+tt_canonicalize_latin = compiled_tables.tt_canonicalize_latin
 
 # A list of Latin characters that are allowed to be unmatched in the
 # Greek. The value is the corresponding Greek character to insert.
@@ -371,6 +345,7 @@ def post_canonicalize_latin(text):
 # is more reliable when both aare provided. This is less reliable than
 # tr_matching() and is meant when that fails. Return value is a tuple of
 # (CANONLATIN, CANONARABIC).
+@translit_memoized
 def canonicalize_latin_greek(latin, greek, msgfun=msg):
     if greek is not None:
         greek = pre_pre_canonicalize_greek(greek)
@@ -385,7 +360,7 @@ def canonicalize_latin_greek(latin, greek, msgfun=msg):
         def quote_subst(m):
             return m.group(0).replace("'", multi_single_quote_subst)
         latin = re.sub(r"''+", quote_subst, latin)
-        latin = rsub(latin, u".", tt_canonicalize_latin)
+        latin = unicode(latin).translate(compiled_tables.canonicalize_latin)
         latin = latin.replace(multi_single_quote_subst, "'")
         latin = post_canonicalize_latin(latin)
     return (latin, greek)
@@ -492,6 +467,7 @@ debug_tr_matching = False
 # appropriate, so that ambiguities of Latin transliteration can be
 # correctly handled. Returns a tuple of Greek, Latin. If unable to match,
 # throw an error if ERR, else return None.
+@translit_memoized
 def tr_matching(greek, latin, err=False, msgfun=msg):
     origgreek = greek
     origlatin = latin
@@ -532,22 +508,17 @@ def tr_matching(greek, latin, err=False, msgfun=msg):
         bow = is_bow()
         eow = is_eow()
 
-        matches = tt_to_greek_matching.get(ac)
-        debprint("get_matches: matches is %s" % matches)
+        matches = compiled_tables.matching.get(ac)
+        debprint("get_matches: matches is %s" % (matches and matches[0]))
         if matches == None:
-            if True:
-                error("Encountered non-Greek (?) character " + ac +
-                    " at index " + str(gind[0]))
-            else:
-                matches = [ac]
-        if type(matches) is not list:
-            matches = [matches]
+            error("Encountered non-Greek (?) character " + ac +
+                " at index " + str(gind[0]))
+        matches, nonblank = matches
         if delete_blank_matches:
             # Don't delete blank matches if first match is blank, otherwise
             # we run into problems with ἆθλον vs. āthlon.
-            if matches[0]:
-                matches = [x for x in matches if x]
-                debprint("get_matches: deleted blanks, matches is now %s" % matches)
+            matches = nonblank
+            debprint("get_matches: deleted blanks, matches is now %s" % matches)
         return matches
 
     # attempt to match the current Greek character against the current
@@ -588,39 +559,12 @@ def tr_matching(greek, latin, err=False, msgfun=msg):
                     return True
                 newpos += 1
 
-        for m in matches:
-            preserve_latin = False
-            # If an element of the match list is a list, it means
-            # "don't canonicalize".
-            if type(m) is list:
-                preserve_latin = True
-                m = m[0]
-            # A one-element tuple is a signal for use in self-canonicalization,
-            # not here.
-            elif type(m) is tuple:
-                m = m[0]
-            l = lind[0]
-            matched = True
+        for m, subst, substgreek in matches:
             debprint("m: %s" % m)
-            for cp in m:
-                debprint("cp: %s" % cp)
-                if l < llen and la[l] == cp:
-                    l = l + 1
-                else:
-                    matched = False
-                    break
-            if matched:
+            if latin.startswith(m, lind[0]):
                 res.append(ac)
-                if preserve_latin:
-                    for cp in m:
-                        lres.append(cp)
-                else:
-                    subst = matches[0]
-                    if type(subst) is list or type(subst) is tuple:
-                        subst = subst[0]
-                    for cp in subst:
-                        lres.append(cp)
-                lind[0] = l
+                lres.append(subst)
+                lind[0] += len(m)
                 gind[0] = gind[0] + 1
                 debprint("matched; lind is %s" % lind[0])
                 return True
@@ -714,6 +658,7 @@ def tr_matching(greek, latin, err=False, msgfun=msg):
     latin = post_canonicalize_latin(latin)
     return greek, latin
 
+@translit_memoized
 def remove_diacritics(text):
     text = rsub(text, u"[ᾸᾹᾰᾱῘῙῐῑῨῩῠῡ]",
             {u"Ᾰ":u"Α", u"Ᾱ":u"Α", u"ᾰ":u"α", u"ᾱ":u"α", u"Ῐ":u"Ι", u"Ῑ":u"Ι",
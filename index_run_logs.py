@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+#    index_run_logs.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Index run logs in an SQLite database with a full-text index, and query
+# them. Logs are read straight out of the run-logs-*.tar.bz2 archives (or
+# from single logs, possibly compressed) without extracting them. Each log
+# is a run, named after the log file (e.g.
+# run-logs-4/canon_arabic.1.pagetext.out), and its script is the first
+# component of the file name (e.g. canon_arabic). Each line is classified
+# by its wording using blib.EventLog.parse_message(), giving the page, the
+# template being processed (e.g. t+), the message type (replace, process,
+# warning, ...) and for warnings a warning code. Ingesting a run again
+# replaces what was indexed for it before.
+#
+# For example, to find all failures to match-canon in t+ templates in
+# canon_arabic runs:
+#
+# index_run_logs.py -f logs.db --add run-logs-*.tar.bz2
+# index_run_logs.py -f logs.db --script canon_arabic --template t+ \
+#   '"unable to match-canon"'
+
+import re, os, sqlite3, argparse
+
+import blib
+from blib import msg
+
+class RunLogIndex(object):
+  # Lines of the form "* [[TITLE]]: ...", from output of parse_log_file.py
+  # turned into a wiki list for manual editing (see push_manual_changes.py).
+  bullet_re = re.compile(r"^\* \[\[(.+?)\]\]: (.*)$", re.S)
+
+  def __init__(self, filename):
+    self.conn = sqlite3.connect(filename)
+    self.conn.executescript("""
+      CREATE TABLE IF NOT EXISTS runs
+        (id INTEGER PRIMARY KEY, name TEXT UNIQUE, script TEXT,
+         archive TEXT);
+      CREATE TABLE IF NOT EXISTS messages
+        (id INTEGER PRIMARY KEY, run INTEGER, line INTEGER,
+         pageindex TEXT, page TEXT, template TEXT, param TEXT, type TEXT,
+         code TEXT, text TEXT);
+      CREATE INDEX IF NOT EXISTS messages_run ON messages (run, line);
+      CREATE INDEX IF NOT EXISTS messages_page ON messages (page);
+      CREATE INDEX IF NOT EXISTS messages_template
+        ON messages (template, type);
+      CREATE INDEX IF NOT EXISTS messages_type ON messages (type, code);
+      CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts4
+        (content="messages", text,
+         tokenize=unicode61 "remove_diacritics=0");
+      """)
+
+  # Return the name of the template in TEMPLATE, the text of a template.
+  @staticmethod
+  def template_name(template):
+    m = re.match(r"\{\{\s*([^|{}]*?)\s*[|}]", template)
+    return m and m.group(1)
+
+  # Classify each line of FP, yielding the fields of the messages table
+  # after the run.
+  def iter_messages(self, fp):
+    for lineno, line in enumerate(fp, 1):
+      line = line.rstrip("\r\n").decode("utf-8", "replace")
+      event = blib.EventLog.parse_message(line)
+      if not event:
+        m = self.bullet_re.match(line)
+        if m:
+          event = blib.EventLog.parse_message(u"Page - %s: %s" % m.groups())
+          event["index"] = None
+      if not event:
+        yield (lineno, None, None, None, None,
+            "warning" if line.startswith("WARNING") else "message", None,
+            line)
+        continue
+      template = event.get("tempname") or self.template_name(
+          event.get("before") or event.get("template") or "")
+      index = event["index"]
+      yield (lineno, index if index is None else unicode(index),
+          event["page"], template,
+          event.get("param"), event["action"], event.get("code"), line)
+
+  # Index the run NAME from archive ARCHIVE (None if not from an archive)
+  # with its log in FP, replacing anything indexed for it before. Return the
+  # number of lines indexed.
+  def add_run(self, name, archive, fp):
+    script = os.path.basename(name).split(".")[0]
+    with self.conn:
+      row = self.conn.execute("SELECT id FROM runs WHERE name = ?",
+          (name,)).fetchone()
+      if row:
+        runid = row[0]
+        self.conn.execute("""DELETE FROM messages_fts WHERE docid IN
+          (SELECT id FROM messages WHERE run = ?)""", (runid,))
+        self.conn.execute("DELETE FROM messages WHERE run = ?", (runid,))
+        self.conn.execute("UPDATE runs SET script = ?, archive = ? WHERE id = ?",
+            (script, archive, runid))
+      else:
+        runid = self.conn.execute(
+            "INSERT INTO runs (name, script, archive) VALUES (?, ?, ?)",
+            (name, script, archive)).lastrowid
+      self.conn.executemany("""INSERT INTO messages (run, line, pageindex,
+        page, template, param, type, code, text)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        ((runid,) + fields for fields in self.iter_messages(fp)))
+      self.conn.execute("""INSERT INTO messages_fts (docid, text)
+        SELECT id, text FROM messages WHERE run = ?""", (runid,))
+      count, = self.conn.execute("SELECT COUNT(*) FROM messages WHERE run = ?",
+          (runid,)).fetchone()
+    return count
+
+  # Index all the logs in FILENAME, a tar archive or single log.
+  def add(self, filename):
+    archive = re.search(r"\.(tar|tbz2?|tgz)", filename) and filename or None
+    for name, fp in blib.iter_log_files(filename):
+      count = self.add_run(name, archive, fp)
+      msg("Indexed %s lines from %s" % (count, name))
+
+  # Yield (RUN, LINE, TEXT) for the messages matching the full-text query
+  # MATCH (in SQLite FTS syntax, e.g. '"unable to match-canon"') if given,
+  # restricted to those with the given values of the other arguments, in
+  # run and line order, at most LIMIT of them if LIMIT is given.
+  def query(self, match=None, script=None, run=None, page=None,
+      template=None, msgtype=None, code=None, limit=None):
+    tables = ["messages JOIN runs ON runs.id = messages.run"]
+    conds = []
+    args = []
+    if match:
+      tables.append("JOIN messages_fts ON messages_fts.docid = messages.id")
+      conds.append("messages_fts MATCH ?")
+      args.append(match)
+    for column, value in [("runs.script", script), ("runs.name", run),
+        ("messages.page", page), ("messages.template", template),
+        ("messages.type", msgtype), ("messages.code", code)]:
+      if value is not None:
+        conds.append("%s = ?" % column)
+        args.append(value)
+    sql = "SELECT runs.name, messages.line, messages.text FROM %s" % (
+        " ".join(tables))
+    if conds:
+      sql += " WHERE " + " AND ".join(conds)
+    sql += " ORDER BY runs.id, messages.line"
+    if limit:
+      sql += " LIMIT %d" % limit
+    return self.conn.execute(sql, args)
+
+if __name__ == "__main__":
+  pa = argparse.ArgumentParser(description="Index run logs and query them")
+  pa.add_argument("-f", "--file", required=True, help="Index database file")
+  pa.add_argument("--add", nargs="+", metavar="LOG",
+      help="""Index these logs: run-logs-*.tar.bz2 archives, or single logs
+(possibly compressed)""")
+  pa.add_argument("--script", help="Only messages from runs of this script")
+  pa.add_argument("--run", help="Only messages from this run (log file)")
+  pa.add_argument("--page", help="Only messages about this page")
+  pa.add_argument("--template",
+      help="Only messages about this template (e.g. t+)")
+  pa.add_argument("--type",
+      help="""Only messages of this type (replace, process, warning,
+would-save, save, skip, error or message)""")
+  pa.add_argument("--code", help="Only warnings with this warning code")
+  pa.add_argument("--limit", type=int, help="Output at most this many messages")
+  pa.add_argument("query", nargs="?",
+      help="Full-text query, in SQLite FTS syntax")
+  params = pa.parse_args()
+
+  index = RunLogIndex(params.file)
+  for filename in params.add or []:
+    index.add(filename)
+  def arg(value):
+    return value and value.decode("utf-8")
+  if params.query or params.script or params.run or params.page or (
+      params.template or params.type or params.code):
+    for run, line, text in index.query(arg(params.query), arg(params.script),
+        arg(params.run), arg(params.page), arg(params.template),
+        arg(params.type), arg(params.code), params.limit):
+      msg("%s:%s: %s" % (run, line, text))
+  elif not params.add:
+    for script, runs, lines in index.conn.execute("""SELECT script,
+        COUNT(DISTINCT runs.id), COUNT(*) FROM runs JOIN messages
+        ON messages.run = runs.id GROUP BY script ORDER BY script"""):
+      msg("%s: %s runs, %s lines" % (script, runs, lines))
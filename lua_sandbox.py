@@ -0,0 +1,909 @@
+#!/usr/bin/env python
+#coding: utf-8
+
+#    lua_sandbox.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A local imitation of Scribunto, the MediaWiki extension that runs Lua
+# modules, so that calls to {{#invoke:...}} and to simple wrapper templates
+# around it (e.g. {{ar-verb-part-all|...}}) can be expanded without an
+# expandtemplates request. Modules are loaded from .lua files on disk (by
+# default the copies in this directory, e.g. ar-verb.lua for
+# [[Module:ar-verb]]), and a minimal version of the mw.* library is provided,
+# enough for the modules here. Anything the sandbox can't handle (a module
+# not available locally, an mw.* function not implemented, a template that
+# isn't a known wrapper, nested template calls) makes expand() return None,
+# and the caller should then expand the text on the server as usual.
+#
+# Requires the 'lupa' package (Python bindings for Lua).
+
+import re, os, sys, unicodedata
+
+try:
+  import lupa
+except ImportError:
+  lupa = None
+
+# Templates that consist of nothing but an #invoke of a module function,
+# passing on their own arguments; maps the template name to the module and
+# function.
+wrapper_templates = {
+  "ar-conj": ("ar-verb", "show"),
+  "ar-past3sm": ("ar-verb", "past3sm"),
+  "ar-past3sm-all": ("ar-verb", "past3sm_all"),
+  "ar-verb-part": ("ar-verb", "verb_part"),
+  "ar-verb-part-all": ("ar-verb", "verb_part_all"),
+  "ar-verb-prop": ("ar-verb", "verb_prop"),
+  "ar-verb-forms": ("ar-verb", "verb_forms"),
+}
+
+# Namespace numbers for mw.title objects.
+namespaces = {
+  "": 0, "Talk": 1, "User": 2, "User talk": 3, "Wiktionary": 4,
+  "Wiktionary talk": 5, "File": 6, "MediaWiki": 8, "Template": 10,
+  "Template talk": 11, "Help": 12, "Category": 14, "Appendix": 100,
+  "Appendix talk": 101, "Concordance": 102, "Index": 104, "Rhymes": 106,
+  "Transwiki": 108, "Thesaurus": 110, "Citations": 114, "Sign gloss": 116,
+  "Reconstruction": 118, "Reconstruction talk": 119, "Module": 828,
+  "Module talk": 829,
+}
+
+no_such_function = "The function you specified did not exist."
+
+# Raised when something needed to expand a piece of text isn't available
+# locally, so it must be expanded on the server instead.
+class Unavailable(Exception):
+  pass
+
+############################################################################
+#                     Lua patterns as Python regexes                       #
+############################################################################
+
+# Ranges of code points in a Unicode general category (or group of
+# categories, e.g. "P" for all punctuation), computed on first use.
+category_ranges_cache = {}
+
+def category_ranges(cats):
+  if cats not in category_ranges_cache:
+    ranges = []
+    for cp in xrange(sys.maxunicode + 1):
+      if unicodedata.category(unichr(cp)) in cats:
+        if ranges and ranges[-1][1] == cp - 1:
+          ranges[-1][1] = cp
+        else:
+          ranges.append([cp, cp])
+    category_ranges_cache[cats] = ranges
+  return category_ranges_cache[cats]
+
+def complement_ranges(ranges):
+  result = []
+  nextcp = 0
+  for lo, hi in ranges:
+    if lo > nextcp:
+      result.append([nextcp, lo - 1])
+    nextcp = hi + 1
+  if nextcp <= sys.maxunicode:
+    result.append([nextcp, sys.maxunicode])
+  return result
+
+def ranges_for_chars(chars):
+  return [[ord(c), ord(c)] for c in chars]
+
+# The character classes of Scribunto's mw.ustring patterns, which are
+# defined in terms of Unicode general categories rather than ASCII.
+def class_ranges(c):
+  lower = c.lower()
+  if lower == "a":
+    ranges = category_ranges(("Lu", "Ll", "Lt", "Lm", "Lo"))
+  elif lower == "c":
+    ranges = category_ranges(("Cc",))
+  elif lower == "d":
+    ranges = category_ranges(("Nd",))
+  elif lower == "l":
+    ranges = category_ranges(("Ll",))
+  elif lower == "p":
+    ranges = category_ranges(("Pc", "Pd", "Ps", "Pe", "Pi", "Pf", "Po"))
+  elif lower == "s":
+    ranges = sorted(category_ranges(("Zs", "Zl", "Zp")) +
+        ranges_for_chars(u"\t\n\v\f\r"))
+  elif lower == "u":
+    ranges = category_ranges(("Lu",))
+  elif lower == "w":
+    ranges = sorted(category_ranges(("Lu", "Ll", "Lt", "Lm", "Lo", "Nd")))
+  elif lower == "x":
+    ranges = [[0x30, 0x39], [0x41, 0x46], [0x61, 0x66], [0xFF10, 0xFF19],
+        [0xFF21, 0xFF26], [0xFF41, 0xFF46]]
+  elif lower == "z":
+    ranges = [[0, 0]]
+  else:
+    return None
+  if c != lower:
+    ranges = complement_ranges(ranges)
+  return ranges
+
+def regex_ranges(ranges):
+  def char(cp):
+    return re.escape(unichr(cp)) if cp > 0 else u"\\x00"
+  return u"".join(char(lo) if lo == hi else u"%s-%s" % (char(lo), char(hi))
+      for lo, hi in ranges)
+
+def set_char(c):
+  return u"\\" + c if c in u"\\]^-[" else c
+
+class LuaPattern(object):
+  def __init__(self, pattern):
+    self.anchored = pattern.startswith(u"^")
+    # Indices (1-based) of position captures, i.e. ().
+    self.position_captures = set()
+    self.ncaptures = 0
+    self.regex = re.compile(self.translate(pattern[1:] if self.anchored
+      else pattern), re.UNICODE | re.DOTALL)
+
+  # Translate the set starting at PATTERN[I] (just after the opening
+  # bracket); return the regex set and the index just past the closing
+  # bracket.
+  def translate_set(self, pattern, i):
+    parts = [u"["]
+    if i < len(pattern) and pattern[i] == u"^":
+      parts.append(u"^")
+      i += 1
+    first = True
+    while True:
+      if i >= len(pattern):
+        raise ValueError("malformed pattern (missing ']')")
+      c = pattern[i]
+      if c == u"]" and not first:
+        return u"".join(parts) + u"]", i + 1
+      first = False
+      if c == u"%":
+        if i + 1 >= len(pattern):
+          raise ValueError("malformed pattern (ends with '%')")
+        ranges = class_ranges(pattern[i + 1])
+        parts.append(regex_ranges(ranges) if ranges is not None
+            else set_char(pattern[i + 1]))
+        i += 2
+      elif (i + 2 < len(pattern) and pattern[i + 1] == u"-" and
+          pattern[i + 2] != u"]"):
+        parts.append(u"%s-%s" % (set_char(c), set_char(pattern[i + 2])))
+        i += 3
+      else:
+        parts.append(set_char(c))
+        i += 1
+
+  def translate(self, pattern):
+    parts = []
+    i = 0
+    open_captures = []
+    while i < len(pattern):
+      c = pattern[i]
+      # A single character class, which can be followed by a quantifier.
+      item = None
+      if c == u"(":
+        self.ncaptures += 1
+        if pattern[i + 1:i + 2] == u")":
+          self.position_captures.add(self.ncaptures)
+          parts.append(u"()")
+          i += 2
+        else:
+          open_captures.append(self.ncaptures)
+          parts.append(u"(")
+          i += 1
+      elif c == u")":
+        if not open_captures:
+          raise ValueError("invalid pattern capture")
+        open_captures.pop()
+        parts.append(u")")
+        i += 1
+      elif c == u"$" and i == len(pattern) - 1:
+        parts.append(u"\\Z")
+        i += 1
+      elif c == u"%":
+        if i + 1 >= len(pattern):
+          raise ValueError("malformed pattern (ends with '%')")
+        d = pattern[i + 1]
+        if d == u"b":
+          raise Unavailable("%b in patterns")
+        elif d == u"f":
+          if pattern[i + 2:i + 3] != u"[":
+            raise ValueError("missing '[' after '%f' in pattern")
+          fset, i = self.translate_set(pattern, i + 3)
+          # The beginning and end of the string count as \0.
+          if re.match(fset, u"\0", re.UNICODE):
+            parts.append(u"(?:(?<=.)(?<!%s)(?=%s|\\Z))" % (fset, fset))
+          else:
+            parts.append(u"(?:(?<!%s)(?=%s))" % (fset, fset))
+          continue
+        elif d.isdigit():
+          n = int(d)
+          if n == 0 or n > self.ncaptures or n in open_captures:
+            raise ValueError("invalid capture index %%%s" % n)
+          parts.append(u"(?:\\%s)" % n)
+          i += 2
+          continue
+        else:
+          ranges = class_ranges(d)
+          item = (u"[%s]" % regex_ranges(ranges) if ranges is not None
+              else re.escape(d))
+          i += 2
+      elif c == u"[":
+        item, i = self.translate_set(pattern, i + 1)
+      elif c == u".":
+        item = u"."
+        i += 1
+      else:
+        item = re.escape(c)
+        i += 1
+      if item is not None:
+        q = pattern[i:i + 1]
+        if q == u"-":
+          item += u"*?"
+          i += 1
+        elif q and q in u"*+?":
+          item += q
+          i += 1
+        parts.append(item)
+    if open_captures:
+      raise ValueError("unfinished capture")
+    return u"".join(parts)
+
+  # Return the captures of match M as Lua would: the whole match if the
+  # pattern has no captures, with position captures as 1-based integers.
+  def captures(self, m, whole_if_none=True):
+    if self.ncaptures == 0:
+      return (m.group(0),) if whole_if_none else ()
+    return tuple(m.start(n) + 1 if n in self.position_captures else m.group(n)
+      for n in xrange(1, self.ncaptures + 1))
+
+  # Find the first match at or after position POS (0-based), or at POS only
+  # if the pattern is anchored.
+  def search(self, s, pos):
+    if self.anchored:
+      return self.regex.match(s, pos)
+    return self.regex.search(s, pos)
+
+  # Iterate over successive matches starting from position POS, treating
+  # empty matches as Lua does.
+  def finditer(self, s, pos=0):
+    while pos <= len(s):
+      m = self.search(s, pos)
+      if not m:
+        return
+      yield m
+      if self.anchored:
+        return
+      pos = m.end() if m.end() > m.start() else m.start() + 1
+
+pattern_cache = {}
+
+def lua_pattern(pattern):
+  if pattern not in pattern_cache:
+    pattern_cache[pattern] = LuaPattern(pattern)
+  return pattern_cache[pattern]
+
+############################################################################
+#                             mw.ustring                                   #
+############################################################################
+
+def tostr(s):
+  if isinstance(s, unicode):
+    return s
+  if isinstance(s, str):
+    return s.decode("utf-8")
+  if isinstance(s, float):
+    return u"%.14g" % s
+  return unicode(s)
+
+# Convert a 1-based Lua string index, possibly negative, to a 0-based
+# Python one.
+def start_index(i, length):
+  i = int(i)
+  if i < 0:
+    i = max(length + i + 1, 1)
+  elif i == 0:
+    i = 1
+  return i - 1
+
+class UString(object):
+  def __init__(self, sandbox):
+    self.sandbox = sandbox
+
+  def len(self, s):
+    return len(tostr(s))
+
+  def sub(self, s, i=1, j=-1):
+    s = tostr(s)
+    i = start_index(i, len(s))
+    j = int(j)
+    if j < 0:
+      j = len(s) + j + 1
+    return s[i:j]
+
+  def char(self, *cps):
+    return u"".join(unichr(int(cp)) for cp in cps)
+
+  def codepoint(self, s, i=1, j=None):
+    s = tostr(s)
+    j = i if j is None else j
+    return tuple(ord(c) for c in self.sub(s, i, j))
+
+  def gcodepoint(self, s, i=1, j=-1):
+    cps = iter([ord(c) for c in self.sub(s, i, j)])
+    return lambda *args: next(cps, None)
+
+  def upper(self, s):
+    return tostr(s).upper()
+
+  def lower(self, s):
+    return tostr(s).lower()
+
+  def rep(self, s, n):
+    return tostr(s) * int(n)
+
+  def find(self, s, pattern, init=1, plain=False):
+    s = tostr(s)
+    pattern = tostr(pattern)
+    init = start_index(init, len(s))
+    if init > len(s):
+      return None
+    if plain:
+      pos = s.find(pattern, init)
+      if pos < 0:
+        return None
+      return (pos + 1, pos + len(pattern))
+    pat = lua_pattern(pattern)
+    m = pat.search(s, init)
+    if not m:
+      return None
+    return (m.start() + 1, m.end()) + pat.captures(m, whole_if_none=False)
+
+  def match(self, s, pattern, init=1):
+    s = tostr(s)
+    init = start_index(init, len(s))
+    if init > len(s):
+      return None
+    pat = lua_pattern(tostr(pattern))
+    m = pat.search(s, init)
+    if not m:
+      return None
+    return pat.captures(m)
+
+  def gmatch(self, s, pattern):
+    s = tostr(s)
+    pat = lua_pattern(tostr(pattern))
+    matches = pat.finditer(s)
+    def next_match(*args):
+      m = next(matches, None)
+      return pat.captures(m) if m else None
+    return next_match
+
+  def gsub(self, s, pattern, repl, n=None):
+    s = tostr(s)
+    pat = lua_pattern(tostr(pattern))
+    repltype = lupa.lua_type(repl)
+    if repltype is None:
+      repl = tostr(repl)
+    parts = []
+    count = 0
+    pos = 0
+    for m in pat.finditer(s):
+      if n is not None and count >= n:
+        break
+      count += 1
+      parts.append(s[pos:m.start()])
+      captures = pat.captures(m)
+      if repltype == "table":
+        value = repl[captures[0]]
+      elif repltype == "function":
+        value = repl(*captures)
+        if isinstance(value, tuple):
+          value = value[0] if value else None
+      else:
+        def expand_capture(cm):
+          d = cm.group(1)
+          if d == u"0":
+            return m.group(0)
+          if d.isdigit():
+            return tostr(captures[int(d) - 1])
+          return d
+        value = re.sub(u"%(.)", expand_capture, repl)
+      if value is None or value is False:
+        value = m.group(0)
+      elif not isinstance(value, basestring) and not isinstance(
+          value, (int, long, float)):
+        raise ValueError("invalid replacement value (a %s)" %
+            lupa.lua_type(value))
+      parts.append(tostr(value))
+      # After an empty match, the next character is copied unchanged.
+      pos = m.end()
+      if m.end() == m.start() and pos < len(s):
+        parts.append(s[pos])
+        pos += 1
+    parts.append(s[pos:])
+    return (u"".join(parts), count)
+
+  def toNFC(self, s):
+    return unicodedata.normalize("NFC", tostr(s))
+
+  def toNFD(self, s):
+    return unicodedata.normalize("NFD", tostr(s))
+
+  def toNFKC(self, s):
+    return unicodedata.normalize("NFKC", tostr(s))
+
+  def toNFKD(self, s):
+    return unicodedata.normalize("NFKD", tostr(s))
+
+############################################################################
+#                           The Lua side                                   #
+############################################################################
+
+# Set up the mw library, require() and frames. Unknown mw.* functions call
+# unavailable(), so that the expansion is done on the server rather than
+# failing with a Lua error the server wouldn't give.
+lua_prelude = u"""
+local python = ...
+local ustring, unavailable, load_module_source = python.ustring,
+  python.unavailable, python.load_module_source
+
+unpack = unpack or table.unpack
+loadstring = loadstring or load
+table.getn = table.getn or function(t) return #t end
+table.maxn = table.maxn or function(t)
+  local n = 0
+  for k in pairs(t) do
+    if type(k) == "number" and k > n then n = k end
+  end
+  return n
+end
+
+-- Numbers from Python arrive as floats; make whole ones integers, so they
+-- print as in the Lua 5.1 used by Scribunto (e.g. "6" not "6.0").
+local function ints(...)
+  local n, t = select("#", ...), {...}
+  for i = 1, n do
+    if math.type(t[i]) == "float" then t[i] = math.tointeger(t[i]) or t[i] end
+  end
+  return table.unpack(t, 1, n)
+end
+
+local function strict(name, t)
+  return setmetatable(t, {__index = function(t, k)
+    unavailable(name .. "." .. tostring(k))
+  end})
+end
+
+mw = {}
+mw.ustring = strict("mw.ustring", {
+  len = function(s) return ints(ustring.len(s)) end,
+  sub = function(s, i, j) return ustring.sub(s, i or 1, j or -1) end,
+  char = function(...) return ustring.char(...) end,
+  codepoint = function(s, i, j)
+    return ints(ustring.codepoint(s, i or 1, j))
+  end,
+  gcodepoint = function(s, i, j)
+    local iter = ustring.gcodepoint(s, i or 1, j or -1)
+    return function() return ints(iter()) end, nil, nil
+  end,
+  find = function(s, p, init, plain)
+    return ints(ustring.find(s, p, init or 1, plain or false))
+  end,
+  match = function(s, p, init) return ints(ustring.match(s, p, init or 1)) end,
+  gmatch = function(s, p)
+    local iter = ustring.gmatch(s, p)
+    return function() return ints(iter()) end, nil, nil
+  end,
+  gsub = function(s, p, repl, n) return ints(ustring.gsub(s, p, repl, n)) end,
+  upper = function(s) return ustring.upper(s) end,
+  lower = function(s) return ustring.lower(s) end,
+  rep = function(s, n) return ustring.rep(s, n) end,
+  format = string.format,
+  byte = string.byte,
+  toNFC = function(s) return ustring.toNFC(s) end,
+  toNFD = function(s) return ustring.toNFD(s) end,
+  toNFKC = function(s) return ustring.toNFKC(s) end,
+  toNFKD = function(s) return ustring.toNFKD(s) end,
+  maxPatternLength = math.huge,
+  maxStringLength = math.huge,
+})
+
+mw.text = strict("mw.text", {})
+
+function mw.text.gsplit(text, pattern, plain)
+  local s, l = 1, mw.ustring.len(text)
+  return function()
+    if s then
+      local e, n = mw.ustring.find(text, pattern, s, plain)
+      local ret
+      if not e then
+        ret = mw.ustring.sub(text, s)
+        s = nil
+      elseif n < e then
+        -- Empty separator
+        ret = mw.ustring.sub(text, s, e)
+        if e < l then s = e + 1 else s = nil end
+      else
+        ret = e > s and mw.ustring.sub(text, s, e - 1) or ''
+        s = n + 1
+      end
+      return ret
+    end
+  end, nil, nil
+end
+
+function mw.text.split(text, pattern, plain)
+  local ret = {}
+  for m in mw.text.gsplit(text, pattern, plain) do
+    ret[#ret + 1] = m
+  end
+  return ret
+end
+
+function mw.text.trim(s, charset)
+  charset = charset or '\\t\\r\\n\\f '
+  s = mw.ustring.gsub(s, '^[' .. charset .. ']*(.-)[' .. charset .. ']*$',
+    '%1')
+  return s
+end
+
+local function make_title(ns, nstext, text)
+  local prefixed = nstext == "" and text or nstext .. ":" .. text
+  local base = mw.ustring.match(text, "^(.*)/[^/]*$") or text
+  return {
+    namespace = ns, nsText = nstext, text = text,
+    prefixedText = prefixed, fullText = prefixed,
+    baseText = base, rootText = mw.ustring.match(text, "^[^/]*"),
+    subpageText = mw.ustring.match(text, "[^/]*$"),
+    isSubpage = base ~= text,
+    isContentPage = ns == 0 or ns == 100 or ns == 118,
+    exists = true,
+  }
+end
+
+mw.title = strict("mw.title", {})
+
+function mw.title.makeTitle(ns, text)
+  return make_title(python.namespace_number(ns), python.namespace_text(ns),
+    text)
+end
+
+function mw.title.new(text, ns)
+  local nstext, title = python.split_title(text, ns)
+  return make_title(python.namespace_number(nstext), nstext, title)
+end
+
+function mw.title.getCurrentTitle()
+  return mw.title.new(python.current_title())
+end
+
+local current_frame
+
+function mw.getCurrentFrame()
+  return current_frame
+end
+
+function mw.clone(val)
+  local seen = {}
+  local function clone(v)
+    if type(v) ~= "table" then return v end
+    if seen[v] then return seen[v] end
+    local t = {}
+    seen[v] = t
+    for k, x in pairs(v) do t[clone(k)] = clone(x) end
+    return setmetatable(t, getmetatable(v))
+  end
+  return clone(val)
+end
+
+function mw.log(...) end
+function mw.logObject(...) end
+
+setmetatable(mw, {__index = function(t, k) unavailable("mw." .. k) end})
+
+local loaded = {}
+
+-- Scribunto's built-in libraryUtil, as used by some modules.
+loaded["libraryUtil"] = {
+  checkType = function(name, argIdx, arg, expectType, nilOk)
+    if arg == nil and nilOk then return end
+    if type(arg) ~= expectType then
+      error(string.format("bad argument #%d to '%s' (%s expected, got %s)",
+        argIdx, name, expectType, type(arg)), 3)
+    end
+  end,
+  checkTypeMulti = function(name, argIdx, arg, expectTypes)
+    for _, t in ipairs(expectTypes) do
+      if type(arg) == t then return end
+    end
+    error(string.format("bad argument #%d to '%s' (%s expected, got %s)",
+      argIdx, name, table.concat(expectTypes, " or "), type(arg)), 3)
+  end,
+}
+
+-- [[Module:debug]]'s tracking function, whose only effect on the server is
+-- to add a page to a tracking category.
+loaded["Module:debug"] = strict("Module:debug", {
+  track = function(key) return true end,
+})
+
+function require(name)
+  if loaded[name] == nil then
+    local source, chunkname = load_module_source(name)
+    local chunk = assert(load(source, "=" .. chunkname))
+    local result = chunk()
+    loaded[name] = result == nil and true or result
+  end
+  return loaded[name]
+end
+
+mw.loadData = require
+
+local function make_frame(title, args, parent)
+  local frame = {args = args}
+  function frame:getParent() return parent end
+  function frame:getTitle() return title end
+  function frame:getArgument(name)
+    local arg = args[name]
+    return arg and {expand = function() return arg end}
+  end
+  function frame:newChild(opts)
+    return make_frame(opts.title or title, opts.args or {}, frame)
+  end
+  function frame:preprocess(text)
+    if type(text) == "table" then text = text.text end
+    return python.preprocess(text)
+  end
+  function frame:expandTemplate(opts)
+    return python.expand_template(opts.title, opts.args or {})
+  end
+  return strict("frame", frame)
+end
+
+return function(modname, funcname, args, parentname, parentargs)
+  local module = require("Module:" .. modname)
+  local func = type(module) == "table" and module[funcname]
+  if type(func) ~= "function" then
+    error(python.no_such_function, 0)
+  end
+  local parent = parentname and make_frame(parentname, parentargs) or
+    make_frame(python.current_title(), {})
+  local frame = make_frame("Module:" .. modname, args, parent)
+  local old_frame = current_frame
+  current_frame = frame
+  local ok, result = pcall(func, frame)
+  current_frame = old_frame
+  if not ok then error(result, 0) end
+  return tostring(result == nil and "" or result)
+end
+"""
+
+############################################################################
+#                              The sandbox                                 #
+############################################################################
+
+# Page names on Wiktionary are case-sensitive, even in the first letter.
+def canonicalize_name(name):
+  name = name.replace("_", " ").strip()
+  return re.sub(" +", " ", name)
+
+# Return the canonical form of namespace name NS, or None if it isn't one.
+def canonicalize_namespace(ns):
+  ns = canonicalize_name(ns).lower()
+  for name in namespaces:
+    if name.lower() == ns:
+      return name
+  return None
+
+def split_title(title, ns=None):
+  m = re.match("^(.*?):(.*)$", title)
+  if m and canonicalize_namespace(m.group(1)) is not None:
+    return canonicalize_namespace(m.group(1)), m.group(2)
+  if ns is not None:
+    return namespace_text(ns), title
+  return "", title
+
+def namespace_text(ns):
+  if isinstance(ns, basestring):
+    if canonicalize_namespace(ns) is None:
+      raise Unavailable("namespace %s" % ns)
+    return canonicalize_namespace(ns)
+  for name, num in namespaces.iteritems():
+    if num == ns:
+      return name
+  raise Unavailable("namespace %s" % ns)
+
+def namespace_number(ns):
+  return namespaces[namespace_text(ns)]
+
+# Split the arguments of a template call (the text between the braces) at
+# top-level vertical bars, i.e. not inside of links.
+def split_template_args(text):
+  parts = []
+  depth = 0
+  start = 0
+  for m in re.finditer(r"\[\[|\]\]|\|", text):
+    if m.group(0) == "[[":
+      depth += 1
+    elif m.group(0) == "]]":
+      depth = max(depth - 1, 0)
+    elif depth == 0:
+      parts.append(text[start:m.start()])
+      start = m.end()
+  parts.append(text[start:])
+  return parts
+
+# Convert template arguments as written into a dictionary in the form seen
+# by a module: positional arguments numbered from 1 and left as is, named
+# arguments with whitespace stripped.
+def template_args_dict(args):
+  result = {}
+  pos = 1
+  for arg in args:
+    if "=" in arg:
+      name, value = arg.split("=", 1)
+      name = name.strip()
+      if re.match("^[0-9]+$", name):
+        name = int(name)
+      result[name] = value.strip()
+    else:
+      result[pos] = arg
+      pos += 1
+  return result
+
+class LuaSandbox(object):
+  # MODULE_DIRS is a list of directories in which to look for a module's
+  # source; [[Module:NAME]] is found as NAME.lua or module-NAME.lua (with
+  # spaces and slashes replaced by hyphens). If FETCH is given, it's called
+  # with the title of a module not found locally and should return its
+  # source, or None if it doesn't exist; fetched modules are saved in
+  # SAVE_DIR, if given, so later runs can find them.
+  def __init__(self, module_dirs=None, fetch=None, save_dir=None):
+    if not lupa:
+      raise ImportError("The 'lupa' package is needed to expand Lua modules locally")
+    self.module_dirs = module_dirs or [os.path.dirname(os.path.abspath(__file__))]
+    self.fetch = fetch
+    self.save_dir = save_dir
+    self.title = None
+    self.unavailable = None
+    self.local_expansions = 0
+    self.server_expansions = 0
+    self.lua = lupa.LuaRuntime(unpack_returned_tuples=True)
+    python = self.lua.table_from({
+      "ustring": UString(self),
+      "unavailable": self.mark_unavailable,
+      "load_module_source": self.load_module_source,
+      "current_title": lambda: self.title,
+      "split_title": self.split_title,
+      "namespace_text": namespace_text,
+      "namespace_number": namespace_number,
+      "preprocess": self.preprocess,
+      "expand_template": self.expand_template,
+      "no_such_function": no_such_function,
+    })
+    self.invoke_function = self.lua.execute(lua_prelude, python)
+
+  def mark_unavailable(self, what):
+    self.unavailable = what
+    raise Unavailable(what)
+
+  def split_title(self, title, ns=None):
+    return split_title(tostr(title), ns)
+
+  def module_filenames(self, name):
+    name = re.sub("[ /]", "-", name)
+    return [name + ".lua", "module-" + name + ".lua"]
+
+  def load_module_source(self, name):
+    name = tostr(name)
+    if not name.startswith("Module:"):
+      self.mark_unavailable(name)
+    modname = name[len("Module:"):]
+    for dirname in self.module_dirs + ([self.save_dir] if self.save_dir else []):
+      for filename in self.module_filenames(modname):
+        path = os.path.join(dirname, filename)
+        if os.path.exists(path):
+          with open(path) as f:
+            return f.read().decode("utf-8"), name
+    source = self.fetch and self.fetch(name)
+    if source is None:
+      self.mark_unavailable(name)
+    if self.save_dir:
+      path = os.path.join(self.save_dir, self.module_filenames(modname)[0])
+      with open(path, "w") as f:
+        f.write(source.encode("utf-8"))
+    return source, name
+
+  # Convert the message of a Lua error into the form Scribunto shows.
+  def error_text(self, e):
+    message = unicode(e.args[0] if e.args else e).split("\n")[0]
+    m = re.match("^(Module:.*?):([0-9]+): (.*)$", message)
+    if message == no_such_function:
+      message = "Script error: %s" % message
+    elif m:
+      message = "Lua error in %s at line %s: %s." % m.groups()
+    else:
+      message = "Lua error: %s." % message
+    return ('<strong class="error"><span class="scribunto-error">%s</span></strong>'
+        % message)
+
+  # Call function FUNCNAME in module MODNAME with the invocation's arguments
+  # in ARGS and, if called through a wrapper template, that template's name
+  # and arguments in PARENTNAME and PARENTARGS.
+  def invoke(self, modname, funcname, args, parentname=None, parentargs=None):
+    return self.invoke_function(modname, funcname, self.lua.table_from(args),
+        parentname, parentargs and self.lua.table_from(parentargs))
+
+  # Expand a single template call or #invoke, given the text inside the
+  # braces.
+  def expand_call(self, text):
+    if "{{" in text or "}}" in text:
+      raise Unavailable("nested template call")
+    args = split_template_args(text)
+    name = args[0]
+    m = re.match(r"^\s*#invoke\s*:(.*)$", name)
+    if m:
+      if len(args) < 2:
+        raise Unavailable("#invoke without function")
+      return self.invoke(canonicalize_name(m.group(1)), args[1].strip(),
+          template_args_dict(args[2:]))
+    name = canonicalize_name(re.sub("^\s*[Tt]emplate\s*:", "", name))
+    if name.startswith("#") or ":" in name:
+      raise Unavailable("parser function %s" % name)
+    for tempname, (modname, funcname) in wrapper_templates.iteritems():
+      if canonicalize_name(tempname) == name:
+        return self.invoke(canonicalize_name(modname), funcname, {},
+            "Template:" + name, template_args_dict(args[1:]))
+    raise Unavailable("Template:%s" % name)
+
+  def expand_template(self, title, args):
+    title = tostr(title)
+    argdict = dict((k, tostr(v)) for k, v in args.items())
+    return self.expand_call(u"|".join([title] +
+      ["%s=%s" % (k, v) for k, v in sorted(argdict.items())]))
+
+  # Preprocess TEXT, which must be plain text and template calls not
+  # containing other template calls, expanding the calls.
+  def preprocess(self, text):
+    text = tostr(text)
+    if re.search("<!--|<nowiki|<pre|<includeonly|<noinclude|<onlyinclude|\{\{\{|-\{|__", text):
+      raise Unavailable("wikitext markup")
+    parts = []
+    pos = 0
+    for m in re.finditer(r"\{\{(.*?)\}\}", text, re.S):
+      parts.append(text[pos:m.start()])
+      parts.append(self.expand_call(m.group(1)))
+      pos = m.end()
+    parts.append(text[pos:])
+    return u"".join(parts)
+
+  # Expand TEXT as if on page TITLE, as the expandtemplates API does. Return
+  # None if the text can't be expanded locally.
+  def expand(self, text, title):
+    self.title = tostr(title)
+    self.unavailable = None
+    try:
+      result = self.preprocess(text)
+    except Unavailable:
+      result = None
+    except lupa.LuaError as e:
+      # An error from a Lua pcall() of something unavailable still means
+      # the local result can't be trusted.
+      result = None if self.unavailable else self.error_text(e)
+    except Exception:
+      result = None
+    if self.unavailable:
+      result = None
+    if result is None:
+      self.server_expansions += 1
+    else:
+      self.local_expansions += 1
+    return result
@@ -574,24 +574,30 @@ def iter_pages_units(createfn, include_ten=False, skip_one=False):
       yield createfn(digval, dig)
 
 def do_pages(createfn, iterfn=iter_pages):
-  pages = iterfn(createfn)
-  for current, index in blib.iter_pages(pages, startFrom, upTo,
-      key=lambda x:x[0]):
-    pagename, text, changelog = current
-    pagetitle = remove_diacritics(pagename)
-    if params.offline:
-      msg("Text for %s: [[%s]]" % (pagename, text))
-      msg("Changelog = %s" % changelog)
-    else:
-      page = pywikibot.Page(site, pagetitle)
-      if page.exists():
-        msg("Page %s %s: WARNING, page already exists, skipping" % (
-          index, pagename))
+  def make_save_text(text, changelog):
+    def save_text(page, index, parsed):
+      return text, changelog
+    return save_text
+
+  def iter_pages_to_save():
+    pages = iterfn(createfn)
+    for current, index in blib.iter_pages(pages, startFrom, upTo,
+        key=lambda x:x[0]):
+      pagename, text, changelog = current
+      pagetitle = remove_diacritics(pagename)
+      if params.offline:
+        msg("Text for %s: [[%s]]" % (pagename, text))
+        msg("Changelog = %s" % changelog)
       else:
-        def save_text(page, index, parsed):
-          return text, changelog
-        blib.do_edit(page, index, save_text, save=params.save,
-            verbose=params.verbose)
+        page = pywikibot.Page(site, pagetitle)
+        if page.exists():
+          msg("Page %s %s: WARNING, page already exists, skipping" % (
+            index, pagename))
+        else:
+          yield page, index, make_save_text(text, changelog)
+
+  blib.do_edits(iter_pages_to_save(), save=params.save,
+      verbose=params.verbose)
 
 if params.lemmas:
   do_pages(create_lemma)
@@ -46,17 +46,30 @@
 # well as all the FROM templates (FOO, BAR and BAZ), since any of them may
 # occur as the FROM template in one of the lines to be processed.
 
-import re, codecs, argparse
+# The log may be compressed (.bz2 or .gz) or a tar archive of logs (e.g.
+# run-logs-10.tar.bz2), which are read one after another without being
+# extracted. With --processes, the log is split into chunks at page
+# boundaries, which are worked on in parallel; since everything done for a
+# page depends only on that page's lines, and output (including messages
+# about each page) is written out in the original order, the output is the
+# same as when working on the whole log in one process.
+
+import re, codecs, argparse, collections, itertools, multiprocessing, sys
 
 import blib
 from blib import msg
 
 pa = argparse.ArgumentParser(description="Parse log files from canon_arabic etc.")
-pa.add_argument("-f", "--file", help="Log file")
+pa.add_argument("-f", "--file",
+    help="Log file, possibly compressed, or tar archive of log files")
+pa.add_argument("--processes", type=int, default=1,
+    help="Number of processes to spread the work across (default 1)")
 pa.add_argument("start", nargs="?", help="First page to work on")
 pa.add_argument("end", nargs="?", help="Last page to work on")
 
-def yield_page_lines(fn):
+# Yield (INDEX, PAGENAME, PAGE_LINES) for each page in LINES, an iterator
+# over the lines of a log.
+def yield_page_lines(lines):
   index = None
   pagename = None
   page_lines = []
@@ -113,7 +126,7 @@ def yield_page_lines(fn):
     for i in xrange(frm+1, to):
       page_lines[i] = fix_page_line(page_lines[i])
 
-  for line in codecs.open(fn, "r", encoding="utf-8"):
+  for line in lines:
     line = line.strip()
     # Add a colon after Processing to match other lines
     m = re.match(r"^(Page [^{}]*: )Processing (\{\{.*?\}\})$", line)
@@ -191,18 +204,101 @@ def yield_page_lines(fn):
       fix_page_lines(last_replace_line, len(page_lines))
     yield index, pagename, page_lines
 
-def parse_log_file(fn, startFrom, upTo):
-  for current, index in blib.iter_pages(yield_page_lines(fn), startFrom, upTo,
-      key=lambda x:x[1]):
+# Iterate over the lines of the log (or logs) in FN, decoded the same way as
+# by codecs.open().
+def read_log_lines(fn):
+  for name, fp in blib.iter_log_files(fn):
+    for line in codecs.getreader("utf-8")(fp):
+      yield line
+
+# Return the lines to output for the lines LINES of the page with index
+# PAGEINDEX.
+def format_page_lines(pageindex, lines):
+  outlines = []
+  for line in lines:
+    m = re.match(r"^Page ([0-9/.-]+) (.*)$", line)
+    if m:
+      outlines.append("Page %s/%s %s" % (pageindex, m.group(1), m.group(2)))
+    else:
+      outlines.append(line)
+  return outlines
+
+# Number of lines after which to end a chunk (at the next page boundary) when
+# splitting a log for --processes.
+chunk_lines = 20000
+
+# Split LINES, an iterator over the lines of a log, into lists of lines
+# starting at page boundaries, i.e. at a "Page ..." line for a different
+# page than the "Page ..." line before it (as in yield_page_lines()).
+def split_log_lines(lines):
+  chunk = []
+  lastkey = None
+  for line in lines:
+    if len(chunk) >= chunk_lines:
+      m = re.match(r"^Page ([0-9/.-]+) (.*?): (.*)$", line.strip())
+      if m:
+        key = m.group(1), m.group(2)
+        if lastkey and key != lastkey:
+          yield chunk
+          chunk = []
+          lastkey = None
+        else:
+          lastkey = key
+    chunk.append(line)
+  if chunk:
+    yield chunk
+
+# Work on CHUNK, a list of lines starting at a page boundary, in a
+# subprocess. Return a list of (OUTPUT, (INDEX, PAGENAME, OUTLINES)) for each
+# page, where OUTPUT is the messages output while reading the page and
+# OUTLINES the lines to output for it.
+def parse_chunk(chunk):
+  pages = []
+  blib.msg_capture = []
+  for index, pagename, lines in yield_page_lines(chunk):
+    pages.append(("".join(blib.msg_capture),
+      (index, pagename, format_page_lines(index, lines))))
+    blib.msg_capture = []
+  blib.msg_capture = None
+  return pages
+
+# Yield (INDEX, PAGENAME, OUTLINES) for each page in the log FN, as for
+# yield_page_lines() but with OUTLINES being the lines to output for the
+# page. If PROCESSES > 1, split the log into chunks worked on by that many
+# processes, writing out the messages output for each page just before
+# yielding it, so the output is the same as when working in this process.
+def yield_page_output(fn, processes):
+  if processes <= 1:
+    for index, pagename, lines in yield_page_lines(read_log_lines(fn)):
+      yield index, pagename, format_page_lines(index, lines)
+    return
+  pool = multiprocessing.Pool(processes)
+  try:
+    # Keep a limited number of chunks in flight so that the whole log isn't
+    # read into memory.
+    pending = collections.deque()
+    chunks = split_log_lines(read_log_lines(fn))
+    while True:
+      for chunk in itertools.islice(chunks, 2 * processes - len(pending)):
+        pending.append(pool.apply_async(parse_chunk, (chunk,)))
+      if not pending:
+        break
+      for output, page in pending.popleft().get():
+        sys.stdout.write(output)
+        yield page
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+
+def parse_log_file(fn, startFrom, upTo, processes=1):
+  for current, index in blib.iter_pages(yield_page_output(fn, processes),
+      startFrom, upTo, key=lambda x:x[1]):
     pageindex, pagename, lines = current
     for line in lines:
-      m = re.match(r"^Page ([0-9/.-]+) (.*)$", line)
-      if m:
-        msg("Page %s/%s %s" % (pageindex, m.group(1), m.group(2)))
-      else:
-        msg(line)
+      msg(line)
 
 params = pa.parse_args()
 startFrom, upTo = blib.parse_start_end(params.start, params.end)
 
-parse_log_file(params.file, startFrom, upTo)
+parse_log_file(params.file, startFrom, upTo, params.processes)
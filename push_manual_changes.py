@@ -45,14 +45,12 @@ def push_manual_changes(save, verbose, direcfile, annotation, startFrom, upTo):
         template_changes.pop()
       template_changes.append(m.groups())
 
-  for current, index in blib.iter_pages(template_changes, startFrom, upTo,
-      # key is the page name
-      key = lambda x: x[0]):
-    pagename, repl_template, curr_template = current
-
+  # Return the function to do the change for one page, given the change
+  # read from DIRECFILE.
+  def make_push_one_manual_change(repl_template, curr_template):
     def push_one_manual_change(page, index, text):
       def pagemsg(txt):
-        msg("Page %s %s: %s" % (index, unicode(page.title()), txt))
+        blib.page_message(index, unicode(page.title()), txt)
       #template = blib.parse_text(template_text).filter_templates()[0]
       #orig_template = unicode(template)
       #if getparam(template, "sc") == "polytonic":
@@ -92,14 +90,22 @@ def push_manual_changes(save, verbose, direcfile, annotation, startFrom, upTo):
             annotation)
         pagemsg("Change log = %s" % changelog)
       return newtext, changelog
+    return push_one_manual_change
+
+  def iter_pages_to_change():
+    for current, index in blib.iter_pages(template_changes, startFrom, upTo,
+        # key is the page name
+        key = lambda x: x[0]):
+      pagename, repl_template, curr_template = current
+      page = pywikibot.Page(site, pagename)
+      if not page.exists():
+        msg("Page %s %s: WARNING, something wrong, does not exist" % (
+          index, pagename))
+      else:
+        yield page, index, make_push_one_manual_change(
+            repl_template, curr_template)
 
-    page = pywikibot.Page(site, pagename)
-    if not page.exists():
-      msg("Page %s %s: WARNING, something wrong, does not exist" % (
-        index, pagename))
-    else:
-      blib.do_edit(page, index, push_one_manual_change, save=save,
-          verbose=verbose)
+  blib.do_edits(iter_pages_to_change(), save=save, verbose=verbose)
 
 pa = blib.init_argparser("Push manual changes to Wiktionary")
 pa.add_argument("--file",
@@ -102,7 +102,7 @@ def remove_translit(params, startFrom, upTo):
   def remove_translit_one_page(page, index, text):
     pagetitle = page.title()
     def pagemsg(text):
-      msg("Page %s %s: %s" % (index, pagetitle, text))
+      blib.page_message(index, pagetitle, text)
 
     # Hack for grc pages where we don't want to remove the translit
     if u"Ͷ" in pagetitle or u"ͷ" in pagetitle:
@@ -349,10 +349,10 @@ def remove_translit(params, startFrom, upTo):
   for category in yield_cats():
     msg("Processing category %s ..." % category)
     errmsg("Processing category %s ..." % category)
-    for page, index in blib.cat_articles(category, startFrom, upTo):
-      if page.title() not in pages_to_ignore:
-        blib.do_edit(page, index, remove_translit_one_page, save=params.save,
-            verbose=params.verbose)
+    blib.do_edits(((page, index) for page, index in
+        blib.cat_articles(category, startFrom, upTo)
+        if page.title() not in pages_to_ignore),
+      remove_translit_one_page, save=params.save, verbose=params.verbose)
 
 pa = blib.init_argparser("Remove translit, sc= from hy, xcl, ka, el, grc templates")
 pa.add_argument("--langs", default="all",
@@ -30,8 +30,8 @@ import ar_translit
 def process_param(pagetitle, index, template, param, paramtr,
     include_tempname_in_changelog=False):
   def pagemsg(text):
-    msg("Page %s %s: %s.%s: %s" % (index, pagetitle, template.name, param,
-      text))
+    blib.page_message(index, pagetitle, text, tempname=unicode(template.name),
+        param=param)
   arabic = getparam(template, param)
   latin = getparam(template, paramtr)
   if include_tempname_in_changelog:
@@ -67,8 +67,9 @@ def process_param(pagetitle, index, template, param, paramtr,
         pagemsg("Removing redundant translit for %s (%s)" % (arabic, latin))
         oldtempl = "%s" % unicode(template)
         template.remove(paramtr)
-        msg("Page %s %s: Replaced %s with %s" %
-            (index, pagetitle, oldtempl, unicode(template)))
+        blib.page_message(index, pagetitle, "Replaced %s with %s" % (oldtempl,
+          unicode(template)), "replace", before=oldtempl,
+          after=unicode(template))
         return ["remove redundant %s=%s" % (paramtrname, latin)]
       else:
         pagemsg("Auto-translit for %s (%s) not same as manual translit %s (canonicalized %s)" %
@@ -78,8 +79,9 @@ def process_param(pagetitle, index, template, param, paramtr,
         pagemsg("Match-canonicalizing Latin %s to %s" % (latin, canonlatin))
         oldtempl = "%s" % unicode(template)
         addparam(template, paramtr, canonlatin)
-        msg("Page %s %s: Replaced %s with %s" %
-            (index, pagetitle, oldtempl, unicode(template)))
+        blib.page_message(index, pagetitle, "Replaced %s with %s" % (oldtempl,
+          unicode(template)), "replace", before=oldtempl,
+          after=unicode(template))
         return ["match-canon %s=%s -> %s" % (paramtrname, latin, canonlatin)]
       return True
     canonlatin, _ = ar_translit.canonicalize_latin_arabic(latin, None)
@@ -87,8 +89,9 @@ def process_param(pagetitle, index, template, param, paramtr,
       pagemsg("Self-canonicalizing Latin %s to %s" % (latin, canonlatin))
       oldtempl = "%s" % unicode(template)
       addparam(template, paramtr, canonlatin)
-      msg("Page %s %s: Replaced %s with %s" %
-          (index, pagetitle, oldtempl, unicode(template)))
+      blib.page_message(index, pagetitle, "Replaced %s with %s" % (oldtempl,
+        unicode(template)), "replace", before=oldtempl,
+        after=unicode(template))
       return ["self-canon %s=%s -> %s" % (paramtrname, latin, canonlatin)]
   return True
 
@@ -185,8 +188,8 @@ def process_headwords(save, verbose, startFrom, upTo):
   #for page in blib.references(u"Template:tracking/ar-head/head", startFrom, upTo):
   #for page in blib.references("Template:ar-nisba", startFrom, upTo):
   for cat in [u"Arabic lemmas", u"Arabic non-lemma forms"]:
-    for page, index in blib.cat_articles(cat, startFrom, upTo):
-      blib.do_edit(page, index, process_page, save=save, verbose=verbose)
+    blib.do_edits(blib.cat_articles(cat, startFrom, upTo),
+        process_page, save=save, verbose=verbose)
 
 # Remove translit params from link-like templates when the auto-translit
 # returns the same thing, or canonicalizing, on pages from STARTFROM to
@@ -199,12 +202,13 @@ def process_links(save, verbose, cattype, startFrom, upTo):
     result = process_param(pagetitle, index, template, param, paramtr,
         include_tempname_in_changelog=True)
     if getparam(template, "sc") == "Arab":
-      msg("Page %s %s: %s.%s: Removing sc=Arab" % (index, pagetitle,
-        template.name, "sc"))
+      blib.page_message(index, pagetitle, "Removing sc=Arab",
+          tempname=unicode(template.name), param="sc")
       oldtempl = "%s" % unicode(template)
       template.remove("sc")
-      msg("Page %s %s: Replaced %s with %s" %
-          (index, pagetitle, oldtempl, unicode(template)))
+      blib.page_message(index, pagetitle, "Replaced %s with %s" % (oldtempl,
+        unicode(template)), "replace", before=oldtempl,
+        after=unicode(template))
       newresult = ["remove %s.sc=Arab" % template.name]
       if isinstance(result, list):
         result = result + newresult
@@ -42,15 +42,18 @@ def rewrite_pages(refrom, reto, refs, cat, pages, pagefile, pagetitle_sub,
     pages = blib.references(refs, startFrom, upTo, includelinks=True)
   else:
     pages = blib.cat_articles(cat, startFrom, upTo)
-  for page, index in pages:
-    pagetitle = unicode(page.title())
-    if filter_pages and not re.search(filter_pages, pagetitle):
-      blib.msg("Skipping %s because doesn't match --filter-pages regex %s" %
-          (pagetitle, filter_pages))
-    else:
-      if verbose:
-        blib.msg("Processing %s" % pagetitle)
-      blib.do_edit(page, index, rewrite_one_page, save=save, verbose=verbose)
+  def filter_pages_to_do():
+    for page, index in pages:
+      pagetitle = unicode(page.title())
+      if filter_pages and not re.search(filter_pages, pagetitle):
+        blib.msg("Skipping %s because doesn't match --filter-pages regex %s" %
+            (pagetitle, filter_pages))
+      else:
+        if verbose:
+          blib.msg("Processing %s" % pagetitle)
+        yield page, index
+  blib.do_edits(filter_pages_to_do(), rewrite_one_page, save=save,
+      verbose=verbose)
 
 pa = blib.init_argparser("Search and replace on pages")
 pa.add_argument("-f", "--from", help="From regex, can be specified multiple times",
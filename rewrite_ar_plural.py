@@ -26,8 +26,8 @@ def rewrite_one_page_ar_plural(page, index, text):
 
 def rewrite_ar_plural(save, verbose, startFrom, upTo):
   for cat in [u"Arabic plurals"]:
-    for page, index in blib.cat_articles(cat, startFrom, upTo):
-      blib.do_edit(page, index, rewrite_one_page_ar_plural, save=save, verbose=verbose)
+    blib.do_edits(blib.cat_articles(cat, startFrom, upTo),
+        rewrite_one_page_ar_plural, save=save, verbose=verbose)
 
 pa = blib.init_argparser("Rewrite ar-plural to ar-noun-pl templates")
 params = pa.parse_args()
@@ -85,9 +85,8 @@ def rewrite_one_page_arz_headword(page, index, text):
 
 def rewrite_arz_headword(save, verbose, startFrom, upTo):
   for cat in [u"Egyptian Arabic adjectives", "Egyptian Arabic nouns"]:
-    for page, index in blib.cat_articles(cat, startFrom, upTo):
-      blib.do_edit(page, index, rewrite_one_page_arz_headword, save=save,
-          verbose=verbose)
+    blib.do_edits(blib.cat_articles(cat, startFrom, upTo),
+        rewrite_one_page_arz_headword, save=save, verbose=verbose)
 
 pa = blib.init_argparser("Rewrite Egyptian Arabic headword templates")
 params = pa.parse_args()
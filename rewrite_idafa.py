@@ -23,7 +23,7 @@ from arabiclib import arabic_decl_templates
 def rewrite_one_page_idafa(page, index, text):
   pagetitle = unicode(page.title())
   def pagemsg(txt):
-    msg("Page %s %s: %s" % (index, pagetitle, txt))
+    blib.page_message(index, pagetitle, txt)
   num_new_style = 0
   num_modhead_changed = 0
   num_state_ind_to_ind_def = 0
@@ -161,9 +161,8 @@ def rewrite_one_page_idafa(page, index, text):
 
 def rewrite_idafa(save, verbose, startFrom, upTo):
   for template in arabic_decl_templates:
-    for page, index in blib.references("Template:" + template, startFrom, upTo):
-      blib.do_edit(page, index, rewrite_one_page_idafa, save=save,
-          verbose=verbose)
+    blib.do_edits(blib.references("Template:" + template, startFrom, upTo),
+        rewrite_one_page_idafa, save=save, verbose=verbose)
 
 pa = blib.init_argparser(u"Rewrite ʾidāfa params with idafa= param, and related changes")
 params = pa.parse_args()
@@ -106,7 +106,7 @@ def rewrite_one_page_ru_decl_adj(page, index, text):
   oldtemps = []
   pagename = unicode(page.title())
   def pagemsg(txt):
-    msg("Page %s %s: %s" % (index, pagename, txt))
+    blib.page_message(index, pagename, txt)
   for t in text.filter_templates():
     converted = True
     def tname():
@@ -197,7 +197,7 @@ def rewrite_one_page_ru_decl_noun(page, index, text):
   oldtemps = []
   pagename = unicode(page.title())
   def pagemsg(txt):
-    msg("Page %s %s: %s" % (index, pagename, txt))
+    blib.page_message(index, pagename, txt)
   nochange = False
   change = False
   for t in text.filter_templates():
@@ -398,12 +398,12 @@ def rewrite_one_page_ru_decl_noun(page, index, text):
 
 def rewrite_ru_decl_noun(save, verbose, startFrom, upTo):
   for cat in [u"Russian nouns"]:
-    for page, index in blib.cat_articles(cat, startFrom, upTo):
-      blib.do_edit(page, index, rewrite_one_page_ru_decl_noun, save=save, verbose=verbose)
+    blib.do_edits(blib.cat_articles(cat, startFrom, upTo),
+        rewrite_one_page_ru_decl_noun, save=save, verbose=verbose)
 def rewrite_ru_decl_adj(save, verbose, startFrom, upTo):
   for cat in [u"Russian adjectives"]:
-    for page, index in blib.cat_articles(cat, startFrom, upTo):
-      blib.do_edit(page, index, rewrite_one_page_ru_decl_adj, save=save, verbose=verbose)
+    blib.do_edits(blib.cat_articles(cat, startFrom, upTo),
+        rewrite_one_page_ru_decl_adj, save=save, verbose=verbose)
 
 pa = blib.init_argparser("Rewrite Russian old declension templates")
 pa.add_argument("--adjectives", action='store_true',
@@ -32,9 +32,8 @@ def rewrite_template_names(old, new, removelist, save, verbose,
 
     return text, '; '.join(actions)
 
-  for page, index in blib.references("Template:%s" % old, startFrom, upTo):
-    blib.do_edit(page, index, rewrite_one_page_template_names, save=save,
-        verbose=verbose)
+  blib.do_edits(blib.references("Template:%s" % old, startFrom, upTo),
+      rewrite_one_page_template_names, save=save, verbose=verbose)
 
 pa = blib.init_argparser("Rewrite old to new template names")
 pa.add_argument("-o", "--old", help="Old name of template")
@@ -18,7 +18,9 @@
 import re
 import unicodedata
 
-from blib import remove_links, msg
+import translit_tables
+
+from blib import remove_links, msg, translit_memoized
 
 # FIXME:
 #
@@ -93,6 +95,7 @@ russian_vowels = u"АОУҮЫЭЯЁЮИЕЪЬІѢѴаоуүыэяёюиеъьі
 
 # Transliterates text, which should be a single word or phrase. It should
 # include stress marks, which are then preserved in the transliteration.
+@translit_memoized
 def tr(text, lang=None, sc=None, msgfun=msg):
     text = remove_links(text)
     text = tr_canonicalize_russian(text)
@@ -443,69 +446,18 @@ tt_to_russian_matching_all_char = dict(
         tt_to_russian_matching_3char.items() +
         tt_to_russian_matching_4char.items())
 
-build_canonicalize_latin = {}
-for ch in dont_self_canonicalize:
-    # "multiple" suppresses any self-canonicalization of this character
-    build_canonicalize_latin[ch] = "multiple"
-build_canonicalize_latin[""] = "multiple"
-
-# Make sure we don't canonicalize any canonical letter to any other one;
-# e.g. could happen with ʾ, an alternative for ʿ.
-for russian, alts in tt_to_russian_matching_all_char.items():
-    if not isinstance(alts, list):
-        alts = [alts]
-    canon = alts[0]
-    if isinstance(canon, list):
-        canon = canon[0]
-    if isinstance(canon, tuple):
-        continue
-    # "multiple" suppresses any self-canonicalization of this character
-    build_canonicalize_latin[canon] = "multiple"
-    # For from->to canonicalization, suppress self-canonicalzation of
-    # the 'to' character, because it's a possible canonical char
-    for canon in alts[1:]:
-        if isinstance(canon, list) and len(canon) == 2:
-            build_canonicalize_latin[canon[1]] = "multiple"
-
-# Now build a table along the way to constructing the self-canonicalizing
-# table. We make from->to entries for all non-canonical chars; if we
-# encounter an existing from->to entry with a different 'to', we set the
-# value to "multiple", which suppresses any self-canonicalization of the
-# character.
-for russian, alts in tt_to_russian_matching_all_char.items():
-    if not isinstance(alts, list):
-        alts = [alts]
-    canon = alts[0]
-    if isinstance(canon, list):
-        continue
-    for alt in alts[1:]:
-        frm = alt
-        to = canon
-        if isinstance(frm, list):
-            if len(frm) == 1:
-                continue
-            assert len(frm) == 2 or len(frm) == 3
-            to = frm[1]
-            frm = frm[0]
-        if isinstance(frm, tuple):
-            continue
-        if frm in build_canonicalize_latin and build_canonicalize_latin[frm] != to:
-            if debug_tables:
-                msg("Setting bcl of %s to multiple" % frm)
-            build_canonicalize_latin[frm] = "multiple"
-        else:
-            if debug_tables:
-                msg("Setting bcl of %s to %s" % (frm, to))
-            build_canonicalize_latin[frm] = to
-
-# Now build the actual self-canonicalizing table, derived from the
-# previous table minus any entries with the value 'multiple'.
+# Compile the matching tables into the trie used by tr_matching() and build
+# the self-canonicalizing tables from them (see translit_tables.py).
+# build_canonicalize_latin maps non-canonical Latin chars to canonical ones,
+# or to "multiple", which suppresses any self-canonicalization of the
+# character; tt_canonicalize_latin is the same minus the "multiple" entries.
 # NOTE: Multiple-character 'from' entries on this table have no effect
 # since the self-canonicalizing algorithm goes character-by-character.
-tt_canonicalize_latin = {}
-for frm, to in build_canonicalize_latin.items():
-    if to != "multiple":
-        tt_canonicalize_latin[frm] = to
+compiled_tables = translit_tables.compile_tables("ru_translit",
+        tt_to_russian_matching_all_char, dont_self_canonicalize,
+        debug_tables and msg or None)
+build_canonicalize_latin = compiled_tables.build_canonicalize_latin
+tt_canonicalize_latin = compiled_tables.tt_canonicalize_latin
 
 if debug_tables:
     for x,y in build_canonicalize_latin.items():
@@ -644,6 +596,7 @@ def post_canonicalize_latin(text, msgfun=msg):
 # is more reliable when both aare provided. This is less reliable than
 # tr_matching() and is meant when that fails. Return value is a tuple of
 # (CANONLATIN, CANONARABIC).
+@translit_memoized
 def canonicalize_latin_russian(latin, russian, msgfun=msg):
     if russian is not None:
         russian = pre_pre_canonicalize_russian(russian, msgfun)
@@ -658,7 +611,7 @@ def canonicalize_latin_russian(latin, russian, msgfun=msg):
         def quote_subst(m):
             return m.group(0).replace("'", multi_single_quote_subst)
         latin = re.sub(r"''+", quote_subst, latin)
-        latin = rsub(latin, u".", tt_canonicalize_latin)
+        latin = unicode(latin).translate(compiled_tables.canonicalize_latin)
         latin = latin.replace(multi_single_quote_subst, "'")
         latin = post_canonicalize_latin(latin, msgfun)
     return (latin, russian)
@@ -728,6 +681,7 @@ def debprint(x):
 # appropriate, so that ambiguities of Latin transliteration can be
 # correctly handled. Returns a tuple of Russian, Latin. If unable to match,
 # throw an error if ERR, else return None.
+@translit_memoized
 def tr_matching(russian, latin, err=False, msgfun=msg):
     origrussian = russian
     origlatin = latin
@@ -787,42 +741,15 @@ def tr_matching(russian, latin, err=False, msgfun=msg):
             pos = rind[0]
         return pos == rlen - 1 or ru[pos + 1] in [u" ", u"]", u"|", u"-"]
 
-    def get_matches_nchar(numchar):
-        assert numchar >= 2 and numchar <= 4
-        assert rind[0] + numchar <= rlen
-        ac = "".join(ru[rind[0]:rind[0]+numchar])
-        debprint("get_matches_%schar: ac (%schar) is %s" % (
-            numchar, numchar, ac))
-        if numchar == 4:
-            matches = tt_to_russian_matching_4char.get(ac)
-        elif numchar == 3:
-            matches = tt_to_russian_matching_3char.get(ac)
-        elif numchar == 2:
-            matches = tt_to_russian_matching_2char.get(ac)
-        debprint("get_matches_%schar: matches is %s" % (numchar, matches))
-        if matches == None:
-            matches = []
-        elif type(matches) is not list:
-            matches = [matches]
-        return ac, matches
-
+    # Return a list of (NUMCHAR, MATCHES) for the Russian sequences in the
+    # matching tables starting at the current Russian character, longest
+    # first, where MATCHES is the compiled list of alternatives (see
+    # translit_tables.MatchingTable).
     def get_matches():
         assert rind[0] < rlen
-        ac = ru[rind[0]]
-        debprint("get_matches: ac is %s" % ac)
-        matches = tt_to_russian_matching.get(ac)
-        if matches == None and ac in unmatch_either_after:
-            matches = []
-        debprint("get_matches: matches is %s" % matches)
-        if matches == None:
-            if True:
-                error("Encountered non-Russian (?) character " + ac +
-                    " at index " + str(rind[0]))
-            else:
-                matches = [ac]
-        if type(matches) is not list:
-            matches = [matches]
-        return ac, matches
+        found = compiled_tables.matching.lookup(russian, rind[0])
+        debprint("get_matches: found is %s" % found)
+        return found
 
     # Check for link of the form [[foo|bar]] and skip over the part
     # up through the vertical bar, copying it
@@ -841,75 +768,37 @@ def tr_matching(russian, latin, err=False, msgfun=msg):
                 newpos += 1
         return False
 
-    # attempt to match the current Russian character (or multi-char sequence,
-    # if NUMCHAR > 1) against the current Latin character(s). If no match,
+    # attempt to match the current Russian character or multi-char sequence
+    # (longest first) against the current Latin character(s). If no match,
     # return False; else, increment the Russian and Latin pointers over
     # the matched characters, add the Russian character(s) and the
     # corresponding match-canonical Latin character(s) to the result lists
     # and return True.
-    def match(numchar):
-        if rind[0] + numchar > rlen:
+    def match():
+        if rind[0] >= rlen:
             return False
 
-        if numchar > 1:
-            ac, matches = get_matches_nchar(numchar)
-        else:
-            ac, matches = get_matches()
-
         debprint("match: lind=%s, la=%s" % (
             lind[0], lind[0] >= llen and "EOF" or la[lind[0]]))
 
-        for m in matches:
-            subst = matches[0]
-            if type(subst) is list:
-                subst = subst[0]
-            if type(subst) is tuple:
-                subst = subst[0]
-            substrussian = ac
-            preserve_latin = False
-            # If an element of the match list is a one-element list, it means
-            # "don't canonicalize". If a two-element list, it means
-            # "canonicalize from m[0] to m[1]".
-            if type(m) is list:
-                if len(m) == 1:
-                    preserve_latin = True
-                    m = m[0]
-                elif len(m) == 2:
-                    m, subst = m
-                else:
-                    assert len(m) == 3
-                    m, subst, substrussian = m
-            assert isinstance(subst, basestring)
-            assert isinstance(substrussian, basestring)
-            # A one-element tuple is a signal for use in self-canonicalization,
-            # not here.
-            if type(m) is tuple:
-                m = m[0]
-            assert isinstance(m, basestring)
-            l = lind[0]
-            matched = True
-            debprint("m: %s, subst: %s" % (m, subst))
-            for cp in m:
-                if l < llen and la[l] == cp:
-                    debprint("cp: %s, l=%s, la=%s" % (cp, l, la[l]))
-                    l = l + 1
-                else:
-                    debprint("cp: %s, unmatched")
-                    matched = False
-                    break
-            if matched:
-                for c in substrussian:
-                    res.append(c)
-                if preserve_latin:
-                    for cp in m:
-                        lres.append(cp)
-                else:
-                    for cp in subst:
-                        lres.append(cp)
-                lind[0] = l
-                rind[0] = rind[0] + len(ac)
-                debprint("matched; lind is %s" % lind[0])
-                return True
+        found = get_matches()
+        for numchar, (matches, _) in found:
+            for m, subst, substrussian in matches:
+                debprint("m: %s, subst: %s" % (m, subst))
+                if latin.startswith(m, lind[0]):
+                    if substrussian is None:
+                        substrussian = russian[rind[0]:rind[0]+numchar]
+                    res.append(substrussian)
+                    lres.append(subst)
+                    lind[0] += len(m)
+                    rind[0] += numchar
+                    debprint("matched; lind is %s" % lind[0])
+                    return True
+        if not found or found[-1][0] != 1:
+            ac = ru[rind[0]]
+            if ac not in unmatch_either_after:
+                error("Encountered non-Russian (?) character " + ac +
+                    " at index " + str(rind[0]))
         return False
 
     def cant_match():
@@ -991,17 +880,8 @@ def tr_matching(russian, latin, err=False, msgfun=msg):
         elif skip_vertical_bar_link():
             debprint("Matched: skip_vertical_bar_link()")
             matched = True
-        elif match(4):
-            debprint("Matched: Clause match(4)")
-            matched = True
-        elif match(3):
-            debprint("Matched: Clause match(3)")
-            matched = True
-        elif match(2):
-            debprint("Matched: Clause match(2)")
-            matched = True
-        elif match(1):
-            debprint("Matched: Clause match(1)")
+        elif match():
+            debprint("Matched: Clause match()")
             matched = True
         # Check for matching or unmatching punctuation. We do this afterwards
         # to deal with cases where the Russian has a right bracket,
@@ -1022,6 +902,7 @@ def tr_matching(russian, latin, err=False, msgfun=msg):
     latin = post_canonicalize_latin(latin, msgfun)
     return russian, latin
 
+@translit_memoized
 def remove_diacritics(text):
     text = text.replace(AC, "")
     text = text.replace(GR, "")
@@ -26,7 +26,7 @@ def split_one_page_etymologies(page, index, pagetext, verbose):
   pagename = page.title()
   pagetext = unicode(pagetext)
   def pagemsg(text):
-    msg("Page %s %s: %s" % (index, pagename, text))
+    blib.page_message(index, pagename, text)
 
   comment = None
   notes = []
@@ -239,9 +239,8 @@ def split_one_page_etymologies(page, index, pagetext, verbose):
 def split_etymologies(save, verbose, startFrom, upTo):
   def split_page_etymologies(page, index, pagetext):
     return split_one_page_etymologies(page, index, pagetext, verbose)
-  for page, index in blib.cat_articles("Arabic lemmas", startFrom, upTo):
-    blib.do_edit(page, index, split_page_etymologies, save=save,
-        verbose=verbose)
+  blib.do_edits(blib.cat_articles("Arabic lemmas", startFrom, upTo),
+      split_page_etymologies, save=save, verbose=verbose)
 
 pa = blib.init_argparser("Split etymology sections")
 params = pa.parse_args()
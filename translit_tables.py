@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    translit_tables.py is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compile the declarative matching tables of the translit modules
+# (tt_to_russian_matching_all_char in ru_translit.py, tt_to_greek_matching
+# in grc_translit.py) into the form their tr_matching() uses, and derive
+# the self-canonicalization tables from them. If the environment variable
+# TRANSLIT_TABLE_CACHE names a directory, the compiled tables are pickled
+# there and loaded by later imports as long as the source tables haven't
+# changed.
+
+import os, cPickle, hashlib
+
+# Bump when the compiled form changes, to invalidate pickled tables.
+compiled_version = 1
+
+# Compiled matching table. The entries of the source table map a foreign
+# string (usually one character, but possibly several) to a list of the
+# Latin strings that may correspond to it (or a single string, equivalent
+# to a one-entry list). The first element is the canonical Latin. An
+# element may be a one-element tuple, which matches like a plain string
+# but is ignored when building the self-canonicalization table; a
+# one-element list, meaning don't canonicalize the Latin; a two-element
+# list [LATIN, CANON] meaning canonicalize LATIN to CANON rather than to
+# the first element; or a three-element list [LATIN, CANON, FOREIGN],
+# which also replaces the foreign string with FOREIGN.
+#
+# The keys are compiled into a trie, so that the entries matching at a
+# given position, longest first, are found in one walk along the text;
+# each entry is compiled into a list of alternatives (LATIN, LATINOUT,
+# FOREIGNOUT) giving the Latin to match, the Latin to output and the
+# foreign text to output (None for the text matched).
+class MatchingTable(object):
+    def __init__(self, table):
+        # Each node maps a character to a list [ENTRY, CHILDREN], where
+        # ENTRY is the compiled entry for the key ending there (or None)
+        # and CHILDREN is the node for the next character.
+        self.trie = {}
+        for key, alts in table.items():
+            node = self.trie
+            for ch in key[:-1]:
+                node = node.setdefault(ch, [None, {}])[1]
+            node.setdefault(key[-1], [None, {}])[0] = self.compile_entry(alts)
+
+    # Compile the list of alternatives ALTS for one foreign string into a
+    # tuple (ALTS, NONBLANK), where NONBLANK is ALTS without the plain
+    # empty-string alternatives (unless the first is one), for when a Latin
+    # character that can be unmatched comes next (see grc_translit).
+    @staticmethod
+    def compile_entry(alts):
+        if type(alts) is not list:
+            alts = [alts]
+        canon = alts[0]
+        if type(canon) is list:
+            canon = canon[0]
+        if type(canon) is tuple:
+            canon = canon[0]
+        compiled = []
+        nonblank = []
+        for m in alts:
+            subst = canon
+            substforeign = None
+            preserve_latin = False
+            blank = m == u""
+            if type(m) is list:
+                if len(m) == 1:
+                    preserve_latin = True
+                    m = m[0]
+                elif len(m) == 2:
+                    m, subst = m
+                else:
+                    assert len(m) == 3
+                    m, subst, substforeign = m
+            if type(m) is tuple:
+                m = m[0]
+            assert isinstance(m, basestring)
+            assert isinstance(subst, basestring)
+            if preserve_latin:
+                subst = m
+            alt = (m, subst, substforeign)
+            compiled.append(alt)
+            if not blank or not alts[0]:
+                nonblank.append(alt)
+        return compiled, nonblank
+
+    # Return a list of (LENGTH, ENTRY) for the keys matching TEXT at POS,
+    # longest first, where ENTRY is as returned by compile_entry().
+    def lookup(self, text, pos):
+        found = []
+        node = self.trie
+        end = pos
+        while end < len(text):
+            child = node.get(text[end])
+            if not child:
+                break
+            end += 1
+            if child[0]:
+                found.append((end - pos, child[0]))
+            node = child[1]
+        found.reverse()
+        return found
+
+    # Return the entry (as returned by compile_entry()) for the
+    # single-character key CH, or None.
+    def get(self, ch):
+        child = self.trie.get(ch)
+        return child and child[0]
+
+# Build the table from which self-canonicalization is derived, from TABLE, a
+# matching table as for MatchingTable. It maps each non-canonical Latin
+# string to its canonical form, or to "multiple" if it's canonical for some
+# foreign string or non-canonical for several with different canonical
+# forms, which suppresses any self-canonicalization of it. The same is done
+# for the strings in DONT_SELF_CANONICALIZE. DEBUGFUN, if given, is called
+# with a message for each entry set.
+def build_canonicalize_latin(table, dont_self_canonicalize, debugfun=None):
+    bcl = {}
+    for ch in dont_self_canonicalize:
+        bcl[ch] = "multiple"
+    bcl[""] = "multiple"
+
+    # Make sure we don't canonicalize any canonical letter to any other one;
+    # e.g. could happen with ʾ, an alternative for ʿ.
+    for foreign, alts in table.items():
+        if not isinstance(alts, list):
+            alts = [alts]
+        canon = alts[0]
+        if isinstance(canon, list):
+            canon = canon[0]
+        if isinstance(canon, tuple):
+            continue
+        bcl[canon] = "multiple"
+        # For from->to canonicalization, suppress self-canonicalzation of
+        # the 'to' character, because it's a possible canonical char
+        for canon in alts[1:]:
+            if isinstance(canon, list) and len(canon) == 2:
+                bcl[canon[1]] = "multiple"
+
+    # Now make from->to entries for all non-canonical chars; if we
+    # encounter an existing from->to entry with a different 'to', we set the
+    # value to "multiple".
+    for foreign, alts in table.items():
+        if not isinstance(alts, list):
+            alts = [alts]
+        canon = alts[0]
+        if isinstance(canon, list):
+            continue
+        for alt in alts[1:]:
+            frm = alt
+            to = canon
+            if isinstance(frm, list):
+                if len(frm) == 1:
+                    continue
+                assert len(frm) == 2 or len(frm) == 3
+                to = frm[1]
+                frm = frm[0]
+            if isinstance(frm, tuple):
+                continue
+            if frm in bcl and bcl[frm] != to:
+                if debugfun:
+                    debugfun("Setting bcl of %s to multiple" % frm)
+                bcl[frm] = "multiple"
+            else:
+                if debugfun:
+                    debugfun("Setting bcl of %s to %s" % (frm, to))
+                bcl[frm] = to
+    return bcl
+
+# The compiled tables for a translit module: MATCHING, the MatchingTable;
+# BUILD_CANONICALIZE_LATIN, as returned by build_canonicalize_latin();
+# TT_CANONICALIZE_LATIN, the same minus the "multiple" entries; and
+# CANONICALIZE_LATIN, a table for unicode.translate() that does the
+# self-canonicalization character by character (multi-character entries
+# have no effect, and newlines are left alone, as when doing it with
+# rsub(text, u".", tt_canonicalize_latin)).
+class TranslitTables(object):
+    def __init__(self, matching, dont_self_canonicalize, debugfun=None):
+        self.matching = MatchingTable(matching)
+        self.build_canonicalize_latin = build_canonicalize_latin(matching,
+                dont_self_canonicalize, debugfun)
+        self.tt_canonicalize_latin = {}
+        self.canonicalize_latin = {}
+        for frm, to in self.build_canonicalize_latin.items():
+            if to != "multiple":
+                self.tt_canonicalize_latin[frm] = to
+                if len(frm) == 1 and frm != u"\n":
+                    self.canonicalize_latin[ord(frm)] = unicode(to)
+
+# Compile the tables for the translit module NAME from its matching table
+# MATCHING and the characters it never self-canonicalizes,
+# DONT_SELF_CANONICALIZE, returning a TranslitTables. If TRANSLIT_TABLE_CACHE
+# is set, load them from the pickle there if it was made from the same
+# source tables, else compile them and save the pickle.
+def compile_tables(name, matching, dont_self_canonicalize, debugfun=None):
+    cache_dir = os.environ.get("TRANSLIT_TABLE_CACHE")
+    if not cache_dir:
+        return TranslitTables(matching, dont_self_canonicalize, debugfun)
+    digest = hashlib.sha1(repr((compiled_version, sorted(matching.items()),
+        dont_self_canonicalize))).hexdigest()
+    filename = os.path.join(cache_dir, "%s.tables.pickle" % name)
+    if os.path.exists(filename):
+        try:
+            with open(filename, "rb") as fp:
+                cached_digest, tables = cPickle.load(fp)
+            if cached_digest == digest:
+                return tables
+        except Exception:
+            pass
+    tables = TranslitTables(matching, dont_self_canonicalize, debugfun)
+    # Write to a temporary file and rename, so that processes importing at
+    # the same time never see a partly written pickle.
+    tmpname = "%s.%s" % (filename, os.getpid())
+    with open(tmpname, "wb") as fp:
+        cPickle.dump((digest, tables), fp, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmpname, filename)
+    return tables
@@ -32,14 +32,12 @@ def undo_greek_removal(save, verbose, direcfile, startFrom, upTo):
     else:
       template_removals.append(m.groups())
 
-  for current, index in blib.iter_pages(template_removals, startFrom, upTo,
-      # key is the page name
-      key = lambda x: x[0]):
-    pagename, removed_param, template_text = current
-
+  # Return the function to do the change for one page, given the change
+  # read from DIRECFILE.
+  def make_undo_one_page_greek_removal(removed_param, template_text):
     def undo_one_page_greek_removal(page, index, text):
       def pagemsg(txt):
-        msg("Page %s %s: %s" % (index, unicode(page.title()), txt))
+        blib.page_message(index, unicode(page.title()), txt)
       template = blib.parse_text(template_text).filter_templates()[0]
       orig_template = unicode(template)
       if getparam(template, "sc") == "polytonic":
@@ -69,14 +67,22 @@ def undo_greek_removal(save, verbose, direcfile, startFrom, upTo):
             param_value, to_template)
         pagemsg("Change log = %s" % changelog)
       return newtext, changelog
+    return undo_one_page_greek_removal
 
-    page = pywikibot.Page(site, pagename)
-    if not page.exists():
-      msg("Page %s %s: WARNING, something wrong, does not exist" % (
-        index, pagename))
-    else:
-      blib.do_edit(page, index, undo_one_page_greek_removal, save=save,
-          verbose=verbose)
+  def iter_pages_to_change():
+    for current, index in blib.iter_pages(template_removals, startFrom, upTo,
+        # key is the page name
+        key = lambda x: x[0]):
+      pagename, removed_param, template_text = current
+      page = pywikibot.Page(site, pagename)
+      if not page.exists():
+        msg("Page %s %s: WARNING, something wrong, does not exist" % (
+          index, pagename))
+      else:
+        yield page, index, make_undo_one_page_greek_removal(
+            removed_param, template_text)
+
+  blib.do_edits(iter_pages_to_change(), save=save, verbose=verbose)
 
 pa = blib.init_argparser("Undo Greek transliteration removal")
 pa.add_argument("--file",
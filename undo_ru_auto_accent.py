@@ -37,15 +37,12 @@ def undo_ru_auto_accent(save, verbose, direcfile, startFrom, upTo):
     else:
       template_removals.append(m.groups())
 
-  for current, index in blib.iter_pages(template_removals, startFrom, upTo,
-      # key is the page name
-      key = lambda x: x[0]):
-    pagename, orig_template, repl_template = current
-    if not re.search(r"^\{\{(ux|usex|ru-ux|lang)\|", orig_template):
-      continue
+  # Return the function to do the change for one page, given the change
+  # read from DIRECFILE.
+  def make_undo_one_page_ru_auto_accent(orig_template, repl_template):
     def undo_one_page_ru_auto_accent(page, index, text):
-      def pagemsg(txt):
-        msg("Page %s %s: %s" % (index, unicode(page.title()), txt))
+      def pagemsg(txt, action=None, **fields):
+        blib.page_message(index, unicode(page.title()), txt, action, **fields)
       text = unicode(text)
       if not re.search("^#\*:* *%s" % re.escape(repl_template), text, re.M):
         return None, ""
@@ -59,7 +56,8 @@ def undo_ru_auto_accent(save, verbose, direcfile, startFrom, upTo):
         else:
           pagemsg("Original template found, taking no action")
       else:
-        pagemsg("Replaced %s with %s" % (repl_template, orig_template))
+        pagemsg("Replaced %s with %s" % (repl_template, orig_template),
+            "replace", before=repl_template, after=orig_template)
         if found_orig_template:
           pagemsg("WARNING: Undid replacement, but original template %s already present!" %
               orig_template)
@@ -69,14 +67,24 @@ def undo_ru_auto_accent(save, verbose, direcfile, startFrom, upTo):
         changelog = "Undid auto-accenting (per Wikitiki89) of %s" % (orig_template)
         pagemsg("Change log = %s" % changelog)
       return newtext, changelog
+    return undo_one_page_ru_auto_accent
 
-    page = pywikibot.Page(site, pagename)
-    if not page.exists():
-      msg("Page %s %s: WARNING, something wrong, does not exist" % (
-        index, pagename))
-    else:
-      blib.do_edit(page, index, undo_one_page_ru_auto_accent, save=save,
-          verbose=verbose)
+  def iter_pages_to_change():
+    for current, index in blib.iter_pages(template_removals, startFrom, upTo,
+        # key is the page name
+        key = lambda x: x[0]):
+      pagename, orig_template, repl_template = current
+      if not re.search(r"^\{\{(ux|usex|ru-ux|lang)\|", orig_template):
+        continue
+      page = pywikibot.Page(site, pagename)
+      if not page.exists():
+        msg("Page %s %s: WARNING, something wrong, does not exist" % (
+          index, pagename))
+      else:
+        yield page, index, make_undo_one_page_ru_auto_accent(
+            orig_template, repl_template)
+
+  blib.do_edits(iter_pages_to_change(), save=save, verbose=verbose)
 
 pa = blib.init_argparser("Undo auto-accent changes involving ux, usex and lang templates that look like direct quotes")
 pa.add_argument("--file",
@@ -17,7 +17,7 @@
 import re
 
 import blib, pywikibot
-from blib import msg, getparam, addparam
+from blib import getparam, addparam
 
 import arabiclib
 import ar_translit
@@ -29,8 +29,8 @@ import ar_translit
 # only in status messages.
 def do_vocalize_param(pagetitle, index, template, param, arabic, latin):
   def pagemsg(text):
-    msg("Page %s %s: %s.%s: %s" % (index, pagetitle, template.name, param,
-      text))
+    blib.page_message(index, pagetitle, text, tempname=unicode(template.name),
+        param=param)
   try:
     vocalized, _ = ar_translit.tr_matching(arabic, latin, True, pagemsg)
   except Exception as e:
@@ -60,8 +60,9 @@ def vocalize_param(pagetitle, index, template, param, paramtr):
     if vocalized:
       oldtempl = "%s" % unicode(template)
       addparam(template, param, vocalized)
-      msg("Page %s %s: Replaced %s with %s" % (index, pagetitle,
-        oldtempl, unicode(template)))
+      blib.page_message(index, pagetitle, "Replaced %s with %s" % (oldtempl,
+        unicode(template)), "replace", before=oldtempl,
+        after=unicode(template))
       return vocalized
   return True
 
@@ -137,8 +138,9 @@ def vocalize_head(pagetitle, index, template):
           else:
             addparam(template, "1", vocalized, before="tr")
           paramschanged.append("1")
-          msg("Page %s %s: Replaced %s with %s" % (index, pagetitle,
-            oldtempl, unicode(template)))
+          blib.page_message(index, pagetitle, "Replaced %s with %s" % (
+            oldtempl, unicode(template)), "replace", before=oldtempl,
+            after=unicode(template))
 
   # Check and try to vocalize extra heads
   i = 2
@@ -171,7 +173,7 @@ def vocalize_one_page_headwords(pagetitle, index, text):
         actions_taken.append("%s (%s)" % (', '.join(paramschanged), tempname))
   changelog = "vocalize parameters: %s" % '; '.join(actions_taken)
   #if len(actions_taken) > 0:
-  msg("Page %s %s: Change log = %s" % (index, pagetitle, changelog))
+  blib.page_message(index, pagetitle, "Change log = %s" % changelog)
   return text, changelog
 
 # Vocalize headword templates on pages from STARTFROM to (but not including)
@@ -183,8 +185,8 @@ def vocalize_headwords(save, verbose, startFrom, upTo):
   #for page in blib.references(u"Template:tracking/ar-head/head", startFrom, upTo):
   #for page in blib.references("Template:ar-nisba", startFrom, upTo):
   for cat in [u"Arabic lemmas", u"Arabic non-lemma forms"]:
-    for page, index in blib.cat_articles(cat, startFrom, upTo):
-      blib.do_edit(page, index, process_page, save=save, verbose=verbose)
+    blib.do_edits(blib.cat_articles(cat, startFrom, upTo),
+        process_page, save=save, verbose=verbose)
 
 # Vocalize link-like templates on pages from STARTFROM to (but not including)
 # UPTO, either page names or 0-based integers. Save changes if SAVE is true.